@@ -1,4 +1,5 @@
 import os
+import click
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
@@ -57,6 +58,8 @@ def create_app(config_name=None):
 
     # Register CLI commands
     register_seed_commands(app)
+    register_vector_commands(app)
+    register_analytics_commands(app)
 
     return app
 
@@ -87,3 +90,101 @@ def register_seed_commands(app):
         """Crear categorias por defecto."""
         from app.seeds.seed_categories import seed_categories
         seed_categories()
+
+
+def register_vector_commands(app):
+    @app.cli.group()
+    def vectors():
+        """Mantenimiento del almacenamiento de embeddings."""
+        pass
+
+    @vectors.command()
+    def status():
+        """Mostrar modo de almacenamiento y tamanos."""
+        from app.rag.maintenance import get_vector_storage_stats
+        stats = get_vector_storage_stats()
+        for key, value in stats.items():
+            print(f"{key}: {value}")
+
+    @vectors.command('migrate-halfvec')
+    @click.option('--batch-size', default=5000, show_default=True, help='Filas por lote de backfill.')
+    @click.option('--drop-float32', is_flag=True, help='Eliminar indice y datos float32 al terminar.')
+    def migrate_halfvec(batch_size, drop_float32):
+        """Migrar embeddings a halfvec sin detener las busquedas."""
+        from app.rag.maintenance import migrate_to_halfvec
+        migrate_to_halfvec(batch_size=batch_size, drop_float32=drop_float32)
+
+    @vectors.command('backfill-bits')
+    @click.option('--batch-size', default=5000, show_default=True, help='Filas por lote de backfill.')
+    def backfill_bits(batch_size):
+        """Calcular firmas binarias para el modo de busqueda binary."""
+        from app.rag.maintenance import backfill_binary_signatures
+        backfill_binary_signatures(batch_size=batch_size)
+
+    @vectors.command('backfill-summaries')
+    @click.option('--batch-size', default=5000, show_default=True, help='Filas por lote de backfill.')
+    def backfill_summaries(batch_size):
+        """Calcular vectores reducidos de los resumenes (Stage 1)."""
+        from app.rag.maintenance import backfill_summary_vectors
+        backfill_summary_vectors(batch_size=batch_size)
+
+    @vectors.command('gc')
+    @click.option('--batch-size', default=5000, show_default=True, help='Filas por lote.')
+    def gc(batch_size):
+        """Eliminar chunks de generaciones inactivas (reprocesos)."""
+        from app.rag.maintenance import gc_chunk_generations
+        gc_chunk_generations(batch_size=batch_size)
+
+    @vectors.command('ann-snapshot')
+    @click.option('--nlist', default=None, type=int, help='Listas IVF (por defecto ~sqrt(chunks)).')
+    @click.option('--keep-log-hours', default=24, show_default=True, help='Horas de log de cambios a conservar.')
+    def ann_snapshot(nlist, keep_log_hours):
+        """Exportar el snapshot de la replica ANN en proceso."""
+        from flask import current_app
+        from app.rag.ann_replica import build_snapshot
+        build_snapshot(current_app.config['RAG_ANN_SNAPSHOT_DIR'], nlist=nlist,
+                       keep_log_hours=keep_log_hours)
+
+    @vectors.command('ann-prune-log')
+    @click.option('--keep-hours', default=1, show_default=True, help='Horas de log de cambios a conservar.')
+    def ann_prune_log(keep_hours):
+        """Recortar el log de cambios de la replica ANN (programar con cron)."""
+        from app.rag.ann_replica import prune_change_log
+        prune_change_log(keep_hours=keep_hours)
+
+    @vectors.command('ann-check')
+    @click.option('--queries', default=50, show_default=True, help='Consultas de muestra.')
+    @click.option('--top-k', default=10, show_default=True)
+    def ann_check(queries, top_k):
+        """Verificar consistencia y latencia de la replica ANN frente a SQL."""
+        from app.rag.ann_replica import check_replica
+        check_replica(queries=queries, top_k=top_k)
+
+
+def register_analytics_commands(app):
+    @app.cli.group()
+    def analytics():
+        """Mantenimiento de los rollups de uso (agregados continuos)."""
+        pass
+
+    @analytics.command('refresh-rollups')
+    @click.option('--days', default=None, type=int, help='Dias hacia atras a materializar (por defecto todo).')
+    def refresh_rollups(days):
+        """Materializar usage_hourly y usage_daily (p.ej. tras cargar el historial)."""
+        from app.db import get_conn_raw, put_conn_raw
+        conn = get_conn_raw()
+        conn.autocommit = True     # refresh_continuous_aggregate no admite bloques de transaccion
+        try:
+            with conn.cursor() as cur:
+                for view in ('usage_hourly', 'usage_daily'):
+                    if days is None:
+                        cur.execute("CALL refresh_continuous_aggregate(%s, NULL, NULL)", (view,))
+                    else:
+                        cur.execute(
+                            "CALL refresh_continuous_aggregate(%s, NOW() - make_interval(days => %s), NULL)",
+                            (view, days),
+                        )
+                    print(f"{view}: materializado")
+        finally:
+            conn.autocommit = False
+            put_conn_raw(conn)
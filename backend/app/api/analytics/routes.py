@@ -1,7 +1,8 @@
-from flask import Blueprint
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, request
 from app.db import call_fn
 from app.middleware.role_required import role_required
-from app.utils.response import success_response
+from app.utils.response import success_response, error_response
 from app.utils.formatters import format_feedback
 
 analytics_bp = Blueprint('analytics', __name__)
@@ -33,6 +34,57 @@ def usage():
     })
 
 
+_ROLLUP_MAX_RANGE = {
+    'hour': timedelta(days=31),
+    'day': timedelta(days=366 * 2),
+    'week': timedelta(days=366 * 5),
+    'month': timedelta(days=366 * 10),
+}
+
+
+def _parse_datetime(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+@analytics_bp.route('/usage-rollup', methods=['GET'])
+@role_required('admin')
+def usage_rollup():
+    """
+    Uso por rango (from/to ISO 8601) y granularidad desde los agregados continuos.
+    El rango se amplía a buckets completos; feedback_* son eventos de valoración netos.
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in _ROLLUP_MAX_RANGE:
+        return error_response('Granularidad invalida (hour, day, week, month).', 'Error de validacion', 400)
+
+    try:
+        end = _parse_datetime(request.args['to']) if request.args.get('to') else datetime.now(timezone.utc)
+        start = _parse_datetime(request.args['from']) if request.args.get('from') else end - timedelta(days=30)
+    except ValueError:
+        return error_response('Fechas invalidas (use ISO 8601).', 'Error de validacion', 400)
+    if start >= end:
+        return error_response('El inicio debe ser anterior al fin.', 'Error de validacion', 400)
+    if end - start > _ROLLUP_MAX_RANGE[granularity]:
+        return error_response('Rango demasiado amplio para la granularidad.', 'Error de validacion', 400)
+
+    rows = call_fn('fn_get_usage_rollup', (start, end, granularity), fetch_all=True) or []
+    return success_response(data={
+        'granularity': granularity,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'buckets': [{
+            'bucket': r['bucket'].isoformat(),
+            'messages': r['messages'],
+            'user_messages': r['user_messages'],
+            'active_users': r['active_users'],
+            'conversations': r['conversations'],
+            'feedback_positive': r['feedback_positive'],
+            'feedback_negative': r['feedback_negative'],
+        } for r in rows],
+    })
+
+
 @analytics_bp.route('/popular-queries', methods=['GET'])
 @role_required('admin')
 def popular_queries():
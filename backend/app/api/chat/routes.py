@@ -8,8 +8,8 @@ from app.db import call_fn
 from app.schemas.chat_schema import ChatMessageSchema
 from app.schemas.feedback_schema import FeedbackCreateSchema
 from app.middleware.auth_middleware import auth_required
-from app.utils.response import success_response, error_response, paginated_response
-from app.utils.pagination import get_pagination_params
+from app.utils.response import success_response, error_response, paginated_response, cursor_response
+from app.utils.pagination import get_pagination_params, get_cursor_params, cursor_values, keyset_page
 from app.utils.formatters import format_chat_message
 
 chat_bp = Blueprint('chat', __name__)
@@ -120,19 +120,40 @@ def stream_message():
 @chat_bp.route('/conversations', methods=['GET'])
 @auth_required
 def list_conversations():
+    """
+    Con ?page= pagina por número (total incluido); si no, por cursor (?cursor=&limit=),
+    siguiendo (last_message_at, id) sin contar las conversaciones.
+    """
     user_id = get_jwt_identity()
-    page, per_page = get_pagination_params()
 
-    rows = call_fn('fn_list_conversations', (user_id, page, per_page), fetch_all=True)
+    if 'page' in request.args:
+        page, per_page = get_pagination_params()
+        rows = call_fn('fn_list_conversations', (user_id, page, per_page), fetch_all=True)
+        total = rows[0]['total_count'] if rows else 0
+        return paginated_response([_format_conversation(r) for r in rows], total, page, per_page,
+                                  'Conversaciones obtenidas.')
 
-    total = rows[0]['total_count'] if rows else 0
-    items = [{
+    try:
+        cursor, limit = get_cursor_params()
+        before_at, before_id = cursor_values(cursor, ('timestamp', 'id'))
+    except ValueError as e:
+        return error_response(str(e), 'Error de validacion', 400)
+
+    rows = call_fn('fn_list_conversations_keyset', (user_id, before_at, before_id, limit + 1),
+                   fetch_all=True) or []
+    rows, next_cursor = keyset_page(
+        rows, limit, lambda r: [r['last_message_at'].isoformat(), r['conversation_id']])
+    return cursor_response([_format_conversation(r) for r in rows], next_cursor, limit,
+                           'Conversaciones obtenidas.')
+
+
+def _format_conversation(r):
+    return {
         'conversation_id': r['conversation_id'],
         'last_message_at': r['last_message_at'].isoformat() if r['last_message_at'] else None,
         'preview': r['preview'] or '',
-    } for r in rows]
-
-    return paginated_response(items, total, page, per_page, 'Conversaciones obtenidas.')
+        'message_count': r['message_count'],
+    }
 
 
 @chat_bp.route('/conversations/<conversation_id>', methods=['GET'])
@@ -201,19 +222,34 @@ _FALLBACK_SUGGESTIONS = [
 @chat_bp.route('/autocomplete', methods=['GET'])
 @auth_required
 def autocomplete():
+    from app.rag.autocomplete import suggest_questions
+
     query = request.args.get('q', '').strip()
     if len(query) < 3:
         return success_response(data={'suggestions': []}, message='Sugerencias obtenidas.')
-    rows = call_fn('fn_autocomplete_chat', (query, 3), fetch_all=True) or []
-    suggestions = [{'text': r['suggestion'], 'source': r['source']} for r in rows]
+    limit = 3
+
+    # Preguntas anteriores (índice de prefijos en memoria) y, si faltan, frases de documentos
+    history = suggest_questions(query, limit)
+    suggestions = [{'text': text, 'source': 'history'} for text, _, _ in history]
+    if len(suggestions) < limit:
+        # Claves de fn_normalize_question en ambos lados
+        seen = {key for _, _, key in history}
+        rows = call_fn('fn_autocomplete_chat', (query, limit), fetch_all=True) or []
+        for r in rows:
+            if len(suggestions) >= limit:
+                break
+            if r['suggestion_key'] not in seen:
+                suggestions.append({'text': r['suggestion'], 'source': r['source']})
     return success_response(data={'suggestions': suggestions}, message='Sugerencias obtenidas.')
 
 
 @chat_bp.route('/suggested-questions', methods=['GET'])
 @auth_required
 def suggested_questions():
-    rows = call_fn('fn_get_frequent_questions', (2, 6), fetch_all=True) or []
-    questions = [r['question'] for r in rows]
+    from app.rag.autocomplete import frequent_questions
+
+    questions = list(frequent_questions(2, 6))
     if len(questions) < 3:
         existing_lower = {q.lower() for q in questions}
         for fallback in _FALLBACK_SUGGESTIONS:
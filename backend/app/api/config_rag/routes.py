@@ -18,9 +18,14 @@ def get_rag_config():
         'num_ctx': current_app.config.get('RAG_NUM_CTX', 4096),
         'llm_model': current_app.config.get('LLM_MODEL', 'gemma3:4b'),
         'embedding_model': current_app.config.get('EMBEDDING_MODEL', 'nomic-embed-text'),
+        'embedding_backend': current_app.config.get('EMBEDDING_BACKEND', 'ollama'),
+        'embedding_query_backend': current_app.config.get('EMBEDDING_QUERY_BACKEND') or current_app.config.get('EMBEDDING_BACKEND', 'ollama'),
         'candidate_multiplier': current_app.config.get('RAG_CANDIDATE_MULTIPLIER', 4),
         'max_chunks_per_doc': current_app.config.get('RAG_MAX_CHUNKS_PER_DOC', 2),
         'enable_reflection': current_app.config.get('RAG_ENABLE_REFLECTION', False),
+        'retrieval_mode': current_app.config.get('RAG_RETRIEVAL_MODE', 'hnsw'),
+        'binary_oversample': current_app.config.get('RAG_BINARY_OVERSAMPLE', 10),
+        'hnsw_ef_search': current_app.config.get('RAG_HNSW_EF_SEARCH', 100),
     }
     config.update(_rag_config_overrides)
     return config
@@ -43,6 +48,7 @@ def update_config():
         'chunk_size', 'chunk_overlap', 'top_k',
         'score_threshold', 'temperature', 'num_ctx',
         'candidate_multiplier', 'max_chunks_per_doc', 'enable_reflection',
+        'retrieval_mode', 'binary_oversample', 'hnsw_ef_search',
     }
 
     for key, value in data.items():
@@ -54,9 +60,11 @@ def update_config():
             )
 
     # Validate types
-    int_fields = {'chunk_size', 'chunk_overlap', 'top_k', 'num_ctx', 'candidate_multiplier', 'max_chunks_per_doc'}
+    int_fields = {'chunk_size', 'chunk_overlap', 'top_k', 'num_ctx', 'candidate_multiplier', 'max_chunks_per_doc',
+                  'binary_oversample', 'hnsw_ef_search'}
     float_fields = {'score_threshold', 'temperature'}
     bool_fields = {'enable_reflection'}
+    choice_fields = {'retrieval_mode': ('hnsw', 'binary')}
 
     for key, value in data.items():
         if key in int_fields:
@@ -68,6 +76,10 @@ def update_config():
         elif key in bool_fields:
             if not isinstance(value, bool):
                 return error_response(f'{key} debe ser un booleano (true/false).', 'Validacion', 400)
+        elif key in choice_fields:
+            if value not in choice_fields[key]:
+                opciones = ', '.join(choice_fields[key])
+                return error_response(f'{key} debe ser uno de: {opciones}.', 'Validacion', 400)
 
     _rag_config_overrides.update(data)
 
@@ -80,3 +92,21 @@ def update_config():
         data={'config': get_rag_config()},
         message='Configuracion RAG actualizada exitosamente.'
     )
+
+
+@config_rag_bp.route('/cache-stats', methods=['GET'])
+@role_required('admin')
+def get_cache_stats():
+    from app.rag.query_cache import get_query_cache_stats
+    return success_response(
+        data={'query_embeddings': get_query_cache_stats()},
+        message='Estadisticas de cache obtenidas exitosamente.'
+    )
+
+
+@config_rag_bp.route('/cache-stats', methods=['DELETE'])
+@role_required('admin')
+def reset_cache_stats():
+    from app.rag.query_cache import clear_query_cache
+    clear_query_cache()
+    return success_response(message='Cache de consultas vaciada exitosamente.')
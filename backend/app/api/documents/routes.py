@@ -3,8 +3,9 @@ from flask import Blueprint, request, current_app
 from flask_jwt_extended import get_jwt_identity
 from app.db import call_fn
 from app.middleware.role_required import role_required
-from app.utils.response import success_response, error_response, paginated_response
-from app.utils.pagination import get_pagination_params
+from app.utils.response import success_response, error_response, paginated_response, cursor_response
+from app.utils.pagination import (get_pagination_params, get_cursor_params, cursor_values,
+                                  get_total_mode, list_total, keyset_page)
 from app.utils.file_utils import allowed_file, save_upload, get_file_extension, get_file_size, delete_file
 from app.utils.formatters import format_document
 
@@ -14,17 +15,39 @@ documents_bp = Blueprint('documents', __name__)
 @documents_bp.route('/', methods=['GET'])
 @role_required('admin')
 def list_documents():
-    page, per_page = get_pagination_params()
-    search = request.args.get('search', '')
-    category_id = request.args.get('category_id', '')
-    status = request.args.get('status', '')
-
-    rows = call_fn('fn_list_documents', (search, category_id, status, page, per_page), fetch_all=True)
-
-    total = rows[0]['total_count'] if rows else 0
-    items = [format_document(r) for r in rows]
-
-    return paginated_response(items, total, page, per_page, 'Documentos obtenidos exitosamente.')
+    """
+    Con ?page= pagina por número; si no, por cursor (?cursor=&limit=) sobre (created_at, id),
+    o (similitud, created_at, id) al buscar 3 o más caracteres (?search=, sin tildes).
+    ?total=none|estimate|cached elige el total (por defecto cached por número, none por cursor).
+    """
+    filters = (request.args.get('search', ''), request.args.get('category_id', ''),
+               request.args.get('status', ''))
+
+    if 'page' in request.args:
+        page, per_page = get_pagination_params()
+        try:
+            total_mode = get_total_mode('cached')
+        except ValueError as e:
+            return error_response(str(e), 'Error de validacion', 400)
+        rows = call_fn('fn_list_documents', filters + (page, per_page), fetch_all=True)
+        total = list_total('fn_count_documents_list', filters, total_mode)
+        return paginated_response([format_document(r) for r in rows], total, page, per_page,
+                                  'Documentos obtenidos exitosamente.', total_mode)
+
+    try:
+        cursor, limit = get_cursor_params()
+        before_rank, before_at, before_id = cursor_values(cursor, ('rank', 'timestamp', 'id'))
+        total_mode = get_total_mode()
+    except ValueError as e:
+        return error_response(str(e), 'Error de validacion', 400)
+
+    rows = call_fn('fn_list_documents_keyset', filters + (before_rank, before_at, before_id, limit + 1),
+                   fetch_all=True) or []
+    rows, next_cursor = keyset_page(
+        rows, limit, lambda r: [r['search_rank'], r['created_at'].isoformat(), r['id']])
+    total = list_total('fn_count_documents_list', filters, total_mode)
+    return cursor_response([format_document(r) for r in rows], next_cursor, limit,
+                           'Documentos obtenidos exitosamente.', total, total_mode)
 
 
 @documents_bp.route('/upload', methods=['POST'])
@@ -136,12 +159,12 @@ def upload_batch():
     )
 
 
-def _process_document_async(app, document_id):
+def _process_document_async(app, document_id, incremental=False):
     def process():
         with app.app_context():
             from app.rag.pipeline import process_document
             try:
-                process_document(document_id, app=app)
+                process_document(document_id, app=app, incremental=incremental)
             except Exception as e:
                 # process_document ya actualizó el status a 'failed'
                 print(f"[Pipeline error] {document_id}: {e}")
@@ -191,9 +214,12 @@ def delete_document(doc_id):
         return error_response('Documento no encontrado.', 'No encontrado', 404)
 
     # Los chunks se eliminan vía ON DELETE CASCADE en document_chunks
+    previous = call_fn('fn_release_previous_file', (doc_id,), fetch_one=True)
     file_path = call_fn('fn_delete_document', (doc_id,), fetch_one=True)
     if file_path:
         delete_file(file_path['fn_delete_document'])
+    if previous:
+        delete_file(previous['fn_release_previous_file'])
 
     return success_response(message='Documento eliminado exitosamente.')
 
@@ -205,7 +231,8 @@ def reprocess_document(doc_id):
     if not doc:
         return error_response('Documento no encontrado.', 'No encontrado', 404)
 
-    # fn_reset_document_for_reprocess elimina chunks existentes vía DELETE
+    # Los chunks actuales siguen activos; el pipeline construye una generación nueva
+    # y la activa al terminar (ver fn_activate_document_generation)
     call_fn('fn_reset_document_for_reprocess', (doc_id,), fetch_one=True)
 
     doc = call_fn('fn_get_document', (doc_id,), fetch_one=True)
@@ -216,3 +243,52 @@ def reprocess_document(doc_id):
         data={'document': format_document(doc)},
         message='Reprocesamiento iniciado.'
     )
+
+
+@documents_bp.route('/<doc_id>/replace', methods=['POST'])
+@role_required('admin')
+def replace_document(doc_id):
+    # Nueva version del archivo. mode=incremental (defecto): solo se embeben los chunks
+    # que cambiaron; mode=full: reprocesa todo en una generacion nueva.
+    doc = call_fn('fn_get_document', (doc_id,), fetch_one=True)
+    if not doc:
+        return error_response('Documento no encontrado.', 'No encontrado', 404)
+
+    if 'file' not in request.files:
+        return error_response('No se envio ningun archivo.', 'Archivo requerido', 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return error_response('Nombre de archivo vacio.', 'Archivo invalido', 400)
+
+    if not allowed_file(file.filename):
+        return error_response(
+            'Tipo de archivo no permitido. Formatos aceptados: PDF, DOCX, XLSX, TXT, PNG, JPG.',
+            'Tipo no permitido',
+            400
+        )
+
+    mode = request.form.get('mode', 'incremental')
+    if mode not in ('incremental', 'full'):
+        return error_response('mode debe ser incremental o full.', 'Validacion', 400)
+
+    file_size = get_file_size(file)
+    file_path, unique_name = save_upload(file)
+    ext = get_file_extension(file.filename)
+
+    # El archivo anterior se conserva hasta que el pipeline publique la versión nueva
+    # (pipeline._release_previous_file); solo se borra una re-subida que nunca se publicó
+    discarded = call_fn('fn_replace_document_file', (
+        doc_id, file.filename, file_path, ext, file_size
+    ), fetch_one=True)
+    if discarded and discarded['fn_replace_document_file'] != file_path:
+        delete_file(discarded['fn_replace_document_file'])
+
+    doc = call_fn('fn_get_document', (doc_id,), fetch_one=True)
+
+    _process_document_async(current_app._get_current_object(), doc_id, incremental=(mode == 'incremental'))
+
+    return success_response(
+        data={'document': format_document(doc)},
+        message='Nueva version recibida. Procesando cambios...'
+    )
@@ -3,8 +3,9 @@ from flask import Blueprint, request, current_app
 from flask_jwt_extended import get_jwt_identity
 from app.db import call_fn
 from app.middleware.role_required import role_required
-from app.utils.response import success_response, error_response, paginated_response
-from app.utils.pagination import get_pagination_params
+from app.utils.response import success_response, error_response, paginated_response, cursor_response
+from app.utils.pagination import (get_pagination_params, get_cursor_params, cursor_values,
+                                  get_total_mode, list_total, keyset_page)
 from app.utils.file_utils import save_upload, get_file_extension, get_file_size, delete_file
 from app.utils.formatters import format_thesis_check
 
@@ -77,14 +78,36 @@ def _run_check_async(app, check_id):
 @originality_bp.route('/', methods=['GET'])
 @role_required('admin')
 def list_checks():
-    page, per_page = get_pagination_params()
-    status = request.args.get('status', '')
+    """
+    Con ?page= pagina por número; si no, por cursor (?cursor=&limit=) sobre (created_at, id).
+    ?total=none|estimate|cached elige el total (por defecto cached por número, none por cursor).
+    """
+    filters = ('', request.args.get('status', ''))
+
+    if 'page' in request.args:
+        page, per_page = get_pagination_params()
+        try:
+            total_mode = get_total_mode('cached')
+        except ValueError as e:
+            return error_response(str(e), 'Error de validacion', 400)
+        rows = call_fn('fn_list_thesis_checks', filters + (page, per_page), fetch_all=True)
+        total = list_total('fn_count_thesis_checks_list', filters, total_mode)
+        return paginated_response([format_thesis_check(r) for r in rows], total, page, per_page,
+                                  'Verificaciones obtenidas exitosamente.', total_mode)
 
-    rows = call_fn('fn_list_thesis_checks', ('', status, page, per_page), fetch_all=True)
-    total = rows[0]['total_count'] if rows else 0
-    items = [format_thesis_check(r) for r in rows]
-
-    return paginated_response(items, total, page, per_page, 'Verificaciones obtenidas exitosamente.')
+    try:
+        cursor, limit = get_cursor_params()
+        before_at, before_id = cursor_values(cursor, ('timestamp', 'id'))
+        total_mode = get_total_mode()
+    except ValueError as e:
+        return error_response(str(e), 'Error de validacion', 400)
+
+    rows = call_fn('fn_list_thesis_checks_keyset', filters + (before_at, before_id, limit + 1),
+                   fetch_all=True) or []
+    rows, next_cursor = keyset_page(rows, limit, lambda r: [r['created_at'].isoformat(), r['id']])
+    total = list_total('fn_count_thesis_checks_list', filters, total_mode)
+    return cursor_response([format_thesis_check(r) for r in rows], next_cursor, limit,
+                           'Verificaciones obtenidas exitosamente.', total, total_mode)
 
 
 @originality_bp.route('/<check_id>', methods=['GET'])
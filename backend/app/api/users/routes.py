@@ -1,8 +1,9 @@
 from flask import Blueprint, request
 from app.db import call_fn
 from app.middleware.role_required import role_required
-from app.utils.response import success_response, error_response, paginated_response
-from app.utils.pagination import get_pagination_params
+from app.utils.response import success_response, error_response, paginated_response, cursor_response
+from app.utils.pagination import (get_pagination_params, get_cursor_params, cursor_values,
+                                  get_total_mode, list_total, keyset_page)
 from app.utils.formatters import format_user
 
 users_bp = Blueprint('users', __name__)
@@ -11,15 +12,38 @@ users_bp = Blueprint('users', __name__)
 @users_bp.route('/', methods=['GET'])
 @role_required('admin')
 def list_users():
-    page, per_page = get_pagination_params()
-    search = request.args.get('search', '')
+    """
+    Con ?page= pagina por número; si no, por cursor (?cursor=&limit=) sobre (created_at, id),
+    o (similitud, created_at, id) al buscar 3 o más caracteres (?search=, sin tildes).
+    ?total=none|estimate|cached elige el total (por defecto cached por número, none por cursor).
+    """
+    filters = (request.args.get('search', ''),)
 
-    rows = call_fn('fn_list_users', (search, page, per_page), fetch_all=True)
+    if 'page' in request.args:
+        page, per_page = get_pagination_params()
+        try:
+            total_mode = get_total_mode('cached')
+        except ValueError as e:
+            return error_response(str(e), 'Error de validacion', 400)
+        rows = call_fn('fn_list_users', filters + (page, per_page), fetch_all=True)
+        total = list_total('fn_count_users_list', filters, total_mode)
+        return paginated_response([format_user(r) for r in rows], total, page, per_page,
+                                  'Usuarios obtenidos exitosamente.', total_mode)
 
-    total = rows[0]['total_count'] if rows else 0
-    items = [format_user(r) for r in rows]
+    try:
+        cursor, limit = get_cursor_params()
+        before_rank, before_at, before_id = cursor_values(cursor, ('rank', 'timestamp', 'id'))
+        total_mode = get_total_mode()
+    except ValueError as e:
+        return error_response(str(e), 'Error de validacion', 400)
 
-    return paginated_response(items, total, page, per_page, 'Usuarios obtenidos exitosamente.')
+    rows = call_fn('fn_list_users_keyset', filters + (before_rank, before_at, before_id, limit + 1),
+                   fetch_all=True) or []
+    rows, next_cursor = keyset_page(
+        rows, limit, lambda r: [r['search_rank'], r['created_at'].isoformat(), r['id']])
+    total = list_total('fn_count_users_list', filters, total_mode)
+    return cursor_response([format_user(r) for r in rows], next_cursor, limit,
+                           'Usuarios obtenidos exitosamente.', total, total_mode)
 
 
 @users_bp.route('/<user_id>', methods=['GET'])
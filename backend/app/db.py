@@ -1,7 +1,11 @@
+import io
+import json
+import struct
 import psycopg2
 from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import RealDictCursor
 from flask import g
+from app.vector_types import register_vector_types
 
 _pool = None
 
@@ -15,6 +19,12 @@ def init_pool(app):
         cursor_factory=RealDictCursor,
     )
 
+    conn = _pool.getconn()
+    try:
+        register_vector_types(conn)
+    finally:
+        _pool.putconn(conn)
+
     @app.teardown_appcontext
     def return_conn(exc):
         conn = g.pop('db_conn', None)
@@ -45,8 +55,11 @@ def put_conn_raw(conn):
         _pool.putconn(conn)
 
 
-def call_fn(fn_name, params=None, fetch_one=False, fetch_all=False, conn=None):
-    """Call a stored function: SELECT * FROM fn_name(params...)"""
+def call_fn(fn_name, params=None, fetch_one=False, fetch_all=False, conn=None, commit=True):
+    """
+    Call a stored function: SELECT * FROM fn_name(params...)
+    commit=False leaves the transaction open so several calls can share it.
+    """
     own_conn = conn is None
     if own_conn:
         conn = get_conn()
@@ -63,7 +76,8 @@ def call_fn(fn_name, params=None, fetch_one=False, fetch_all=False, conn=None):
             result = cur.fetchall()
         else:
             result = None
-        conn.commit()
+        if commit:
+            conn.commit()
         return result
     except Exception:
         conn.rollback()
@@ -94,3 +108,54 @@ def execute(query, params=None, fetch_one=False, fetch_all=False, conn=None):
         raise
     finally:
         cur.close()
+
+
+def encode_text(value):
+    return str(value).encode('utf-8')
+
+
+def encode_int4(value):
+    return struct.pack('>i', value)
+
+
+def encode_jsonb(value):
+    # jsonb binary format: version byte (1) + JSON text
+    return b'\x01' + json.dumps(value).encode('utf-8')
+
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+
+
+def copy_rows(table, columns, encoders, rows, conn):
+    """
+    Bulk load rows with COPY ... FROM STDIN (FORMAT binary).
+    encoders: one callable per column returning the field's binary representation
+    (encode_text, encode_int4, encode_jsonb, app.vector_types.encode_vector).
+    Does NOT commit: the caller owns the transaction. Returns the number of rows sent.
+    """
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    field_count = struct.pack('>h', len(columns))
+    count = 0
+    for row in rows:
+        buf.write(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                buf.write(struct.pack('>i', -1))
+                continue
+            data = encode(value)
+            buf.write(struct.pack('>i', len(data)))
+            buf.write(data)
+        count += 1
+    if not count:
+        return 0
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+
+    cur = conn.cursor()
+    try:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)", buf)
+        return count
+    finally:
+        cur.close()
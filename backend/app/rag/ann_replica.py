@@ -0,0 +1,504 @@
+"""
+Réplica ANN en proceso de los embeddings de contenido (RAG_ANN_REPLICA_ENABLED).
+
+- Snapshot (`flask vectors ann-snapshot`): los chunks 'content' buscables se exportan a
+  RAG_ANN_SNAPSHOT_DIR como arrays .npy (vectores normalizados, ordenados por lista IVF)
+  junto con los centroides k-means. Cada worker los abre con mmap: los workers de
+  gunicorn comparten las páginas del page cache en vez de tener una copia cada uno.
+- Sincronización: triggers en document_chunks llenan chunk_change_log y hacen
+  NOTIFY chunk_changes. Un hilo por worker escucha (LISTEN) y aplica los cambios sobre
+  una máscara de bajas del snapshot y un delta en memoria con las altas. Cada réplica
+  reporta su último seq (ann_replica_positions); `flask vectors ann-prune-log` y
+  `flask vectors gc` recortan el log hasta lo que ninguna réplica ni el snapshot necesitan.
+- Búsqueda: listas IVF en orden de cercanía al centroide (mínimo RAG_ANN_NPROBE, más si
+  los filtros descartan candidatos) + delta por fuerza bruta. Contenido y título se leen
+  por id (fn_get_chunks_by_ids). Si la réplica no está cargada o lleva más de
+  RAG_ANN_MAX_LAG segundos sin sincronizar, search() retorna None y se usa SQL.
+"""
+import json
+import os
+import select
+import shutil
+import socket
+import threading
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from flask import current_app
+
+from app.db import call_fn
+from app.vector_types import DTYPE
+
+CHANNEL = 'chunk_changes'
+POLL_SECONDS = 5           # sincroniza al menos cada POLL_SECONDS aunque no lleguen NOTIFY
+CHANGE_BATCH = 5000
+HOLE_TTL_SECONDS = 120     # un seq que no aparece en este tiempo era de una transacción abortada
+MAX_HOLE_GAP = 1000
+REPLAY_MARGIN = 1000       # cambios previos al snapshot que se reaplican al cargarlo
+EXPORT_BATCH = 10000
+REPLICA_LIVE_SECONDS = 600  # réplica sin reportar su seq en este lapso = detenida (no frena el recorte)
+KMEANS_ITERATIONS = 10
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return (matrix / np.clip(norms, 1e-12, None)).astype(DTYPE, copy=False)
+
+
+# ─── Snapshot ───
+
+def _train_centroids(vectors, nlist, rng):
+    """k-means esférico (producto punto) sobre una muestra de hasta 64 filas por lista."""
+    sample_size = min(len(vectors), nlist * 64)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = sample[assign == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def _assign(vectors, centroids, block=65536):
+    return np.concatenate([
+        np.argmax(vectors[i:i + block] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), block)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+def build_snapshot(directory, nlist=None, keep_log_hours=24, log=print):
+    """
+    Exporta los chunks de la réplica a un snapshot nuevo y lo publica en CURRENT.
+    Activa el registro de cambios antes de leer, así nada de lo que cambie durante la
+    exportación se pierde (los cambios se reaplican sobre el snapshot, son idempotentes).
+    """
+    conn = psycopg2.connect(current_app.config['DATABASE_URL'], cursor_factory=RealDictCursor)
+    try:
+        call_fn('fn_set_rag_setting', ('ann_change_log', 'on'), conn=conn)
+        pruned = call_fn('fn_prune_chunk_change_log', (keep_log_hours, REPLICA_LIVE_SECONDS),
+                         fetch_one=True, conn=conn)['fn_prune_chunk_change_log']
+        bounds = call_fn('fn_get_chunk_change_bounds', fetch_one=True, conn=conn)
+        seq = bounds['max_seq']
+        # Transacciones sin commit al leer el head pueden tener seq menores: se reaplican
+        replay_from = max(seq - REPLAY_MARGIN, bounds['min_seq'] - 1, 0)
+
+        ids, doc_ids, category_ids, pages, batches = [], [], [], [], []
+        after = ''
+        while True:
+            rows = call_fn('fn_list_replica_chunks', (after, EXPORT_BATCH), fetch_all=True, conn=conn)
+            if not rows:
+                break
+            ids.extend(r['id'] for r in rows)
+            doc_ids.extend(r['document_id'] for r in rows)
+            category_ids.extend(r['category_id'] or '' for r in rows)
+            pages.extend(r['page'] for r in rows)
+            batches.append(np.stack([r['embedding'] for r in rows]))
+            after = rows[-1]['id']
+            log(f'  exportados {len(ids)} chunks')
+
+        if not ids:
+            raise ValueError('No hay chunks de contenido buscables para la réplica.')
+
+        vectors = _normalize(np.concatenate(batches))
+        del batches
+        nlist = nlist or int(np.clip(np.sqrt(len(vectors)), 1, 4096))
+        nlist = min(nlist, len(vectors))
+        log(f'Entrenando {nlist} listas IVF...')
+        centroids = _train_centroids(vectors, nlist, np.random.default_rng(0))
+        assign = _assign(vectors, centroids)
+
+        # Filas ordenadas por lista: cada lista IVF es un bloque contiguo del mmap
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        ids_sorted = np.array(ids)[order]
+        id_order = np.argsort(ids_sorted)
+
+        name = f'snapshot-{seq}-{int(time.time())}'
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, f'.{name}')
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'vectors.npy'), vectors[order])
+        np.save(os.path.join(tmp, 'ids.npy'), ids_sorted)
+        np.save(os.path.join(tmp, 'doc_ids.npy'), np.array(doc_ids)[order])
+        np.save(os.path.join(tmp, 'category_ids.npy'), np.array(category_ids)[order])
+        np.save(os.path.join(tmp, 'pages.npy'), np.array(pages, dtype=np.int32)[order])
+        np.save(os.path.join(tmp, 'centroids.npy'), centroids)
+        np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+        np.save(os.path.join(tmp, 'lookup_ids.npy'), ids_sorted[id_order])
+        np.save(os.path.join(tmp, 'lookup_rows.npy'), id_order.astype(np.int64))
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump({'seq': replay_from, 'count': len(ids), 'nlist': nlist,
+                       'dim': int(vectors.shape[1]), 'created_at': time.time()}, f)
+        os.rename(tmp, os.path.join(directory, name))
+
+        current_tmp = os.path.join(directory, 'CURRENT.tmp')
+        with open(current_tmp, 'w') as f:
+            f.write(name)
+        os.replace(current_tmp, os.path.join(directory, 'CURRENT'))
+        # Las réplicas que carguen este snapshot reaplican el log desde replay_from
+        call_fn('fn_set_rag_setting', ('ann_snapshot_seq', str(replay_from)), conn=conn)
+
+        # Se conserva el snapshot anterior (workers que aún no recargan lo tienen en mmap)
+        snapshots = sorted(
+            (d for d in os.listdir(directory) if d.startswith('snapshot-')),
+            key=lambda d: os.path.getmtime(os.path.join(directory, d)),
+        )
+        for old in snapshots[:-2]:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+        log(f'Snapshot {name}: {len(ids)} chunks, {nlist} listas, '
+            f'{pruned} cambios antiguos eliminados del log.')
+        return name
+    finally:
+        conn.close()
+
+
+def prune_change_log(keep_hours=1, log=print):
+    """
+    Recorta chunk_change_log hasta el menor seq que necesitan el snapshot publicado y las
+    réplicas vivas (conservando keep_hours de historia). Lo ejecutan `flask vectors
+    ann-prune-log` y `flask vectors gc`; los triggers registran cada chunk escrito.
+    """
+    pruned = call_fn('fn_prune_chunk_change_log', (keep_hours, REPLICA_LIVE_SECONDS),
+                     fetch_one=True)['fn_prune_chunk_change_log']
+    log(f'Cambios eliminados del log de la replica ANN: {pruned}.')
+    return pruned
+
+
+# ─── Réplica ───
+
+class AnnReplica:
+    """Snapshot en mmap + cambios aplicados desde chunk_change_log (un hilo LISTEN por proceso)."""
+
+    def __init__(self, dsn, directory, nprobe=16, max_lag=30.0):
+        self.dsn = dsn
+        self.directory = directory
+        self.nprobe = nprobe
+        self.max_lag = max_lag
+        self.pid = os.getpid()
+        self.replica_id = f'{socket.gethostname()}:{self.pid}'
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = None      # dict de arrays (mmap) + manifest
+        self._expired = None       # snapshot que el log ya no cubre (espera uno nuevo)
+        self._deleted = None       # bajas/cambios sobre el snapshot (privado del proceso)
+        self._delta = {}           # chunk_id -> (vector, document_id, category_id, page)
+        self._delta_arrays = None  # caché de _delta en forma de matriz
+        self._holes = {}           # seq pendiente -> momento en que se detectó
+        self.seq = 0
+        self.last_sync = 0.0
+
+    # Ciclo de vida
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='ann-replica', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_fresh(self):
+        return self._snapshot is not None and time.monotonic() - self.last_sync <= self.max_lag
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN {CHANNEL}')
+                while not self._stop.is_set():
+                    name = self._current_name()
+                    if name not in ((self._snapshot or {}).get('name'), self._expired):
+                        self.load()
+                    self.sync(conn)
+                    if select.select([conn], [], [], POLL_SECONDS) != ([], [], []):
+                        conn.poll()
+                        conn.notifies.clear()
+            except Exception as e:
+                print(f'[AnnReplica] {e}')
+                self._stop.wait(POLL_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    # Snapshot
+
+    def _current_name(self):
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        name = self._current_name()
+        if name is None:
+            raise FileNotFoundError(f'No hay snapshot ANN en {self.directory} (flask vectors ann-snapshot)')
+        path = os.path.join(self.directory, name)
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        snapshot = {'name': name, 'manifest': manifest}
+        for key in ('vectors', 'ids', 'doc_ids', 'category_ids', 'pages', 'centroids',
+                    'offsets', 'lookup_ids', 'lookup_rows'):
+            snapshot[key] = np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r')
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._deleted = np.zeros(manifest['count'], dtype=bool)
+            self._delta = {}
+            self._delta_arrays = None
+            self._holes = {}
+            self._expired = None
+            self.seq = manifest['seq']
+        print(f'[AnnReplica] snapshot {name} cargado ({manifest["count"]} chunks)')
+
+    def _row_of(self, chunk_id):
+        lookup = self._snapshot['lookup_ids']
+        i = int(np.searchsorted(lookup, chunk_id))
+        if i < len(lookup) and lookup[i] == chunk_id:
+            return int(self._snapshot['lookup_rows'][i])
+        return None
+
+    # Sincronización
+
+    def sync(self, conn):
+        """Aplica los cambios pendientes del log. Idempotente: cada cambio relee el estado actual."""
+        if self._snapshot is None:
+            return
+        bounds = call_fn('fn_get_chunk_change_bounds', fetch_one=True, conn=conn)
+        if bounds['min_seq'] > self.seq + 1:
+            # El log se recortó por detrás del snapshot: se vuelve a SQL hasta el próximo snapshot
+            print('[AnnReplica] el log de cambios no cubre el snapshot; ejecute flask vectors ann-snapshot')
+            with self._lock:
+                self._expired = self._snapshot['name']
+                self._snapshot = None
+            return
+
+        while True:
+            now = time.monotonic()
+            self._holes = {s: t for s, t in self._holes.items() if now - t < HOLE_TTL_SECONDS}
+            rows = call_fn('fn_get_chunk_changes',
+                           (self.seq, CHANGE_BATCH, list(self._holes) or None),
+                           fetch_all=True, conn=conn)
+            with self._lock:
+                for row in rows:
+                    self._apply(row)
+                    self._holes.pop(row['seq'], None)
+                    if row['seq'] > self.seq:
+                        # seq saltados = transacciones sin commit todavía (o abortadas)
+                        if row['seq'] - self.seq <= MAX_HOLE_GAP:
+                            for missing in range(self.seq + 1, row['seq']):
+                                self._holes.setdefault(missing, now)
+                        self.seq = row['seq']
+            if len(rows) < CHANGE_BATCH:
+                break
+        call_fn('fn_report_ann_replica_seq', (self.replica_id, self.seq), conn=conn)
+        self.last_sync = time.monotonic()
+
+    def _apply(self, row):
+        chunk_id = row['chunk_id']
+        base_row = self._row_of(chunk_id)
+        if base_row is not None:
+            self._deleted[base_row] = True
+        if row['present'] and row['embedding'] is not None:
+            self._delta[chunk_id] = (
+                _normalize(np.asarray(row['embedding'], dtype=DTYPE)),
+                row['document_id'], row['category_id'] or '', row['page'],
+            )
+        else:
+            self._delta.pop(chunk_id, None)
+        self._delta_arrays = None
+
+    def _delta_view(self):
+        if self._delta_arrays is None:
+            items = list(self._delta.items())
+            self._delta_arrays = (
+                np.array([k for k, _ in items]),
+                np.stack([v[0] for _, v in items]) if items else None,
+                np.array([v[1] for _, v in items]),
+                np.array([v[2] for _, v in items]),
+                np.array([v[3] for _, v in items], dtype=np.int32),
+            )
+        return self._delta_arrays
+
+    # Búsqueda
+
+    def search(self, vector, top_k, score_threshold, category_id='', document_ids=None):
+        """
+        Top-k por coseno con los filtros de fn_search_similar (content, no excluidos).
+        Retorna [(chunk_id, score)] ordenado, o None si la réplica no está al día.
+        """
+        if not self.is_fresh():
+            return None
+        with self._lock:
+            snap, deleted, delta = self._snapshot, self._deleted, self._delta_view()
+
+        query = _normalize(np.asarray(vector, dtype=DTYPE))
+        docs = np.array(document_ids) if document_ids else None
+
+        def passes(doc_ids, category_ids):
+            mask = np.ones(len(doc_ids), dtype=bool)
+            if category_id:
+                mask &= category_ids == category_id
+            if docs is not None:
+                mask &= np.isin(doc_ids, docs)
+            return mask
+
+        found_ids, found_scores = [], []
+
+        # Delta (altas y cambios posteriores al snapshot): fuerza bruta
+        d_ids, d_vectors, d_docs, d_cats, _ = delta
+        if d_vectors is not None:
+            mask = passes(d_docs, d_cats)
+            found_ids.append(d_ids[mask])
+            found_scores.append(d_vectors[mask] @ query)
+
+        # Snapshot: listas IVF por cercanía al centroide hasta tener nprobe listas y top_k candidatos
+        offsets = snap['offsets']
+        candidates = 0
+        for probed, lst in enumerate(np.argsort(-(snap['centroids'] @ query))):
+            start, end = int(offsets[lst]), int(offsets[lst + 1])
+            if start == end:
+                continue
+            mask = ~deleted[start:end] & passes(snap['doc_ids'][start:end], snap['category_ids'][start:end])
+            if mask.any():
+                found_ids.append(snap['ids'][start:end][mask])
+                found_scores.append(snap['vectors'][start:end][mask] @ query)
+                candidates += int(mask.sum())
+            if probed + 1 >= self.nprobe and candidates >= top_k:
+                break
+
+        if not found_ids:
+            return []
+        ids = np.concatenate(found_ids)
+        scores = np.concatenate(found_scores)
+        keep = scores >= score_threshold
+        ids, scores = ids[keep], scores[keep]
+        if len(scores) > top_k:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores)
+        return [(str(ids[i]), float(scores[i])) for i in order]
+
+    def stats(self):
+        with self._lock:
+            manifest = (self._snapshot or {}).get('manifest', {})
+            snapshot_rows = manifest.get('count', 0)
+            deleted_rows = int(self._deleted.sum()) if self._snapshot is not None else 0
+            return {
+                'snapshot': (self._snapshot or {}).get('name'),
+                'snapshot_rows': snapshot_rows,
+                'deleted_rows': deleted_rows,
+                'delta_rows': len(self._delta),
+                'live_rows': snapshot_rows - deleted_rows + len(self._delta),
+                'seq': self.seq,
+                'pending_holes': len(self._holes),
+                'lag_seconds': round(time.monotonic() - self.last_sync, 1) if self.last_sync else None,
+            }
+
+
+def get_ann_replica():
+    """
+    Réplica del proceso actual (se crea al primer uso, después del fork de gunicorn) o
+    None si RAG_ANN_REPLICA_ENABLED está desactivado.
+    """
+    global _replica
+    cfg = current_app.config
+    if not cfg.get('RAG_ANN_REPLICA_ENABLED', False):
+        return None
+    if _replica is None or _replica.pid != os.getpid():
+        with _replica_lock:
+            if _replica is None or _replica.pid != os.getpid():
+                _replica = AnnReplica(
+                    cfg['DATABASE_URL'],
+                    cfg.get('RAG_ANN_SNAPSHOT_DIR', 'ann_snapshot'),
+                    nprobe=cfg.get('RAG_ANN_NPROBE', 16),
+                    max_lag=cfg.get('RAG_ANN_MAX_LAG', 30.0),
+                )
+                _replica.start()
+    return _replica
+
+
+def hydrate(hits, conn=None):
+    """[(chunk_id, score)] -> resultados con el formato de search_similar (una lectura por PK)."""
+    if not hits:
+        return []
+    rows = call_fn('fn_get_chunks_by_ids', ([chunk_id for chunk_id, _ in hits],),
+                   fetch_all=True, conn=conn)
+    by_id = {r['chunk_id']: r for r in rows}
+    results = []
+    for chunk_id, score in hits:
+        r = by_id.get(chunk_id)
+        if r is None:       # borrado u oculto (réplica atrasada) desde la búsqueda
+            continue
+        results.append({
+            'chunk_id': chunk_id,
+            'content': r['content'],
+            'document_id': r['document_id'],
+            'title': r['title'],
+            'category_id': r['category_id'],
+            'page': r['page'],
+            'score': score,
+        })
+    return results
+
+
+def check_replica(queries=50, top_k=10, log=print):
+    """
+    Verificación de consistencia y latencia: carga una réplica en primer plano, compara su
+    cantidad de filas con la BD y sus top-k con fn_search_similar_multi (HNSW) sobre
+    vectores de chunks al azar.
+    """
+    cfg = current_app.config
+    replica = AnnReplica(cfg['DATABASE_URL'], cfg.get('RAG_ANN_SNAPSHOT_DIR', 'ann_snapshot'),
+                         nprobe=cfg.get('RAG_ANN_NPROBE', 16), max_lag=float('inf'))
+    conn = psycopg2.connect(cfg['DATABASE_URL'], cursor_factory=RealDictCursor)
+    conn.autocommit = True
+    try:
+        replica.load()
+        replica.sync(conn)
+        stats = replica.stats()
+        db_rows = call_fn('fn_count_replica_chunks', fetch_one=True, conn=conn)['fn_count_replica_chunks']
+        head = call_fn('fn_get_chunk_change_bounds', fetch_one=True, conn=conn)['max_seq']
+        for key, value in stats.items():
+            log(f'{key}: {value}')
+        log(f'db_rows: {db_rows} ({"OK" if db_rows == stats["live_rows"] else "DIFERENTE"})')
+        log(f'log_head: {head} ({"OK" if head == stats["seq"] else "ATRASADO"})')
+
+        vectors = [r['embedding'] for r in
+                   call_fn('fn_sample_chunk_embeddings', (queries,), fetch_all=True, conn=conn)]
+        sql_ms, replica_ms, agreement = [], [], []
+        for vector in vectors:
+            start = time.perf_counter()
+            rows = call_fn('fn_search_similar_multi', (
+                [vector], top_k, -1.0, '', False, None, 'content', cfg.get('RAG_HNSW_EF_SEARCH', 100),
+            ), fetch_all=True, conn=conn)
+            sql_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            hits = replica.search(vector, top_k, -1.0)
+            replica_ms.append((time.perf_counter() - start) * 1000)
+
+            expected = {r['chunk_id'] for r in rows}
+            if expected:
+                agreement.append(len(expected & {chunk_id for chunk_id, _ in hits}) / len(expected))
+
+        if vectors:
+            log(f'\n{len(vectors)} consultas, top_k={top_k}')
+            log(f'  SQL (HNSW)   p50={np.median(sql_ms):7.2f} ms  p95={np.percentile(sql_ms, 95):7.2f} ms')
+            log(f'  réplica IVF  p50={np.median(replica_ms):7.2f} ms  p95={np.percentile(replica_ms, 95):7.2f} ms'
+                f'  (sin la lectura de contenido por id)')
+            log(f'  coincidencia top-{top_k} con SQL: {np.mean(agreement):.3f}')
+    finally:
+        conn.close()
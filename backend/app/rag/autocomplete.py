@@ -0,0 +1,189 @@
+"""
+Sugerencias del chat a partir de las preguntas anteriores de los usuarios
+(tabla question_frequency, mantenida por triggers de chat_history).
+
+- Autocompletado: índice de prefijos en proceso. Las claves normalizadas (question_key,
+  calculadas por fn_normalize_question) se guardan en una lista ordenada: el rango de
+  un prefijo se ubica con bisect y se eligen las más frecuentes con heapq. Si el rango
+  supera MAX_PREFIX_SCAN claves (prefijos de 1-2 letras), su top se calcula una vez sobre
+  el rango completo y se guarda por prefijo; las relecturas lo actualizan. La clave del
+  prefijo también la calcula fn_normalize_question (question_key, con caché LRU), así
+  nunca se comparan claves de dos normalizadores distintos. La primera
+  consulta carga todas las preguntas; luego, cada AUTOCOMPLETE_REFRESH_SECONDS se releen
+  las modificadas desde la última lectura (con REREAD_MARGIN de solape, releer una fila
+  solo reemplaza su frecuencia), y cada AUTOCOMPLETE_REBUILD_SECONDS se reconstruye
+  completo (descarta preguntas cuyas conversaciones se eliminaron).
+- Preguntas sugeridas: top de fn_get_frequent_questions con caché TTL en proceso.
+"""
+import bisect
+import functools
+import heapq
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+
+from app.db import call_fn
+
+MAX_PREFIX_SCAN = 5000     # rangos más grandes usan el top guardado por prefijo
+PREFIX_TOP_SIZE = 10       # claves guardadas por prefijo de rango grande
+REREAD_MARGIN = timedelta(seconds=60)   # transacciones confirmadas con last_asked_at anterior
+
+_frequent_cache = {}       # (min_frequency, limit) -> (expira_en, preguntas)
+_frequent_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4096)
+def question_key(text):
+    """Clave de text según fn_normalize_question (cacheada: los prefijos tecleados se repiten)."""
+    row = call_fn('fn_normalize_question', (text,), fetch_one=True)
+    return (row['fn_normalize_question'] if row else None) or ''
+
+
+class QuestionPrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._keys = []          # claves normalizadas, ordenadas
+        self._entries = {}       # question_key -> [texto a mostrar, frecuencia]
+        self._prefix_top = {}    # prefijo de rango grande -> claves más frecuentes
+        self._since = None       # created_at más reciente leído
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+
+    @staticmethod
+    def _merge(rows, keys, entries, insort):
+        since = None
+        for r in rows:
+            key = r['question_key']
+            if key not in entries:
+                if insort:
+                    bisect.insort(keys, key)
+                else:
+                    keys.append(key)
+            entries[key] = [r['question'], r['frequency']]
+            if since is None or r['last_at'] > since:
+                since = r['last_at']
+        return since
+
+    def rebuild(self):
+        rows = call_fn('fn_get_question_counts', (None,), fetch_all=True) or []
+        keys, entries = [], {}
+        since = self._merge(rows, keys, entries, insort=False)
+        keys.sort()
+        now = time.monotonic()
+        with self._lock:
+            self._keys, self._entries, self._since = keys, entries, since
+            self._prefix_top = {}
+            self._loaded_at = self._refreshed_at = now
+
+    def refresh(self):
+        since = self._since - REREAD_MARGIN if self._since else None
+        rows = call_fn('fn_get_question_counts', (since,), fetch_all=True) or []
+        with self._lock:
+            previous = {r['question_key']: self._entries.get(r['question_key'], (None, 0))[1] for r in rows}
+            since = self._merge(rows, self._keys, self._entries, insort=True)
+            self._update_prefix_top(previous)
+            if since is not None and (self._since is None or since > self._since):
+                self._since = since
+            self._refreshed_at = time.monotonic()
+
+    def _update_prefix_top(self, previous):
+        """
+        Aplica a los tops guardados las claves releídas (previous: clave -> frecuencia
+        anterior). Si una clave del top bajó, otra fuera del top pudo superarla: ese
+        prefijo se descarta y se recalcula en la próxima consulta.
+        """
+        for prefix, top in list(self._prefix_top.items()):
+            for key, old_freq in previous.items():
+                if not key.startswith(prefix):
+                    continue
+                if key in top:
+                    if self._entries[key][1] < old_freq:
+                        del self._prefix_top[prefix]
+                        break
+                else:
+                    top.append(key)
+            else:
+                top.sort(key=lambda k: self._entries[k][1], reverse=True)
+                del top[PREFIX_TOP_SIZE:]
+
+    def _top_in_range(self, start, end, limit):
+        return heapq.nlargest(limit, self._keys[start:end], key=lambda k: self._entries[k][1])
+
+    def _pending(self):
+        cfg = current_app.config
+        now = time.monotonic()
+        if not self._loaded_at or now - self._loaded_at > cfg.get('AUTOCOMPLETE_REBUILD_SECONDS', 3600):
+            return 'rebuild'
+        if now - self._refreshed_at > cfg.get('AUTOCOMPLETE_REFRESH_SECONDS', 30):
+            return 'refresh'
+        return None
+
+    def maybe_refresh(self):
+        """Carga o actualiza el índice si venció su intervalo; una sola hebra a la vez."""
+        if self._pending() is None:
+            return
+        # Solo la primera carga espera; después, si otra hebra ya está actualizando,
+        # se responde con el índice actual
+        if not self._refresh_lock.acquire(blocking=not self._loaded_at):
+            return
+        try:
+            pending = self._pending()
+            if pending == 'rebuild':
+                self.rebuild()
+            elif pending == 'refresh':
+                self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def suggest(self, prefix, limit):
+        """
+        Preguntas que empiezan con prefix, de mayor a menor frecuencia:
+        [(texto, frecuencia, question_key)].
+        """
+        key = question_key(prefix)
+        if not key:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._keys, key)
+            end = bisect.bisect_left(self._keys, key + '\uffff', start)
+            if end - start <= MAX_PREFIX_SCAN or limit > PREFIX_TOP_SIZE:
+                top = self._top_in_range(start, end, limit)
+            else:
+                top = self._prefix_top.get(key)
+                if top is None:
+                    top = self._prefix_top[key] = self._top_in_range(start, end, PREFIX_TOP_SIZE)
+                top = top[:limit]
+            return [(self._entries[k][0], self._entries[k][1], k) for k in top
+                    if self._entries[k][1] > 0]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+_index = QuestionPrefixIndex()
+
+
+def suggest_questions(prefix, limit):
+    _index.maybe_refresh()
+    return _index.suggest(prefix, limit)
+
+
+def frequent_questions(min_frequency, limit):
+    """Preguntas más frecuentes (question_frequency), cacheadas SUGGESTED_QUESTIONS_CACHE_TTL segundos."""
+    ttl = current_app.config.get('SUGGESTED_QUESTIONS_CACHE_TTL', 60)
+    key = (min_frequency, limit)
+    now = time.monotonic()
+    with _frequent_lock:
+        entry = _frequent_cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+    rows = call_fn('fn_get_frequent_questions', (min_frequency, limit), fetch_all=True) or []
+    questions = [r['question'] for r in rows]
+    if ttl > 0:
+        with _frequent_lock:
+            _frequent_cache[key] = (now + ttl, questions)
+    return questions
@@ -0,0 +1,100 @@
+import threading
+import time
+from flask import current_app
+from app.rag.embeddings import get_embeddings
+
+_batcher_instance = None
+_batcher_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Aproximación barata: ~4 caracteres por token (suficiente para dimensionar batches)."""
+    return max(1, len(text) // 4)
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa textos por presupuesto aproximado de tokens en lugar de un número fijo de items.
+    El presupuesto se adapta a la latencia observada por batch: crece si los batches llenos
+    responden muy por debajo de target_latency y se reduce si la superan. Un batch que falla
+    se divide en mitades y se reintenta, así un texto problemático no tumba el documento.
+    """
+
+    def __init__(self, embed_fn, token_budget=8192, max_batch=64, target_latency=5.0,
+                 min_budget=256, max_budget=65536, adaptive=True):
+        self.embed_fn = embed_fn
+        self.adaptive = adaptive
+        self.token_budget = token_budget
+        self.max_batch = max_batch
+        self.target_latency = target_latency
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self._lock = threading.Lock()
+
+    def plan(self, items, key=None):
+        """Generador de batches de `items` según el presupuesto vigente al momento de cortar."""
+        batch, tokens = [], 0
+        for item in items:
+            t = estimate_tokens(key(item) if key else item)
+            if batch and (tokens + t > self.token_budget or len(batch) >= self.max_batch):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(item)
+            tokens += t
+        if batch:
+            yield batch
+
+    def embed_all(self, texts):
+        vectors = []
+        for batch in self.plan(texts):
+            vectors.extend(self.embed(batch))
+        return vectors
+
+    def embed(self, texts):
+        """Embebe un batch; ante un error lo divide en dos y reintenta cada mitad."""
+        tokens = sum(estimate_tokens(t) for t in texts)
+        start = time.perf_counter()
+        try:
+            vectors = self.embed_fn(texts)
+        except Exception as e:
+            if len(texts) == 1:
+                raise
+            self._shrink()
+            current_app.logger.warning('[EmbeddingBatcher] batch de %d textos falló, dividiendo: %s',
+                                       len(texts), e)
+            mid = len(texts) // 2
+            return self.embed(texts[:mid]) + self.embed(texts[mid:])
+        self._observe(tokens, time.perf_counter() - start)
+        return vectors
+
+    def _observe(self, tokens, elapsed):
+        if not self.adaptive:
+            return
+        with self._lock:
+            if elapsed > self.target_latency:
+                scaled = int(self.token_budget * self.target_latency / elapsed)
+                self.token_budget = max(self.min_budget, scaled)
+            elif elapsed < self.target_latency / 2 and tokens >= self.token_budget * 0.75:
+                self.token_budget = min(self.max_budget, int(self.token_budget * 1.25))
+
+    def _shrink(self):
+        if not self.adaptive:
+            return
+        with self._lock:
+            self.token_budget = max(self.min_budget, self.token_budget // 2)
+
+
+def get_embedding_batcher():
+    """Batcher compartido por el proceso (el presupuesto aprendido persiste entre documentos)."""
+    global _batcher_instance
+    if _batcher_instance is None:
+        with _batcher_lock:
+            if _batcher_instance is None:
+                cfg = current_app.config
+                _batcher_instance = EmbeddingBatcher(
+                    embed_fn=get_embeddings().embed_documents,
+                    token_budget=cfg.get('EMBEDDING_TOKEN_BUDGET', 8192),
+                    max_batch=cfg.get('EMBEDDING_MAX_BATCH', 64),
+                    target_latency=cfg.get('EMBEDDING_TARGET_LATENCY', 5.0),
+                )
+    return _batcher_instance
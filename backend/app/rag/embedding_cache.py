@@ -0,0 +1,86 @@
+import hashlib
+from contextlib import contextmanager
+from flask import current_app
+from app.db import call_fn, get_conn_raw, put_conn_raw
+from app.rag.batcher import get_embedding_batcher
+from app.rag.embeddings import get_embedding_model_key
+from app.vector_types import to_vectors
+
+
+def text_hash(text):
+    """sha256 hex del texto exacto que se envía al modelo de embeddings."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+@contextmanager
+def _cache_conn():
+    """
+    Conexión propia del pool para la caché: sus lecturas, escrituras y rollbacks
+    (call_fn revierte al fallar) no tocan la transacción del llamador.
+    """
+    conn = get_conn_raw()
+    try:
+        yield conn
+    finally:
+        put_conn_raw(conn)
+
+
+def embed_documents_cached(texts):
+    """
+    Embebe `texts` consultando primero la caché persistente (tabla embedding_cache).
+    Solo los textos sin entrada para (modelo, sha256(texto)) se envían al backend
+    (agrupados por presupuesto de tokens, ver app.rag.batcher);
+    los nuevos vectores se guardan para reutilizarlos en reprocesos y re-subidas.
+    La caché usa su propia conexión (_cache_conn): un fallo de caché se registra y se
+    sigue sin ella, sin revertir lo que el llamador tenga pendiente.
+    Retorna los vectores (np.float32) en el mismo orden que `texts`.
+    """
+    if not texts:
+        return []
+
+    batcher = get_embedding_batcher()
+    if not current_app.config.get('EMBEDDING_CACHE_ENABLED', True):
+        return to_vectors(batcher.embed_all(texts))
+
+    model = get_embedding_model_key()
+    hashes = [text_hash(t) for t in texts]
+
+    vectors = {}
+    try:
+        with _cache_conn() as conn:
+            rows = call_fn('fn_get_cached_embeddings', (model, list(set(hashes))), fetch_all=True, conn=conn)
+        vectors = {r['text_hash']: r['embedding'] for r in rows or []}
+    except Exception as e:
+        current_app.logger.warning('[EmbeddingCache] lectura omitida: %s', e)
+
+    # Textos repetidos dentro del mismo batch se embeben una sola vez
+    misses = {}
+    for h, t in zip(hashes, texts):
+        if h not in vectors and h not in misses:
+            misses[h] = t
+
+    if misses:
+        miss_hashes = list(misses)
+        miss_vectors = to_vectors(batcher.embed_all([misses[h] for h in miss_hashes]))
+        vectors.update(zip(miss_hashes, miss_vectors))
+        try:
+            with _cache_conn() as conn:
+                call_fn('fn_store_cached_embeddings', (model, miss_hashes, miss_vectors), conn=conn)
+        except Exception as e:
+            current_app.logger.warning('[EmbeddingCache] escritura omitida: %s', e)
+
+    return [vectors[h] for h in hashes]
+
+
+def evict_embedding_cache():
+    """Recorta la caché a EMBEDDING_CACHE_MAX_ENTRIES eliminando las entradas menos usadas."""
+    if not current_app.config.get('EMBEDDING_CACHE_ENABLED', True):
+        return 0
+    max_entries = current_app.config.get('EMBEDDING_CACHE_MAX_ENTRIES', 500000)
+    try:
+        with _cache_conn() as conn:
+            row = call_fn('fn_evict_embedding_cache', (max_entries,), fetch_one=True, conn=conn)
+        return row['fn_evict_embedding_cache'] if row else 0
+    except Exception as e:
+        current_app.logger.warning('[EmbeddingCache] eviction omitida: %s', e)
+        return 0
@@ -1,18 +1,151 @@
+import hashlib
+import math
+import os
+import re
 import threading
-from langchain_ollama import OllamaEmbeddings
 from flask import current_app
 
-_embeddings_instance = None
+_embeddings_instances = {}
 _embeddings_lock = threading.Lock()
 
 
-def get_embeddings():
-    global _embeddings_instance
-    if _embeddings_instance is None:
+class HashingEmbeddings:
+    """
+    Embedder determinista sin modelo: feature hashing de unigramas y bigramas, normalizado L2.
+    Pensado para tests y benchmarks offline; no comparte espacio vectorial con nomic-embed-text.
+    """
+
+    def __init__(self, dim=768):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def _embed(self, text):
+        vec = [0.0] * self.dim
+        tokens = re.findall(r'\w+', text.lower())
+        features = tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+            vec[h % self.dim] += 1.0 if h >> 63 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+
+class OnnxEmbeddings:
+    """
+    Backend en proceso (CPU) con onnxruntime. Carga desde `model_dir` un `model.onnx`
+    y su `tokenizer.json`; aplica mean pooling y normalización L2 como Ollama.
+    Para mezclarlo con vectores ya indexados el ONNX debe ser el mismo modelo que
+    EMBEDDING_MODEL (p.ej. nomic-embed-text-v1.5 exportado).
+    """
+
+    def __init__(self, model_dir, max_length=2048, batch_size=16, num_threads=0):
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self._np = np
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, 'model.onnx'), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[i:i + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+    def _embed_batch(self, texts):
+        np = self._np
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+
+        output = self.session.run(None, feeds)[0]
+        if output.ndim == 3:
+            mask = attention_mask[..., None].astype(output.dtype)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        output = output / np.clip(np.linalg.norm(output, axis=1, keepdims=True), 1e-12, None)
+        return list(np.ascontiguousarray(output, dtype=np.float32))
+
+
+def _build_ollama(cfg):
+    from langchain_ollama import OllamaEmbeddings
+    return OllamaEmbeddings(model=cfg['EMBEDDING_MODEL'], base_url=cfg['OLLAMA_BASE_URL'])
+
+
+def _build_onnx(cfg):
+    model_dir = cfg.get('EMBEDDING_ONNX_PATH', '')
+    if not model_dir or not os.path.isdir(model_dir):
+        raise ValueError(f'EMBEDDING_ONNX_PATH no es un directorio válido: {model_dir!r}')
+    return OnnxEmbeddings(
+        model_dir,
+        max_length=cfg.get('EMBEDDING_ONNX_MAX_LENGTH', 2048),
+        batch_size=cfg.get('EMBEDDING_ONNX_BATCH', 16),
+        num_threads=cfg.get('EMBEDDING_ONNX_THREADS', 0),
+    )
+
+
+def _build_hashing(cfg):
+    return HashingEmbeddings(dim=cfg.get('EMBEDDING_DIM', 768))
+
+
+EMBEDDING_BACKENDS = {
+    'ollama': _build_ollama,
+    'onnx': _build_onnx,
+    'hashing': _build_hashing,
+}
+
+
+def _resolve_backend(backend=None):
+    backend = (backend or current_app.config.get('EMBEDDING_BACKEND', 'ollama')).lower()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f'Backend de embeddings no soportado: {backend}')
+    return backend
+
+
+def get_embeddings(backend=None):
+    """Instancia compartida del backend (EMBEDDING_BACKEND por defecto) para embeber documentos."""
+    backend = _resolve_backend(backend)
+    instance = _embeddings_instances.get(backend)
+    if instance is None:
         with _embeddings_lock:
-            if _embeddings_instance is None:
-                _embeddings_instance = OllamaEmbeddings(
-                    model=current_app.config['EMBEDDING_MODEL'],
-                    base_url=current_app.config['OLLAMA_BASE_URL'],
-                )
-    return _embeddings_instance
+            instance = _embeddings_instances.get(backend)
+            if instance is None:
+                instance = EMBEDDING_BACKENDS[backend](current_app.config)
+                _embeddings_instances[backend] = instance
+    return instance
+
+
+def get_query_embeddings():
+    """Backend para embeber consultas; EMBEDDING_QUERY_BACKEND permite sacarlas de la cola de Ollama."""
+    return get_embeddings(current_app.config.get('EMBEDDING_QUERY_BACKEND') or None)
+
+
+def get_embedding_model_key(backend=None):
+    """
+    Identificador del espacio vectorial para claves de caché. ollama y onnx sirven el mismo
+    EMBEDDING_MODEL (mismo espacio); el embedder por hashing tiene su propio espacio.
+    """
+    backend = _resolve_backend(backend)
+    if backend == 'hashing':
+        return f"hashing-{current_app.config.get('EMBEDDING_DIM', 768)}"
+    return current_app.config['EMBEDDING_MODEL']
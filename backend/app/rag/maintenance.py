@@ -0,0 +1,115 @@
+from app.db import call_fn, execute, get_conn_raw, put_conn_raw
+
+# Índices HNSW parciales de embedding (tables.sql): sufijo -> predicado
+HNSW_PARTIAL_INDEXES = (
+    ('content', "chunk_type = 'content' AND searchable AND NOT rag_excluded"),
+    ('content_excluded', "chunk_type = 'content' AND searchable AND rag_excluded"),
+    ('summary', "chunk_type = 'summary' AND searchable AND NOT rag_excluded"),
+)
+
+
+def _backfill(fn_name, batch_size, conn, log):
+    total = 0
+    while True:
+        row = call_fn(fn_name, (batch_size,), fetch_one=True, conn=conn)
+        count = row[fn_name] if row else 0
+        if not count:
+            return total
+        total += count
+        log(f'  {fn_name}: {total} filas')
+
+
+def migrate_to_halfvec(batch_size=5000, drop_float32=False, log=print):
+    """
+    Migración en línea de document_chunks a halfvec. Las búsquedas siguen usando float32
+    hasta el último paso:
+      1. vector_storage = 'dual': los chunks nuevos se escriben en ambas columnas.
+      2. Backfill embedding -> embedding_half en lotes (cada lote es una transacción corta).
+      3. CREATE INDEX CONCURRENTLY de los HNSW halfvec parciales (ver HNSW_PARTIAL_INDEXES).
+      4. vector_storage = 'halfvec' (búsquedas e inserciones pasan a media precisión).
+      5. Opcional: DROP INDEX CONCURRENTLY de los HNSW float32 y vaciado de la columna float32.
+    """
+    conn = get_conn_raw()
+    try:
+        conn.autocommit = True
+
+        if call_fn('fn_get_vector_storage', fetch_one=True, conn=conn)['fn_get_vector_storage'] != 'halfvec':
+            log('1/4 Activando escritura dual...')
+            call_fn('fn_set_rag_setting', ('vector_storage', 'dual'), conn=conn)
+
+            log('2/4 Copiando embeddings a halfvec...')
+            _backfill('fn_backfill_halfvec', batch_size, conn, log)
+
+            log('3/4 Creando índices HNSW halfvec (CONCURRENTLY)...')
+            for suffix, predicate in HNSW_PARTIAL_INDEXES:
+                execute(
+                    f'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chunks_embedding_half_{suffix} '
+                    f'ON document_chunks USING hnsw (embedding_half halfvec_cosine_ops) '
+                    f'WHERE {predicate}',
+                    conn=conn,
+                )
+
+            log('4/4 Cambiando búsquedas a halfvec...')
+            call_fn('fn_set_rag_setting', ('vector_storage', 'halfvec'), conn=conn)
+            # Chunks escritos en modo float32 justo antes del cambio a 'dual'
+            _backfill('fn_backfill_halfvec', batch_size, conn, log)
+        else:
+            log('vector_storage ya es halfvec.')
+
+        if drop_float32:
+            log('Eliminando índices HNSW float32 (CONCURRENTLY)...')
+            for suffix, _ in HNSW_PARTIAL_INDEXES:
+                execute(f'DROP INDEX CONCURRENTLY IF EXISTS idx_chunks_embedding_{suffix}', conn=conn)
+            log('Vaciando columna float32...')
+            _backfill('fn_clear_float32_embeddings', batch_size, conn, log)
+            log('Ejecute VACUUM (ANALYZE) document_chunks para reutilizar el espacio liberado.')
+
+        log('Migración completada.')
+    finally:
+        conn.autocommit = False
+        put_conn_raw(conn)
+
+
+def backfill_binary_signatures(batch_size=5000, log=print):
+    """Calcula embedding_bits de los chunks existentes (requerido por RAG_RETRIEVAL_MODE='binary')."""
+    conn = get_conn_raw()
+    try:
+        conn.autocommit = True
+        total = _backfill('fn_backfill_bits', batch_size, conn, log)
+        log(f'Firmas binarias calculadas: {total}.')
+    finally:
+        conn.autocommit = False
+        put_conn_raw(conn)
+
+
+def backfill_summary_vectors(batch_size=5000, log=print):
+    """Calcula embedding_small (256-d) de los chunks 'summary' existentes para el Stage 1."""
+    conn = get_conn_raw()
+    try:
+        conn.autocommit = True
+        total = _backfill('fn_backfill_summary_small', batch_size, conn, log)
+        log(f'Vectores de resumen calculados: {total}.')
+    finally:
+        conn.autocommit = False
+        put_conn_raw(conn)
+
+
+def gc_chunk_generations(batch_size=5000, log=print):
+    """
+    Elimina chunks de generaciones reemplazadas o fallidas de todos los documentos y recorta
+    el log de cambios de la réplica ANN.
+    """
+    from app.rag.pipeline import collect_chunk_generations
+    conn = get_conn_raw()
+    try:
+        total = collect_chunk_generations(conn=conn, batch_size=batch_size)
+        log(f'Chunks de generaciones inactivas eliminados: {total}.')
+    finally:
+        put_conn_raw(conn)
+    # Los borrados del GC también pasan por chunk_change_log
+    from app.rag.ann_replica import prune_change_log
+    prune_change_log(log=log)
+
+
+def get_vector_storage_stats():
+    return call_fn('fn_get_vector_storage_stats', fetch_one=True)
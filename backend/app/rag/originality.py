@@ -3,13 +3,12 @@ import json
 from app.db import call_fn, get_conn_raw, put_conn_raw
 from app.document_processing.processor import get_processor
 from app.document_processing.chunker import chunk_text
-from app.rag.embeddings import get_embeddings
+from app.rag.embedding_cache import embed_documents_cached, evict_embedding_cache
+from app.rag.batcher import get_embedding_batcher
+from app.rag.vector_store import iter_similar_batches
 import psycopg2.extras
 
 
-BATCH_SIZE = 32
-
-
 def _plagiarism_level_for_score(max_score):
     """Nivel de similitud de un chunk individual."""
     if max_score >= 0.85:
@@ -138,27 +137,26 @@ def _run(check_id, conn, app):
         texts = [c['text'] for c in chunks]
         total_chunks = len(texts)
 
-        # 3. Embed in batches
-        embeddings_model = get_embeddings()
+        # 3. Embed in token-budget batches (reusing cached vectors of previously seen text)
         all_embeddings = []
-        for i in range(0, len(texts), BATCH_SIZE):
-            batch = texts[i:i + BATCH_SIZE]
-            all_embeddings.extend(embeddings_model.embed_documents(batch))
+        for batch in get_embedding_batcher().plan(texts):
+            all_embeddings.extend(embed_documents_cached(batch))
+        evict_embedding_cache()
 
-        # 4. Compare each chunk against indexed documents
+        # 4. Compare chunks against indexed documents, ORIGINALITY_SEARCH_BATCH chunks per query
         # Accumulate per document_id: max_score, list of scores, pages_hit set, chunk_hits, sample_pairs
         doc_stats = {}  # doc_id -> {title, category_id, scores[], pages_hit set, chunk_hits, sample_pairs[]}
         flagged_chunks = 0
 
-        for idx, (chunk, embedding) in enumerate(zip(chunks, all_embeddings)):
-            results = call_fn(
-                'fn_search_similar',
-                (embedding, top_k_per_chunk, 0.35, '', True),
-                fetch_all=True,
-                conn=conn
-            )
+        for idx, results in iter_similar_batches(
+            all_embeddings, top_k_per_chunk, 0.35, conn,
+            include_excluded=True,
+            batch_size=app.config.get('ORIGINALITY_SEARCH_BATCH', 200),
+            ef_search=app.config.get('RAG_HNSW_EF_SEARCH', 100),
+        ):
             if not results:
                 continue
+            chunk = chunks[idx]
 
             top_result = results[0]
             top_score = float(top_result['score'])
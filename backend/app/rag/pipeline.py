@@ -1,103 +1,229 @@
-from psycopg2.extras import Json
+from collections import defaultdict, deque
 from app.db import call_fn, get_conn_raw, put_conn_raw
 from app.document_processing.processor import get_processor
 from app.document_processing.chunker import chunk_text
-from app.rag.vector_store import add_chunks_to_postgres
-
-
-def process_document(document_id, app=None):
+from app.utils.file_utils import delete_file
+from app.rag.vector_store import (
+    add_chunks_to_postgres, insert_chunks, embed_chunks, chunk_content_hash, apply_chunk_diff,
+)
+
+
+def process_document(document_id, app=None, incremental=False):
+    """
+    Extrae, fragmenta y embebe el documento en una generación nueva de chunks.
+    La generación activa (si es un reproceso) sigue respondiendo búsquedas hasta que
+    fn_activate_document_generation la reemplaza en un solo UPDATE; si algo falla,
+    los datos anteriores quedan intactos. Si otro procesamiento reservó una generación más
+    nueva mientras tanto, esta se descarta sin activarse. Las generaciones inactivas se
+    eliminan al final, en este mismo hilo (y con `flask vectors gc`).
+    incremental=True (re-subida de una versión nueva): si el documento ya tiene chunks
+    activos, solo se embeben los chunks cuyo contenido cambió (ver _process_incremental).
+    """
     conn = get_conn_raw()
     try:
         doc = call_fn('fn_get_document_for_processing', (document_id,), fetch_one=True, conn=conn)
         if not doc:
             raise ValueError(f'Documento no encontrado: {document_id}')
 
-        call_fn('fn_update_document_status', (document_id, 'processing'), conn=conn)
+        if incremental:
+            existing = call_fn('fn_get_document_chunk_hashes', (document_id,), fetch_all=True, conn=conn)
+            if existing:
+                _process_incremental(doc, existing, app, conn)
+                return
+
+        generation = call_fn('fn_begin_document_generation', (document_id,),
+                             fetch_one=True, conn=conn)['fn_begin_document_generation']
 
         try:
-            # 1. Extract text
-            processor = get_processor(doc['file_type'])
-            pages = processor.extract_text(doc['file_path'], app=app)
-
-            # 2. Auto-categorize if no category was provided
-            resolved_category_id = doc['category_id'] or ''
-            if not resolved_category_id and app is not None:
-                try:
-                    from app.rag.categorizer import auto_categorize
-                    sample = ' '.join(p['content'] for p in pages if p.get('content'))[:2000]
-                    categories = call_fn('fn_list_categories', (True,), fetch_all=True, conn=conn)
-                    if categories:
-                        detected_id = auto_categorize(sample, doc['title'], categories, app)
-                        if detected_id:
-                            call_fn('fn_set_document_category', (document_id, detected_id), conn=conn)
-                            resolved_category_id = detected_id
-                except Exception as e:
-                    print(f'[AutoCategorize skipped] {document_id}: {e}')
-
-            # 3. Chunk text
-            all_chunks = []
-            chunk_index = 0
-            for page_data in pages:
-                chunks = chunk_text(page_data['content'])
-                for chunk_content in chunks:
-                    if len(chunk_content.strip()) < 50:
-                        continue
-                    all_chunks.append({
-                        'content': chunk_content,
-                        'document_id': doc['id'],
-                        'title': doc['title'],
-                        'category_id': resolved_category_id,
-                        'page': page_data.get('page', 1),
-                        'chunk_index': chunk_index,
-                    })
-                    chunk_index += 1
-
-            if not all_chunks:
-                raise ValueError('No se generaron chunks del documento.')
-
-            # 4. Embed and store chunks with vectors in PostgreSQL
-            try:
-                add_chunks_to_postgres(all_chunks)
-            except Exception as e:
-                call_fn('fn_delete_chunks_by_document', (document_id,), conn=conn)
-                raise
-
-            # 5. Update document status
-            call_fn('fn_update_document_status', (
-                document_id, 'completed', None, len(all_chunks)
-            ), conn=conn)
-
-            if resolved_category_id:
-                call_fn('fn_update_category_doc_count', (resolved_category_id,), conn=conn)
-
-            # 6. Generate and store document summary
-            if app is not None:
-                try:
-                    summary_text = _generate_summary(all_chunks, doc['title'], app)
-                    if summary_text:
-                        # Save summary text in documents.summary
-                        call_fn('fn_update_document_summary', (document_id, summary_text), conn=conn)
-                        # Save summary as an embedded chunk for semantic search (Stage 1)
-                        from app.rag.embeddings import get_embeddings
-                        embeddings_model = get_embeddings()
-                        summary_vector = embeddings_model.embed_query(summary_text)
-                        call_fn('fn_create_chunk', (
-                            document_id, -1, summary_text, summary_vector,
-                            Json({'page': 1, 'title': doc['title']}), 'summary'
-                        ), fetch_one=True, conn=conn)
-                except Exception as e:
-                    print(f'[Summary skipped] {document_id}: {e}')
-
-            print(f"Documento procesado: {doc['title']} ({len(all_chunks)} chunks)")
+            # 1-3. Extract, auto-categorize and chunk
+            all_chunks, _ = _extract_chunks(doc, app, conn)
+            for chunk in all_chunks:
+                chunk['generation'] = generation
+
+            # 4. Embed and store chunks of the new generation (una transacción; rollback si falla)
+            add_chunks_to_postgres(all_chunks)
+
+            # 5. Generate and store document summary (Stage 1) in the same generation
+            summary = _build_summary(doc, all_chunks, generation, app)
+            if summary:
+                insert_chunks([summary[0]], [summary[1]], conn=conn, chunk_type='summary')
+
+            # 6. Atomic swap: the new generation (and its summary text) becomes visible,
+            #    status -> completed
+            activated = call_fn('fn_activate_document_generation', (
+                document_id, generation, len(all_chunks), summary[0]['content'] if summary else None
+            ), fetch_one=True, conn=conn)['fn_activate_document_generation']
+            if not activated:
+                print(f"Generacion {generation} descartada: {doc['title']} tiene un procesamiento mas reciente")
+                return
+            _release_previous_file(document_id, conn)
+
+            print(f"Documento procesado: {doc['title']} ({len(all_chunks)} chunks, generacion {generation})")
 
         except Exception as e:
-            call_fn('fn_update_document_status', (document_id, 'failed', str(e)), conn=conn)
+            call_fn('fn_abort_document_generation', (document_id, generation, str(e)), conn=conn)
             raise
 
+        finally:
+            # 7. Garbage-collect superseded (or failed) generations in small batches
+            try:
+                collect_chunk_generations(document_id, conn=conn)
+            except Exception as e:
+                print(f'[GC skipped] {document_id}: {e}')
+
     finally:
         put_conn_raw(conn)
 
 
+def _process_incremental(doc, existing, app, conn):
+    """
+    Diff por hash de contenido contra la generación activa: los chunks sin cambios
+    conservan su fila y su vector (solo se renumeran), solo los nuevos se embeben y
+    los que desaparecieron se borran. Todo se aplica en una transacción.
+    """
+    document_id = doc['id']
+    call_fn('fn_update_document_status', (document_id, 'processing'), conn=conn)
+
+    try:
+        all_chunks, _ = _extract_chunks(doc, app, conn)
+        generation = existing[0]['generation']
+
+        # hash -> ids de chunks existentes (un mismo texto puede repetirse en el documento)
+        available = defaultdict(deque)
+        summary_ids = []
+        for row in existing:
+            if row['chunk_type'] == 'summary':
+                summary_ids.append(row['id'])
+            else:
+                available[row['content_hash']].append(row['id'])
+
+        new_chunks, kept = [], []
+        for chunk in all_chunks:
+            chunk['generation'] = generation
+            ids = available.get(chunk_content_hash(chunk))
+            if ids:
+                kept.append((ids.popleft(), chunk['chunk_index'], chunk['page']))
+            else:
+                new_chunks.append(chunk)
+        delete_ids = [chunk_id for ids in available.values() for chunk_id in ids]
+
+        new_vectors = embed_chunks(new_chunks)
+
+        # El resumen solo se regenera si el contenido cambió
+        summary = None
+        if new_chunks or delete_ids:
+            summary = _build_summary(doc, all_chunks, generation, app)
+            if summary:
+                delete_ids.extend(summary_ids)
+
+        inserted = apply_chunk_diff(
+            document_id, new_chunks, new_vectors, delete_ids, kept, len(all_chunks), conn,
+            summary=summary,
+        )
+        _release_previous_file(document_id, conn)
+
+        print(f"Documento actualizado: {doc['title']} ({len(kept)} sin cambios, "
+              f"{inserted} nuevos, {len(delete_ids)} eliminados)")
+
+    except Exception as e:
+        call_fn('fn_update_document_status', (document_id, 'failed', str(e)), conn=conn)
+        raise
+
+
+def _release_previous_file(document_id, conn):
+    """Con la versión nueva ya publicada, borra del disco el archivo que reemplazó la re-subida."""
+    try:
+        row = call_fn('fn_release_previous_file', (document_id,), fetch_one=True, conn=conn)
+        delete_file(row['fn_release_previous_file'] if row else None)
+    except Exception as e:
+        print(f'[Previous file kept] {document_id}: {e}')
+
+
+def _extract_chunks(doc, app, conn):
+    """Extrae texto, auto-categoriza si hace falta y fragmenta. Retorna (chunks, category_id)."""
+    document_id = doc['id']
+
+    # 1. Extract text
+    processor = get_processor(doc['file_type'])
+    pages = processor.extract_text(doc['file_path'], app=app)
+
+    # 2. Auto-categorize if no category was provided
+    resolved_category_id = doc['category_id'] or ''
+    if not resolved_category_id and app is not None:
+        try:
+            from app.rag.categorizer import auto_categorize
+            sample = ' '.join(p['content'] for p in pages if p.get('content'))[:2000]
+            categories = call_fn('fn_list_categories', (True,), fetch_all=True, conn=conn)
+            if categories:
+                detected_id = auto_categorize(sample, doc['title'], categories, app)
+                if detected_id:
+                    call_fn('fn_set_document_category', (document_id, detected_id), conn=conn)
+                    resolved_category_id = detected_id
+        except Exception as e:
+            print(f'[AutoCategorize skipped] {document_id}: {e}')
+
+    # 3. Chunk text
+    all_chunks = []
+    chunk_index = 0
+    for page_data in pages:
+        chunks = chunk_text(page_data['content'])
+        for chunk_content in chunks:
+            if len(chunk_content.strip()) < 50:
+                continue
+            all_chunks.append({
+                'content': chunk_content,
+                'document_id': doc['id'],
+                'title': doc['title'],
+                'category_id': resolved_category_id,
+                'page': page_data.get('page', 1),
+                'chunk_index': chunk_index,
+            })
+            chunk_index += 1
+
+    if not all_chunks:
+        raise ValueError('No se generaron chunks del documento.')
+
+    return all_chunks, resolved_category_id
+
+
+def _build_summary(doc, chunks, generation, app):
+    """
+    Genera el resumen y lo embebe como chunk 'summary' para el Stage 1. Retorna (chunk, vector)
+    o None; un fallo del LLM no detiene el procesamiento. El texto se guarda en
+    documents.summary al activar la generación o aplicar el diff, no aquí.
+    """
+    if app is None:
+        return None
+    try:
+        summary_text = _generate_summary(chunks, doc['title'], app)
+        if not summary_text:
+            return None
+        from app.rag.embeddings import get_embeddings
+        summary_vector = get_embeddings().embed_query(summary_text)
+        return {
+            'document_id': doc['id'],
+            'chunk_index': -1,
+            'content': summary_text,
+            'page': 1,
+            'title': doc['title'],
+            'generation': generation,
+        }, summary_vector
+    except Exception as e:
+        print(f'[Summary skipped] {doc["id"]}: {e}')
+        return None
+
+
+def collect_chunk_generations(document_id=None, conn=None, batch_size=5000):
+    """Elimina por lotes los chunks de generaciones inactivas (document_id None = todos)."""
+    total = 0
+    while True:
+        row = call_fn('fn_gc_chunk_generations', (document_id, batch_size), fetch_one=True, conn=conn)
+        count = row['fn_gc_chunk_generations'] if row else 0
+        if not count:
+            return total
+        total += count
+
+
 def _generate_summary(chunks, title, app):
     """Genera un resumen del documento usando el LLM."""
     from langchain_ollama import ChatOllama
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g
+from app.rag.embeddings import get_query_embeddings, get_embedding_model_key
+from app.vector_types import to_vector, to_vectors
+
+# Caché LRU/TTL en proceso: (modelo, texto normalizado) -> (expira_en, vector np.float32)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'request_hits': 0}
+
+
+def _normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def _cache_get(key, now):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            _stats['misses'] += 1
+            return None
+        expires_at, vector = entry
+        if expires_at < now:
+            del _cache[key]
+            _stats['misses'] += 1
+            return None
+        _cache.move_to_end(key)
+        _stats['hits'] += 1
+        return vector
+
+
+def _cache_put(key, vector, now, max_size, ttl):
+    with _cache_lock:
+        _cache[key] = (now + ttl, vector)
+        _cache.move_to_end(key)
+        while len(_cache) > max_size:
+            _cache.popitem(last=False)
+
+
+def embed_query_cached(query):
+    """
+    Embebe una consulta una sola vez por request (memo en flask.g) y reutiliza
+    vectores entre requests mediante una caché LRU con TTL en el proceso.
+    """
+    cfg = current_app.config
+    key = (get_embedding_model_key(cfg.get('EMBEDDING_QUERY_BACKEND') or None), _normalize(query))
+
+    memo = g.setdefault('query_vectors', {})
+    if key in memo:
+        with _cache_lock:
+            _stats['request_hits'] += 1
+        return memo[key]
+
+    max_size = cfg.get('RAG_QUERY_CACHE_SIZE', 1024)
+    ttl = cfg.get('RAG_QUERY_CACHE_TTL', 3600)
+    now = time.monotonic()
+
+    vector = _cache_get(key, now) if max_size > 0 else None
+    if vector is None:
+        vector = to_vector(get_query_embeddings().embed_query(query))
+        if max_size > 0:
+            _cache_put(key, vector, now, max_size, ttl)
+
+    memo[key] = vector
+    return vector
+
+
+def embed_queries_cached(queries):
+    """
+    Como embed_query_cached para varias consultas (variantes del expander): las que no
+    están en el memo del request ni en la caché se embeben juntas en una sola llamada
+    a embed_documents. Retorna los vectores en el mismo orden que queries.
+    """
+    cfg = current_app.config
+    model_key = get_embedding_model_key(cfg.get('EMBEDDING_QUERY_BACKEND') or None)
+    keys = [(model_key, _normalize(q)) for q in queries]
+
+    memo = g.setdefault('query_vectors', {})
+    max_size = cfg.get('RAG_QUERY_CACHE_SIZE', 1024)
+    ttl = cfg.get('RAG_QUERY_CACHE_TTL', 3600)
+    now = time.monotonic()
+
+    misses = {}
+    for key, query in zip(keys, queries):
+        if key in memo:
+            with _cache_lock:
+                _stats['request_hits'] += 1
+            continue
+        vector = _cache_get(key, now) if max_size > 0 else None
+        if vector is None:
+            misses.setdefault(key, query)
+        else:
+            memo[key] = vector
+
+    if misses:
+        miss_keys = list(misses)
+        vectors = to_vectors(get_query_embeddings().embed_documents([misses[k] for k in miss_keys]))
+        for key, vector in zip(miss_keys, vectors):
+            if max_size > 0:
+                _cache_put(key, vector, now, max_size, ttl)
+            memo[key] = vector
+
+    return [memo[key] for key in keys]
+
+
+def get_query_cache_stats():
+    with _cache_lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {
+            'size': len(_cache),
+            'hits': _stats['hits'],
+            'misses': _stats['misses'],
+            'request_hits': _stats['request_hits'],
+            'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else 0.0,
+        }
+
+
+def clear_query_cache():
+    with _cache_lock:
+        _cache.clear()
+        for k in _stats:
+            _stats[k] = 0
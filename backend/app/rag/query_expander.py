@@ -9,8 +9,13 @@ def expand_query(question: str) -> list[str]:
     Genera hasta 2 reformulaciones alternativas de la pregunta para ampliar el recall.
     Siempre retorna una lista que incluye la pregunta original.
     Falla silenciosamente: retorna [question] si el LLM o el parsing falla.
+    En modo híbrido (RAG_HYBRID_SEARCH) la búsqueda léxica cubre los términos exactos y,
+    con RAG_HYBRID_SKIP_EXPANSION, se omite la llamada al LLM.
     """
-    if not current_app.config.get('RAG_ENABLE_QUERY_EXPANSION', True):
+    cfg = current_app.config
+    if not cfg.get('RAG_ENABLE_QUERY_EXPANSION', True):
+        return [question]
+    if cfg.get('RAG_HYBRID_SEARCH', False) and cfg.get('RAG_HYBRID_SKIP_EXPANSION', True):
         return [question]
 
     try:
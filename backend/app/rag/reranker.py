@@ -1,12 +1,18 @@
 from flask import current_app
-from app.rag.vector_store import search_similar
+from app.rag.query_cache import embed_query_cached, embed_queries_cached
+from app.rag.vector_store import (
+    search_similar, search_summaries, search_similar_multi, search_summaries_multi,
+    search_lexical_multi,
+)
 
 
 def two_stage_retrieve(query, category_id=None, top_k=None, score_threshold=None):
     """
-    Stage 1 (Summary): Busca en chunks de resumen para identificar documentos candidatos.
+    Stage 1 (Summary): Busca en chunks de resumen (embedding_small, 256-d) para identificar
+                       documentos candidatos.
     Stage 2 (Content): Busca chunks de contenido, restringido a los documentos del Stage 1.
     Fallback: Si Stage 2 no devuelve nada con el filtro, busca en todos los documentos.
+    Híbrido (RAG_HYBRID_SEARCH): fusiona los candidatos con la búsqueda léxica (RRF).
     Diversity filter: acepta máximo RAG_MAX_CHUNKS_PER_DOC chunks por documento.
     """
     cfg = current_app.config
@@ -21,13 +27,12 @@ def two_stage_retrieve(query, category_id=None, top_k=None, score_threshold=None
     candidate_k = min(top_k * multiplier, 40)
     candidate_threshold = max(score_threshold * factor, 0.20)
 
-    # NIVEL 1: buscar en resúmenes para identificar documentos relevantes
-    summary_hits = search_similar(
+    # NIVEL 1: buscar en resúmenes (vector reducido de 256-d) para identificar documentos relevantes
+    summary_hits = search_summaries(
         query=query,
         top_k=min(top_k * 3, 15),
         score_threshold=max(score_threshold * 0.6, 0.20),
         category_id=category_id,
-        chunk_type='summary',
     )
     candidate_doc_ids = list({h['document_id'] for h in summary_hits}) if summary_hits else None
 
@@ -51,14 +56,120 @@ def two_stage_retrieve(query, category_id=None, top_k=None, score_threshold=None
             chunk_type='content',
         )
 
+    if cfg.get('RAG_HYBRID_SEARCH', False):
+        candidates = _hybrid([query], [embed_query_cached(query)], [candidates], category_id)[0]
+
+    return _diversify(candidates, top_k, cfg.get('RAG_MAX_CHUNKS_PER_DOC', 2))
+
+
+def two_stage_retrieve_multi(queries, category_id=None, top_k=None, score_threshold=None):
+    """
+    two_stage_retrieve para varias variantes de la consulta con un viaje a la BD por etapa:
+    las variantes se embeben juntas (embed_queries_cached) y cada etapa recibe todos los
+    vectores (fn_search_*_multi, un LATERAL por vector sobre el índice HNSW).
+    Los documentos candidatos del Stage 1 se unen entre variantes; el fallback sin filtro
+    se hace en un solo viaje para las variantes que quedaron vacías.
+    RAG_RETRIEVAL_MODE='binary' no tiene versión multi: se busca variante por variante.
+    Retorna una lista de resultados por variante, en el orden de queries.
+    """
+    cfg = current_app.config
+    if cfg.get('RAG_RETRIEVAL_MODE', 'hnsw') == 'binary':
+        return [two_stage_retrieve(q, category_id=category_id, top_k=top_k,
+                                   score_threshold=score_threshold) for q in queries]
+
+    if top_k is None:
+        top_k = cfg.get('RAG_TOP_K', 5)
+    if score_threshold is None:
+        score_threshold = cfg.get('RAG_SCORE_THRESHOLD', 0.35)
+
+    multiplier = cfg.get('RAG_CANDIDATE_MULTIPLIER', 4)
+    factor = cfg.get('RAG_CANDIDATE_THRESHOLD_FACTOR', 0.70)
+
+    candidate_k = min(top_k * multiplier, 40)
+    candidate_threshold = max(score_threshold * factor, 0.20)
+
+    vectors = embed_queries_cached(queries)
+
+    # NIVEL 1: resúmenes de todas las variantes en una llamada
+    summary_hits = search_summaries_multi(
+        vectors,
+        top_k=min(top_k * 3, 15),
+        score_threshold=max(score_threshold * 0.6, 0.20),
+        category_id=category_id,
+    )
+    candidate_doc_ids = list({h['document_id'] for hits in summary_hits for h in hits}) or None
+
+    # NIVEL 2: contenido restringido a los docs candidatos, todas las variantes en una llamada
+    candidates = search_similar_multi(
+        vectors,
+        top_k=candidate_k,
+        score_threshold=candidate_threshold,
+        category_id=category_id,
+        document_ids=candidate_doc_ids,
+        chunk_type='content',
+    )
+
+    # Fallback: variantes sin resultados con el filtro buscan en todos los documentos
+    empty = [i for i, hits in enumerate(candidates) if not hits]
+    if empty and candidate_doc_ids:
+        retry = search_similar_multi(
+            [vectors[i] for i in empty],
+            top_k=candidate_k,
+            score_threshold=candidate_threshold,
+            category_id=category_id,
+            chunk_type='content',
+        )
+        for i, hits in zip(empty, retry):
+            candidates[i] = hits
+
+    if cfg.get('RAG_HYBRID_SEARCH', False):
+        candidates = _hybrid(queries, vectors, candidates, category_id)
+
+    max_per_doc = cfg.get('RAG_MAX_CHUNKS_PER_DOC', 2)
+    return [_diversify(hits, top_k, max_per_doc) for hits in candidates]
+
+
+def _hybrid(queries, vectors, candidates, category_id):
+    """
+    Fusiona los candidatos vectoriales de cada consulta con su ranking léxico (una llamada
+    para todas). La búsqueda léxica no se limita a los documentos del Stage 1: un código
+    exacto puede estar en un documento cuyo resumen no se parece a la pregunta.
+    """
+    cfg = current_app.config
+    lexical = search_lexical_multi(
+        queries, vectors,
+        top_k=cfg.get('RAG_HYBRID_LEXICAL_K', 20),
+        category_id=category_id,
+        max_candidates=cfg.get('RAG_HYBRID_LEXICAL_MAX_CANDIDATES', 1000),
+    )
+    rrf_k = cfg.get('RAG_HYBRID_RRF_K', 60)
+    return [_fuse_rrf([vector_hits, lexical_hits], rrf_k)
+            for vector_hits, lexical_hits in zip(candidates, lexical)]
+
+
+def _fuse_rrf(rankings, k):
+    """
+    Reciprocal rank fusion: cada chunk suma 1 / (k + posición) en cada ranking donde aparece.
+    Solo usa posiciones, así el coseno y ts_rank_cd no necesitan escalas comparables.
+    Conserva score (coseno) para mostrar y agrega fused_score para ordenar.
+    """
+    fused: dict = {}
+    for ranking in rankings:
+        for position, r in enumerate(ranking, start=1):
+            key = r.get('chunk_id') or f"{r['document_id']}_{r['page']}_{r['content'][:60]}"
+            entry = fused.setdefault(key, dict(r, fused_score=0.0))
+            entry['fused_score'] += 1.0 / (k + position)
+    return sorted(fused.values(), key=lambda r: r['fused_score'], reverse=True)
+
+
+def _diversify(candidates, top_k, max_per_doc):
+    """Diversity-aware selection: máximo max_per_doc chunks por documento."""
     if not candidates:
         return []
 
-    # Diversity-aware selection: máximo RAG_MAX_CHUNKS_PER_DOC por documento
-    max_per_doc = cfg.get('RAG_MAX_CHUNKS_PER_DOC', 2)
     doc_counts: dict = {}
     final = []
-    for chunk in candidates:          # sorted by score DESC (pgvector ORDER BY <=>)
+    for chunk in candidates:          # sorted by score DESC (pgvector ORDER BY <=>) or fused_score
         doc_id = chunk['document_id']
         if doc_counts.get(doc_id, 0) < max_per_doc:
             final.append(chunk)
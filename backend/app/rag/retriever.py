@@ -1,23 +1,27 @@
-from app.rag.reranker import two_stage_retrieve
+from app.rag.reranker import two_stage_retrieve_multi
 from app.rag.query_expander import expand_query
 
 
+def _rank(result):
+    return result.get('fused_score', result['score'])
+
+
 def retrieve_context(query, category_id=None, top_k=None, score_threshold=None):
     # Expander: genera query original + hasta 2 variantes
     queries = expand_query(query)
 
-    # Buscar con cada variante; mantener el chunk con mayor score si aparece en varias
-    seen_chunks: dict[str, dict] = {}  # key: doc_id + page + content[:60]
-    for q in queries:
-        results = two_stage_retrieve(
-            query=q,
-            top_k=top_k,
-            score_threshold=score_threshold,
-            category_id=category_id,
-        )
+    # Todas las variantes en una pasada (un embed y un viaje a la BD por etapa);
+    # mantener el chunk con mayor score si aparece en varias (fused_score en modo híbrido)
+    seen_chunks: dict[str, dict] = {}  # key: chunk_id (o doc_id + page + content[:60] en modo binary)
+    for results in two_stage_retrieve_multi(
+        queries,
+        top_k=top_k,
+        score_threshold=score_threshold,
+        category_id=category_id,
+    ):
         for r in results:
-            key = f"{r['document_id']}_{r['page']}_{r['content'][:60]}"
-            if key not in seen_chunks or r['score'] > seen_chunks[key]['score']:
+            key = r.get('chunk_id') or f"{r['document_id']}_{r['page']}_{r['content'][:60]}"
+            if key not in seen_chunks or _rank(r) > _rank(seen_chunks[key]):
                 seen_chunks[key] = r
 
     if not seen_chunks:
@@ -25,7 +29,7 @@ def retrieve_context(query, category_id=None, top_k=None, score_threshold=None):
 
     # Ordenar por score desc y tomar los top_k mejores
     final_k = top_k or 5
-    final_results = sorted(seen_chunks.values(), key=lambda x: x['score'], reverse=True)[:final_k]
+    final_results = sorted(seen_chunks.values(), key=_rank, reverse=True)[:final_k]
 
     context_parts = []
     sources = []
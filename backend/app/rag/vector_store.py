@@ -1,55 +1,181 @@
-from psycopg2.extras import Json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
-from app.db import call_fn, get_conn
-from app.rag.embeddings import get_embeddings
-
-BATCH_SIZE = 32
+from app.db import call_fn, copy_rows, encode_int4, encode_jsonb, encode_text, get_conn
+from app.vector_types import encode_vector
+from app.rag.embedding_cache import embed_documents_cached, evict_embedding_cache, text_hash
+from app.rag.query_cache import embed_query_cached
+from app.rag.batcher import get_embedding_batcher
+from app.rag.ann_replica import get_ann_replica, hydrate
 
 
 def add_chunks_to_postgres(chunks_data):
     """
     Genera embeddings en batch y guarda cada chunk con su vector en PostgreSQL.
-    chunks_data: list of dicts: content, document_id, title, category_id, page, chunk_index
+    Los batches se cortan por presupuesto aproximado de tokens (EmbeddingBatcher).
+    Pipeline productor/consumidor: mientras se escribe el batch N en PostgreSQL,
+    hasta EMBEDDING_CONCURRENCY hilos embeben los batches siguientes. Como máximo
+    hay EMBEDDING_CONCURRENCY + EMBEDDING_PIPELINE_DEPTH batches en vuelo, así que
+    la memoria de vectores no crece con el tamaño del documento.
+    Los textos ya embebidos antes (misma caché de modelo + texto) no vuelven a Ollama.
+    Cada batch se envía con COPY a chunk_staging y al final se vuelca todo a
+    document_chunks en una única transacción por documento.
+    chunks_data: list of dicts: content, document_id, title, category_id, page, chunk_index, generation
     """
-    embeddings = get_embeddings()
+    app = current_app._get_current_object()
+    concurrency = max(1, app.config.get('EMBEDDING_CONCURRENCY', 2))
+    max_in_flight = concurrency + max(0, app.config.get('EMBEDDING_PIPELINE_DEPTH', 2))
+    batcher = get_embedding_batcher()
+    conn = get_conn()
+
+    def embed_batch(batch):
+        # Cada hilo usa su propio app context (y su propia conexión para la caché)
+        with app.app_context():
+            return embed_documents_cached([_embedding_text(c) for c in batch])
+
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='embed')
+    try:
+        for batch in batcher.plan(chunks_data, key=_embedding_text):
+            pending.append((batch, executor.submit(embed_batch, batch)))
+            if len(pending) >= max_in_flight:
+                _stage_batch(*pending.popleft(), conn=conn)
+        while pending:
+            _stage_batch(*pending.popleft(), conn=conn)
+        written = flush_staged_chunks(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+    evict_embedding_cache()
+    return written
+
+
+def embed_chunks(chunks):
+    """Embebe chunks con el mismo texto que la ingesta, por lotes de tokens y usando la caché."""
+    vectors = []
+    for batch in get_embedding_batcher().plan(chunks, key=_embedding_text):
+        vectors.extend(embed_documents_cached([_embedding_text(c) for c in batch]))
+    return vectors
+
+
+def _embedding_text(chunk):
     # Embebir con contexto del documento para mejor coincidencia semántica.
-    # Se almacena c['content'] sin el prefijo; solo el embedding lleva el contexto.
-    texts = [f"[{c['title']}]\n{c['content']}" for c in chunks_data]
+    # Se almacena chunk['content'] sin el prefijo; solo el embedding lleva el contexto.
+    return f"[{chunk['title']}]\n{chunk['content']}"
 
-    all_vectors = []
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch = texts[i:i + BATCH_SIZE]
-        all_vectors.extend(embeddings.embed_documents(batch))
 
-    conn = get_conn()
-    for i, chunk in enumerate(chunks_data):
-        metadata = Json({'page': chunk['page'], 'title': chunk['title']})
-        call_fn('fn_create_chunk', (
+def chunk_content_hash(chunk):
+    """Clave de contenido del chunk; igual a fn_chunk_content_hash en SQL y a la caché de embeddings."""
+    return text_hash(_embedding_text(chunk))
+
+
+def _stage_batch(batch, future, conn):
+    """Espera los vectores de un batch (consumidor) y los envía a chunk_staging."""
+    return stage_chunks(batch, future.result(), conn)
+
+
+CHUNK_STAGING_COLUMNS = ('document_id', 'chunk_index', 'content', 'embedding', 'metadata_json', 'chunk_type',
+                         'generation')
+_CHUNK_STAGING_ENCODERS = (encode_text, encode_int4, encode_text, encode_vector, encode_jsonb, encode_text,
+                           encode_int4)
+
+
+def stage_chunks(chunks, vectors, conn, chunk_type='content'):
+    """
+    COPY binario de chunks ya embebidos a la tabla temporal chunk_staging, sin COMMIT.
+    Los vectores (float32) viajan en el formato binario de pgvector, sin pasar por texto.
+    chunks: dicts con document_id, chunk_index, content, page, title, generation.
+    """
+    call_fn('fn_prepare_chunk_staging', conn=conn, commit=False)
+    return copy_rows('chunk_staging', CHUNK_STAGING_COLUMNS, _CHUNK_STAGING_ENCODERS, (
+        (
             chunk['document_id'],
             chunk['chunk_index'],
             chunk['content'],
-            all_vectors[i],
-            metadata,
-        ), fetch_one=True, conn=conn)
+            vector,
+            {'page': chunk['page'], 'title': chunk['title']},
+            chunk_type,
+            chunk['generation'],
+        )
+        for chunk, vector in zip(chunks, vectors)
+    ), conn)
 
-    return len(chunks_data)
+
+def flush_staged_chunks(conn):
+    """Vuelca chunk_staging a document_chunks (INSERT ... SELECT), sin COMMIT."""
+    row = call_fn('fn_flush_chunk_staging', fetch_one=True, conn=conn, commit=False)
+    return row['fn_flush_chunk_staging']
+
+
+def insert_chunks(chunks, vectors, conn, chunk_type='content'):
+    """
+    Inserta chunks ya embebidos en una sola transacción (COPY + INSERT ... SELECT).
+    Usado para resúmenes y re-embebidos; la ingesta usa el pipeline de add_chunks_to_postgres.
+    """
+    try:
+        stage_chunks(chunks, vectors, conn, chunk_type=chunk_type)
+        written = flush_staged_chunks(conn)
+        conn.commit()
+        return written
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def apply_chunk_diff(document_id, new_chunks, new_vectors, delete_ids, kept, chunk_count, conn,
+                     summary=None):
+    """
+    Aplica una re-subida incremental sobre la generación activa en una sola transacción:
+    inserta new_chunks (COPY), borra delete_ids y actualiza índice/página de los conservados.
+    kept: lista de (chunk_id, chunk_index, page). summary: (chunk, vector) opcional; su texto
+    pasa a documents.summary en la misma transacción.
+    Las búsquedas ven el documento viejo o el nuevo, nunca un estado intermedio.
+    """
+    try:
+        stage_chunks(new_chunks, new_vectors, conn)
+        if summary is not None:
+            stage_chunks([summary[0]], [summary[1]], conn, chunk_type='summary')
+        row = call_fn('fn_apply_chunk_diff', (
+            document_id,
+            list(delete_ids),
+            [k[0] for k in kept],
+            [k[1] for k in kept],
+            [k[2] for k in kept],
+            chunk_count,
+            summary[0]['content'] if summary is not None else None,
+        ), fetch_one=True, conn=conn, commit=False)
+        conn.commit()
+        return row['fn_apply_chunk_diff']
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def search_similar(query, top_k=None, score_threshold=None, category_id=None,
                    document_ids=None, chunk_type='content'):
-    """Busca chunks similares usando pgvector."""
-    embeddings = get_embeddings()
-
+    """
+    Busca chunks similares usando pgvector.
+    RAG_RETRIEVAL_MODE='binary' usa la primera etapa por Hamming sobre embedding_bits
+    (RAG_BINARY_OVERSAMPLE candidatos por resultado) y re-ranking por coseno exacto.
+    Con RAG_ANN_REPLICA_ENABLED los chunks 'content' se buscan en la réplica en proceso
+    mientras esté al día; si no, en SQL.
+    """
+    cfg = current_app.config
     if top_k is None:
-        top_k = current_app.config.get('RAG_TOP_K', 5)
+        top_k = cfg.get('RAG_TOP_K', 5)
     if score_threshold is None:
-        score_threshold = current_app.config.get('RAG_SCORE_THRESHOLD', 0.35)
+        score_threshold = cfg.get('RAG_SCORE_THRESHOLD', 0.35)
     if category_id is None:
         category_id = ''
 
-    query_vector = embeddings.embed_query(query)
+    # Un mismo query se embebe una sola vez por request (summary, content y fallback)
+    query_vector = embed_query_cached(query)
 
-    rows = call_fn('fn_search_similar', (
+    params = (
         query_vector,
         top_k,
         score_threshold,
@@ -57,12 +183,141 @@ def search_similar(query, top_k=None, score_threshold=None, category_id=None,
         False,           # p_include_excluded
         document_ids,    # lista de UUIDs o None
         chunk_type,
+    )
+    if cfg.get('RAG_RETRIEVAL_MODE', 'hnsw') == 'binary':
+        rows = call_fn('fn_search_similar_binary',
+                       params + (cfg.get('RAG_BINARY_OVERSAMPLE', 10),), fetch_all=True)
+    else:
+        replica = get_ann_replica() if chunk_type == 'content' else None
+        hits = replica.search(query_vector, top_k, score_threshold, category_id,
+                              document_ids) if replica else None
+        if hits is not None:
+            return hydrate(hits)
+        rows = call_fn('fn_search_similar',
+                       params + (cfg.get('RAG_HNSW_EF_SEARCH', 100),), fetch_all=True)
+
+    return _to_results(rows)
+
+
+def search_summaries(query, top_k, score_threshold, category_id=None):
+    """
+    Stage 1: busca chunks de resumen sobre el vector reducido de 256 dimensiones
+    (embedding_small). Solo sirve para elegir documentos candidatos.
+    """
+    query_vector = embed_query_cached(query)
+    rows = call_fn('fn_search_summaries', (
+        query_vector,
+        top_k,
+        score_threshold,
+        category_id or '',
+        False,           # p_include_excluded
+    ), fetch_all=True)
+    return _to_results(rows)
+
+
+def search_similar_multi(query_vectors, top_k=None, score_threshold=None, category_id=None,
+                         document_ids=None, chunk_type='content'):
+    """
+    Busca chunks similares para varios vectores de consulta en una sola llamada
+    (fn_search_similar_multi). Retorna una lista de resultados por vector, en orden;
+    cada resultado incluye chunk_id para fusionar variantes.
+    """
+    cfg = current_app.config
+    if top_k is None:
+        top_k = cfg.get('RAG_TOP_K', 5)
+    if score_threshold is None:
+        score_threshold = cfg.get('RAG_SCORE_THRESHOLD', 0.35)
+
+    replica = get_ann_replica() if chunk_type == 'content' else None
+    if replica:
+        per_query = [replica.search(v, top_k, score_threshold, category_id or '', document_ids)
+                     for v in query_vectors]
+        if all(hits is not None for hits in per_query):
+            # Una sola lectura por id para todas las variantes
+            results = {r['chunk_id']: r for r in hydrate([h for hits in per_query for h in hits])}
+            return [[dict(results[chunk_id], score=score) for chunk_id, score in hits
+                     if chunk_id in results] for hits in per_query]
+
+    rows = call_fn('fn_search_similar_multi', (
+        list(query_vectors),
+        top_k,
+        score_threshold,
+        category_id or '',
+        False,           # p_include_excluded
+        document_ids,
+        chunk_type,
+        cfg.get('RAG_HNSW_EF_SEARCH', 100),
     ), fetch_all=True)
+    return _group_by_query(rows, len(query_vectors))
+
+
+def search_summaries_multi(query_vectors, top_k, score_threshold, category_id=None):
+    """Stage 1 para varios vectores de consulta en una sola llamada (fn_search_summaries_multi)."""
+    rows = call_fn('fn_search_summaries_multi', (
+        list(query_vectors),
+        top_k,
+        score_threshold,
+        category_id or '',
+    ), fetch_all=True)
+    return _group_by_query(rows, len(query_vectors))
+
+
+def search_lexical_multi(queries, query_vectors, top_k, category_id=None, document_ids=None,
+                         max_candidates=1000):
+    """
+    Búsqueda léxica (texto completo en español, fn_search_lexical_multi) para varias
+    consultas en una llamada. Resultados por consulta en orden de ranking léxico; score es
+    el coseno con el vector de la consulta, comparable con search_similar_multi.
+    max_candidates acota las coincidencias que se puntúan por consulta.
+    """
+    rows = call_fn('fn_search_lexical_multi', (
+        list(queries),
+        list(query_vectors),
+        top_k,
+        category_id or '',
+        document_ids,
+        max_candidates,
+    ), fetch_all=True)
+    return _group_by_query(rows, len(queries))
+
+
+def iter_similar_batches(vectors, top_k, score_threshold, conn, include_excluded=True,
+                         batch_size=200, ef_search=100):
+    """
+    Búsqueda masiva (verificación de originalidad): recorre `vectors` en páginas de
+    batch_size filas con una sola llamada a fn_search_similar_multi por página.
+    Genera (índice, resultados) por vector en orden, así el llamador agrega a medida
+    que llegan las páginas sin tener todos los vecinos en memoria.
+    """
+    for start in range(0, len(vectors), batch_size):
+        page = list(vectors[start:start + batch_size])
+        rows = call_fn('fn_search_similar_multi', (
+            page,
+            top_k,
+            score_threshold,
+            '',
+            include_excluded,
+            None,
+            'content',
+            ef_search,
+        ), fetch_all=True, conn=conn)
+        for offset, results in enumerate(_group_by_query(rows, len(page))):
+            yield start + offset, results
+
+
+def _group_by_query(rows, count):
+    grouped = [[] for _ in range(count)]
+    for r in rows or []:
+        grouped[r['query_index'] - 1].append(r)
+    return [_to_results(group) for group in grouped]
+
 
+def _to_results(rows):
     if not rows:
         return []
 
     return [{
+        'chunk_id': r.get('chunk_id'),
         'content': r['content'],
         'document_id': r['document_id'],
         'title': r['title'],
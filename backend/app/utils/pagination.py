@@ -1,4 +1,20 @@
-from flask import request
+import base64
+import json
+import math
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, request
+
+from app.db import call_fn
+
+# Totales de los listados: none = se omite, estimate = estimación del planificador,
+# cached = conteo exacto cacheado LIST_TOTAL_CACHE_TTL segundos por combinación de filtros
+TOTAL_MODES = ('none', 'estimate', 'cached')
+
+_total_cache = {}          # (función, filtros) -> (expira_en, total)
+_total_lock = threading.Lock()
 
 
 def get_pagination_params():
@@ -6,3 +22,107 @@ def get_pagination_params():
     per_page = request.args.get('per_page', 20, type=int)
     per_page = min(per_page, 100)  # Max 100 per page
     return page, per_page
+
+
+def get_cursor_params(default_limit=20):
+    """Paginación por cursor: (valores de la clave de orden o None, limit). ValueError si el cursor es invalido."""
+    limit = request.args.get('limit', default_limit, type=int)
+    limit = max(1, min(limit, 100))  # Max 100 per page
+    return decode_cursor(request.args.get('cursor')), limit
+
+
+def get_total_mode(default='none'):
+    """Modo del total (?total=none|estimate|cached). ValueError si no es uno de TOTAL_MODES."""
+    mode = request.args.get('total', default)
+    if mode not in TOTAL_MODES:
+        raise ValueError(f'total debe ser uno de: {", ".join(TOTAL_MODES)}.')
+    return mode
+
+
+def list_total(fn_name, filters, mode):
+    """
+    Total de un listado con la función fn_count_*_list (filters, p_estimate) según mode;
+    None si mode es 'none'.
+    """
+    if mode == 'none':
+        return None
+    if mode == 'estimate':
+        return call_fn(fn_name, tuple(filters) + (True,), fetch_one=True)[fn_name]
+
+    cfg = current_app.config
+    key = (fn_name, tuple(filters))
+    now = time.monotonic()
+    with _total_lock:
+        entry = _total_cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+    total = call_fn(fn_name, tuple(filters) + (False,), fetch_one=True)[fn_name]
+    with _total_lock:
+        if len(_total_cache) >= cfg.get('LIST_TOTAL_CACHE_SIZE', 512):
+            # Cada búsqueda tecleada es una clave nueva: se descartan las vencidas y,
+            # si no alcanza, todas
+            for k in [k for k, (expires, _) in _total_cache.items() if expires <= now]:
+                del _total_cache[k]
+            if len(_total_cache) >= cfg.get('LIST_TOTAL_CACHE_SIZE', 512):
+                _total_cache.clear()
+        _total_cache[key] = (now + cfg.get('LIST_TOTAL_CACHE_TTL', 30), total)
+    return total
+
+
+def encode_cursor(values):
+    """Cursor opaco (base64url de JSON) con los valores de la clave de orden de la última fila."""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor invalido.')
+    if not isinstance(values, list):
+        raise ValueError('Cursor invalido.')
+    return values
+
+
+def cursor_values(cursor, kinds):
+    """
+    Valida los valores de un cursor decodificado contra kinds ('timestamp', 'id' o 'rank',
+    uno por valor) y los convierte (timestamp -> datetime). cursor None = primera página:
+    retorna None por cada valor. ValueError 'Cursor invalido.' si no coinciden.
+    """
+    if cursor is None:
+        return (None,) * len(kinds)
+    if len(cursor) != len(kinds):
+        raise ValueError('Cursor invalido.')
+    values = []
+    for value, kind in zip(cursor, kinds):
+        try:
+            if kind == 'timestamp':
+                value = datetime.fromisoformat(value)
+            elif kind == 'id':
+                if not isinstance(value, str) or not value:
+                    raise ValueError
+            elif kind == 'rank':
+                # rank NULL = página sin orden por similitud
+                if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                          or not math.isfinite(value)):
+                    raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError('Cursor invalido.')
+        values.append(value)
+    return tuple(values)
+
+
+def keyset_page(rows, limit, key):
+    """
+    Recorta rows (pedidas con limit + 1) a limit y genera el cursor de la página siguiente
+    con key(última fila), o None si no hay más.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
@@ -19,15 +19,34 @@ def error_response(message='Ocurrio un error', error='Error', status_code=400):
     }), status_code
 
 
-def paginated_response(items, total, page, per_page, message='Datos obtenidos exitosamente'):
+def paginated_response(items, total, page, per_page, message='Datos obtenidos exitosamente',
+                       total_mode='exact'):
+    """total puede ser estimado o cacheado (total_mode) o None si se omitió; entonces pages es None."""
     return jsonify({
         'success': True,
         'message': message,
         'data': items,
         'pagination': {
             'total': total,
+            'total_mode': total_mode,
             'page': page,
             'per_page': per_page,
-            'pages': (total + per_page - 1) // per_page,
+            'pages': (total + per_page - 1) // per_page if total is not None else None,
+        }
+    }), 200
+
+
+def cursor_response(items, next_cursor, limit, message='Datos obtenidos exitosamente',
+                    total=None, total_mode='none'):
+    return jsonify({
+        'success': True,
+        'message': message,
+        'data': items,
+        'pagination': {
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None,
+            'limit': limit,
+            'total': total,
+            'total_mode': total_mode,
         }
     }), 200
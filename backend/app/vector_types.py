@@ -0,0 +1,66 @@
+"""
+pgvector <-> numpy.float32 for psycopg2.
+
+Embeddings are kept as contiguous float32 arrays (768 * 4 bytes) end to end:
+  - parameters: a 1-D ndarray is sent as a '[...]'::vector literal, so stored functions
+    take `vector` directly (no ARRAY[...] of numerics cast to FLOAT[] and then to vector);
+  - results: vector columns come back as float32 ndarrays;
+  - COPY: encode_vector() produces pgvector's binary wire format (vector_recv).
+"""
+import struct
+import numpy as np
+from psycopg2.extensions import new_type, register_adapter, register_type
+
+DTYPE = np.float32
+
+
+def to_vector(values):
+    """Any sequence of floats -> contiguous float32 ndarray (no copy if it already is one)."""
+    return np.ascontiguousarray(values, dtype=DTYPE)
+
+
+def to_vectors(rows):
+    """
+    List of vectors -> list of float32 ndarrays backed by a single contiguous matrix
+    (one allocation per batch instead of 768 boxed floats per vector).
+    """
+    if len(rows) == 0:
+        return []
+    return list(np.ascontiguousarray(rows, dtype=DTYPE))
+
+
+def encode_vector(values):
+    """pgvector binary format: int16 dim, int16 unused, dim x float4 big-endian."""
+    array = to_vector(values)
+    return struct.pack('>HH', array.shape[0], 0) + array.astype('>f4').tobytes()
+
+
+class VectorAdapter:
+    def __init__(self, array):
+        self.array = array
+
+    def getquoted(self):
+        text = ','.join(to_vector(self.array).astype(str))
+        return f"'[{text}]'::vector".encode('ascii')
+
+
+def _cast_vector(value, cur):
+    if value is None:
+        return None
+    return np.array(value[1:-1].split(','), dtype=DTYPE)
+
+
+def register_vector_types(conn):
+    """Register the ndarray adapter and the vector typecaster (process-wide)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT to_regtype('vector')::oid AS oid")
+        row = cur.fetchone()
+        conn.rollback()
+    finally:
+        cur.close()
+
+    register_adapter(np.ndarray, VectorAdapter)
+    oid = row['oid'] if row else None
+    if oid:
+        register_type(new_type((oid,), 'VECTOR', _cast_vector))
@@ -23,6 +23,28 @@ class Config:
     LLM_MODEL = os.getenv('LLM_MODEL', 'gemma3:4b')
     EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'nomic-embed-text')
 
+    # Embedding backends: ollama | onnx (in-process CPU) | hashing (deterministic, tests/benchmarks)
+    EMBEDDING_BACKEND         = os.getenv('EMBEDDING_BACKEND', 'ollama')
+    EMBEDDING_QUERY_BACKEND   = os.getenv('EMBEDDING_QUERY_BACKEND', '')   # '' = same as EMBEDDING_BACKEND
+    EMBEDDING_DIM             = int(os.getenv('EMBEDDING_DIM', '768'))
+    EMBEDDING_ONNX_PATH       = os.getenv('EMBEDDING_ONNX_PATH', '')      # dir with model.onnx + tokenizer.json
+    EMBEDDING_ONNX_MAX_LENGTH = int(os.getenv('EMBEDDING_ONNX_MAX_LENGTH', '2048'))
+    EMBEDDING_ONNX_BATCH      = int(os.getenv('EMBEDDING_ONNX_BATCH', '16'))
+    EMBEDDING_ONNX_THREADS    = int(os.getenv('EMBEDDING_ONNX_THREADS', '0'))   # 0 = onnxruntime default
+
+    # Embedding cache (PostgreSQL, keyed by model + sha256 of the embedded text)
+    EMBEDDING_CACHE_ENABLED     = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+
+    # Ingestion pipeline: embedding threads working ahead of the DB writer
+    EMBEDDING_CONCURRENCY    = int(os.getenv('EMBEDDING_CONCURRENCY', '2'))
+    EMBEDDING_PIPELINE_DEPTH = int(os.getenv('EMBEDDING_PIPELINE_DEPTH', '2'))   # extra queued batches
+
+    # Adaptive embedding batches (approx. tokens = chars / 4)
+    EMBEDDING_TOKEN_BUDGET   = int(os.getenv('EMBEDDING_TOKEN_BUDGET', '8192'))
+    EMBEDDING_MAX_BATCH      = int(os.getenv('EMBEDDING_MAX_BATCH', '64'))
+    EMBEDDING_TARGET_LATENCY = float(os.getenv('EMBEDDING_TARGET_LATENCY', '5.0'))  # seconds per batch
+
     # RAG
     RAG_CHUNK_SIZE = int(os.getenv('RAG_CHUNK_SIZE', '1000'))
     RAG_CHUNK_OVERLAP = int(os.getenv('RAG_CHUNK_OVERLAP', '200'))
@@ -35,6 +57,31 @@ class Config:
     RAG_MAX_CHUNKS_PER_DOC = int(os.getenv('RAG_MAX_CHUNKS_PER_DOC', '2'))
     RAG_ENABLE_REFLECTION = os.getenv('RAG_ENABLE_REFLECTION', 'false').lower() == 'true'
     RAG_ENABLE_QUERY_EXPANSION = os.getenv('RAG_ENABLE_QUERY_EXPANSION', 'true').lower() == 'true'
+    RAG_RETRIEVAL_MODE = os.getenv('RAG_RETRIEVAL_MODE', 'hnsw')                # hnsw | binary
+    RAG_BINARY_OVERSAMPLE = int(os.getenv('RAG_BINARY_OVERSAMPLE', '10'))
+    RAG_HNSW_EF_SEARCH = int(os.getenv('RAG_HNSW_EF_SEARCH', '100'))              # iterative scan, max 1000
+    RAG_QUERY_CACHE_SIZE = int(os.getenv('RAG_QUERY_CACHE_SIZE', '1024'))   # 0 = disabled
+    RAG_QUERY_CACHE_TTL = int(os.getenv('RAG_QUERY_CACHE_TTL', '3600'))     # seconds
+    # Hybrid retrieval: Spanish full-text ranking fused with the vector ranking (RRF)
+    RAG_HYBRID_SEARCH = os.getenv('RAG_HYBRID_SEARCH', 'false').lower() == 'true'
+    RAG_HYBRID_LEXICAL_K = int(os.getenv('RAG_HYBRID_LEXICAL_K', '20'))      # lexical candidates per query
+    RAG_HYBRID_LEXICAL_MAX_CANDIDATES = int(os.getenv('RAG_HYBRID_LEXICAL_MAX_CANDIDATES', '1000'))  # matches ranked per query
+    RAG_HYBRID_RRF_K = int(os.getenv('RAG_HYBRID_RRF_K', '60'))              # RRF damping constant
+    RAG_HYBRID_SKIP_EXPANSION = os.getenv('RAG_HYBRID_SKIP_EXPANSION', 'true').lower() == 'true'
+    # In-process ANN replica (NumPy IVF over a memory-mapped snapshot, synced via LISTEN/NOTIFY)
+    RAG_ANN_REPLICA_ENABLED = os.getenv('RAG_ANN_REPLICA_ENABLED', 'false').lower() == 'true'
+    RAG_ANN_SNAPSHOT_DIR = os.getenv('RAG_ANN_SNAPSHOT_DIR', 'ann_snapshot')
+    RAG_ANN_NPROBE = int(os.getenv('RAG_ANN_NPROBE', '16'))                 # IVF lists probed per query
+    RAG_ANN_MAX_LAG = float(os.getenv('RAG_ANN_MAX_LAG', '30'))            # seconds before falling back to SQL
+
+    # Chat suggestions (question_frequency: in-process prefix index + suggested questions cache)
+    AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv('AUTOCOMPLETE_REFRESH_SECONDS', '30'))    # incremental read
+    AUTOCOMPLETE_REBUILD_SECONDS = int(os.getenv('AUTOCOMPLETE_REBUILD_SECONDS', '3600'))  # full reload
+    SUGGESTED_QUESTIONS_CACHE_TTL = int(os.getenv('SUGGESTED_QUESTIONS_CACHE_TTL', '60'))  # 0 = disabled
+
+    # Admin list totals (?total=cached): exact counts cached in-process per filter set
+    LIST_TOTAL_CACHE_TTL = int(os.getenv('LIST_TOTAL_CACHE_TTL', '30'))          # seconds
+    LIST_TOTAL_CACHE_SIZE = int(os.getenv('LIST_TOTAL_CACHE_SIZE', '512'))       # entries
 
     # Upload
     MAX_UPLOAD_SIZE_MB = int(os.getenv('MAX_UPLOAD_SIZE_MB', '80'))
@@ -52,6 +99,7 @@ class Config:
     ORIGINALITY_TOP_K_PER_CHUNK      = int(os.getenv('ORIGINALITY_TOP_K_PER_CHUNK', '3'))
     ORIGINALITY_MAX_LLM_DOCS         = int(os.getenv('ORIGINALITY_MAX_LLM_DOCS', '5'))
     ORIGINALITY_MIN_SIM_FOR_LLM      = float(os.getenv('ORIGINALITY_MIN_SIM_FOR_LLM', '5.0'))
+    ORIGINALITY_SEARCH_BATCH         = int(os.getenv('ORIGINALITY_SEARCH_BATCH', '200'))  # thesis chunks per search call
 
     # Admin seed
     ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', 'admin@upao.edu.pe')
@@ -27,6 +27,7 @@ export interface Conversation {
   conversation_id: string;
   last_message_at: string;
   preview: string;
+  message_count?: number;
 }
 
 export interface FeedbackRequest {
@@ -34,12 +34,28 @@ export interface ApiResponse<T = any> {
   data: T;
 }
 
+export type TotalMode = 'none' | 'estimate' | 'cached';
+
+export interface CursorPaginatedResponse<T = any> {
+  success: boolean;
+  message: string;
+  data: T[];
+  pagination: {
+    next_cursor: string | null;
+    has_more: boolean;
+    limit: number;
+    total?: number | null;
+    total_mode?: TotalMode;
+  };
+}
+
 export interface PaginatedResponse<T = any> {
   success: boolean;
   message: string;
   data: T[];
   pagination: {
-    total: number;
+    total: number | null;
+    total_mode?: TotalMode | 'exact';
     page: number;
     per_page: number;
     pages: number;
@@ -5,7 +5,6 @@ import { DocumentService } from '../../services/document.service';
 import { CategoryService } from '../../services/category.service';
 import { AdminSidebarComponent } from '../../components/admin-sidebar/admin-sidebar.component';
 import { DocumentUploadDialogComponent } from '../../components/document-upload-dialog/document-upload-dialog.component';
-import { PaginationComponent } from '../../../../shared/components/pagination/pagination.component';
 import { ConfirmDialogComponent } from '../../../../shared/components/confirm-dialog/confirm-dialog.component';
 import { ToastService } from '../../../../shared/components/toast/toast.component';
 import { Document, Category } from '../../../../core/models/document.model';
@@ -15,7 +14,7 @@ import { getStatusLabel, getStatusBadgeClass } from '../../../../shared/utils/st
 @Component({
   selector: 'app-document-management',
   standalone: true,
-  imports: [CommonModule, FormsModule, AdminSidebarComponent, DocumentUploadDialogComponent, PaginationComponent, ConfirmDialogComponent],
+  imports: [CommonModule, FormsModule, AdminSidebarComponent, DocumentUploadDialogComponent, ConfirmDialogComponent],
   template: `
     <div class="flex">
       <app-admin-sidebar />
@@ -31,17 +30,17 @@ import { getStatusLabel, getStatusBadgeClass } from '../../../../shared/utils/st
 
         <!-- Filters -->
         <div class="bg-white rounded-xl shadow-sm border p-4 mb-4 flex gap-4">
-          <input type="text" [(ngModel)]="searchQuery" (input)="loadDocuments()"
+          <input type="text" [(ngModel)]="searchQuery" (input)="resetAndLoad()"
                  placeholder="Buscar documentos..."
                  class="flex-1 px-3 py-2 border border-gray-300 rounded-lg text-sm focus:ring-2 focus:ring-primary focus:border-primary outline-none">
-          <select [(ngModel)]="filterCategory" (change)="loadDocuments()"
+          <select [(ngModel)]="filterCategory" (change)="resetAndLoad()"
                   class="px-3 py-2 border border-gray-300 rounded-lg text-sm focus:ring-2 focus:ring-primary outline-none">
             <option value="">Todas las categorias</option>
             @for (cat of categories(); track cat.id) {
               <option [value]="cat.id">{{ cat.name }}</option>
             }
           </select>
-          <select [(ngModel)]="filterStatus" (change)="loadDocuments()"
+          <select [(ngModel)]="filterStatus" (change)="resetAndLoad()"
                   class="px-3 py-2 border border-gray-300 rounded-lg text-sm focus:ring-2 focus:ring-primary outline-none">
             <option value="">Todos los estados</option>
             <option value="completed">Completado</option>
@@ -102,12 +101,33 @@ import { getStatusLabel, getStatusBadgeClass } from '../../../../shared/utils/st
               }
             </tbody>
           </table>
-          <app-pagination [total]="totalDocs()" [currentPage]="currentPage" [perPage]="PAGE_SIZE" (pageChange)="onPageChange($event)" />
+          <!-- Paginacion por cursor: total estimado, solo anterior/siguiente -->
+          @if (cursors().length > 1 || nextCursor()) {
+            <div class="flex items-center justify-between px-4 py-3">
+              <p class="text-sm text-gray-700">
+                Mostrando <span class="font-medium">{{ (cursors().length - 1) * PAGE_SIZE + 1 }}</span>
+                a <span class="font-medium">{{ (cursors().length - 1) * PAGE_SIZE + documents().length }}</span>
+                @if (totalDocs() !== null) {
+                  de <span class="font-medium">~{{ totalDocs() }}</span> resultados
+                }
+              </p>
+              <div class="flex space-x-1">
+                <button (click)="previousPage()" [disabled]="cursors().length === 1"
+                        class="px-3 py-1 text-sm border rounded hover:bg-gray-50 disabled:opacity-50 disabled:cursor-not-allowed">
+                  Anterior
+                </button>
+                <button (click)="nextPage()" [disabled]="!nextCursor()"
+                        class="px-3 py-1 text-sm border rounded hover:bg-gray-50 disabled:opacity-50 disabled:cursor-not-allowed">
+                  Siguiente
+                </button>
+              </div>
+            </div>
+          }
         </div>
 
         <!-- Upload dialog -->
         <app-document-upload-dialog [isOpen]="showUpload()" [categories]="categories()"
-                                    (close)="showUpload.set(false)" (uploaded)="loadDocuments()" />
+                                    (close)="showUpload.set(false)" (uploaded)="resetAndLoad()" />
 
         <!-- Confirm delete -->
         <app-confirm-dialog [isOpen]="!!deleteId()" title="Eliminar Documento"
@@ -129,14 +149,16 @@ export class DocumentManagementComponent implements OnInit {
 
   documents = signal<Document[]>([]);
   categories = signal<Category[]>([]);
-  totalDocs = signal(0);
+  totalDocs = signal<number | null>(null);
+  // cursors()[i] = cursor de la pagina i (null = primera); el ultimo es la pagina actual
+  cursors = signal<(string | null)[]>([null]);
+  nextCursor = signal<string | null>(null);
   showUpload = signal(false);
   deleteId = signal('');
 
   searchQuery = '';
   filterCategory = '';
   filterStatus = '';
-  currentPage = 1;
 
   ngOnInit(): void {
     this.loadDocuments();
@@ -146,21 +168,38 @@ export class DocumentManagementComponent implements OnInit {
   }
 
   loadDocuments(): void {
-    this.docService.list({
-      page: this.currentPage,
+    const pages = this.cursors();
+    this.docService.listByCursor({
+      cursor: pages[pages.length - 1],
+      limit: PAGE_SIZE,
+      total: 'estimate',
       search: this.searchQuery,
       category_id: this.filterCategory,
       status: this.filterStatus,
     }).subscribe({
       next: (res) => {
         this.documents.set(res.data);
-        this.totalDocs.set(res.pagination.total);
+        this.nextCursor.set(res.pagination.next_cursor);
+        this.totalDocs.set(res.pagination.total ?? null);
       }
     });
   }
 
-  onPageChange(page: number): void {
-    this.currentPage = page;
+  resetAndLoad(): void {
+    this.cursors.set([null]);
+    this.loadDocuments();
+  }
+
+  nextPage(): void {
+    const next = this.nextCursor();
+    if (!next) return;
+    this.cursors.update(pages => [...pages, next]);
+    this.loadDocuments();
+  }
+
+  previousPage(): void {
+    if (this.cursors().length === 1) return;
+    this.cursors.update(pages => pages.slice(0, -1));
     this.loadDocuments();
   }
 
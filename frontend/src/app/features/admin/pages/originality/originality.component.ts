@@ -398,7 +398,7 @@ export class OriginalityComponent implements OnInit, OnDestroy {
     this.svc.list({ page: this.currentPage, status: this.filterStatus }).subscribe({
       next: (res) => {
         this.checks.set(res.data);
-        this.total.set(res.pagination.total);
+        this.total.set(res.pagination.total ?? 0);
         this.managePolling();
       },
     });
@@ -96,7 +96,7 @@ export class UserManagementComponent implements OnInit {
     this.userService.list({ page: this.currentPage, search: this.searchQuery }).subscribe({
       next: (res) => {
         this.users.set(res.data);
-        this.totalUsers.set(res.pagination.total);
+        this.totalUsers.set(res.pagination.total ?? 0);
       }
     });
   }
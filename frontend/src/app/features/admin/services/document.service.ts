@@ -2,7 +2,7 @@ import { Injectable, inject } from '@angular/core';
 import { HttpClient, HttpParams } from '@angular/common/http';
 import { Observable } from 'rxjs';
 import { environment } from '../../../../environments/environment';
-import { ApiResponse, PaginatedResponse } from '../../../core/models/user.model';
+import { ApiResponse, CursorPaginatedResponse, PaginatedResponse, TotalMode } from '../../../core/models/user.model';
 import { Document, BatchUploadData } from '../../../core/models/document.model';
 
 @Injectable({ providedIn: 'root' })
@@ -19,6 +19,20 @@ export class DocumentService {
     return this.http.get<PaginatedResponse<Document>>(this.apiUrl, { params: httpParams });
   }
 
+  listByCursor(params?: {
+    cursor?: string | null; limit?: number; total?: TotalMode;
+    search?: string; category_id?: string; status?: string;
+  }): Observable<CursorPaginatedResponse<Document>> {
+    let httpParams = new HttpParams();
+    if (params?.cursor) httpParams = httpParams.set('cursor', params.cursor);
+    if (params?.limit) httpParams = httpParams.set('limit', params.limit.toString());
+    if (params?.total) httpParams = httpParams.set('total', params.total);
+    if (params?.search) httpParams = httpParams.set('search', params.search);
+    if (params?.category_id) httpParams = httpParams.set('category_id', params.category_id);
+    if (params?.status) httpParams = httpParams.set('status', params.status);
+    return this.http.get<CursorPaginatedResponse<Document>>(this.apiUrl, { params: httpParams });
+  }
+
   get(id: string): Observable<ApiResponse<{ document: Document }>> {
     return this.http.get<ApiResponse<{ document: Document }>>(`${this.apiUrl}/${id}`);
   }
@@ -43,6 +57,13 @@ export class DocumentService {
     return this.http.post<ApiResponse<{ document: Document }>>(`${this.apiUrl}/${id}/reprocess`, {});
   }
 
+  replace(id: string, file: File, mode: 'incremental' | 'full' = 'incremental'): Observable<ApiResponse<{ document: Document }>> {
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('mode', mode);
+    return this.http.post<ApiResponse<{ document: Document }>>(`${this.apiUrl}/${id}/replace`, formData);
+  }
+
   uploadBatch(files: File[], categoryId?: string): Observable<ApiResponse<BatchUploadData>> {
     const formData = new FormData();
     files.forEach(file => formData.append('files', file));
@@ -39,6 +39,12 @@ import { Conversation } from '../../../../core/models/chat.model';
             <p class="text-xs text-gray-400 mt-1">{{ formatDate(conv.last_message_at) }}</p>
           </button>
         }
+        @if (nextCursor()) {
+          <button (click)="loadMore()"
+                  class="w-full px-4 py-3 text-sm text-primary hover:bg-gray-50 transition-colors">
+            Cargar mas
+          </button>
+        }
       </div>
     </div>
   `,
@@ -52,6 +58,7 @@ export class ChatHistorySidebarComponent implements OnInit {
 
   private chatService = inject(ChatService);
   conversations = signal<Conversation[]>([]);
+  nextCursor = signal<string | null>(null);
 
   ngOnInit(): void {
     this.loadConversations();
@@ -59,7 +66,19 @@ export class ChatHistorySidebarComponent implements OnInit {
 
   loadConversations(): void {
     this.chatService.getConversations().subscribe({
-      next: (res) => this.conversations.set(res.data),
+      next: (res) => {
+        this.conversations.set(res.data);
+        this.nextCursor.set(res.pagination.next_cursor);
+      },
+    });
+  }
+
+  loadMore(): void {
+    this.chatService.getConversations(this.nextCursor()).subscribe({
+      next: (res) => {
+        this.conversations.update(list => [...list, ...res.data]);
+        this.nextCursor.set(res.pagination.next_cursor);
+      },
     });
   }
 
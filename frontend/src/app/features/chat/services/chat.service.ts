@@ -3,7 +3,7 @@ import { HttpClient } from '@angular/common/http';
 import { Observable } from 'rxjs';
 import { environment } from '../../../../environments/environment';
 import { TokenService } from '../../../core/services/token.service';
-import { ApiResponse, PaginatedResponse } from '../../../core/models/user.model';
+import { ApiResponse, CursorPaginatedResponse } from '../../../core/models/user.model';
 import { ChatMessage, ChatRequest, Conversation } from '../../../core/models/chat.model';
 
 export interface AutocompleteSuggestion {
@@ -73,9 +73,10 @@ export class ChatService {
     }
   }
 
-  getConversations(page = 1): Observable<PaginatedResponse<Conversation>> {
-    return this.http.get<PaginatedResponse<Conversation>>(
-      `${this.apiUrl}/conversations`, { params: { page: page.toString() } }
+  getConversations(cursor?: string | null): Observable<CursorPaginatedResponse<Conversation>> {
+    const params: Record<string, string> = cursor ? { cursor } : {};
+    return this.http.get<CursorPaginatedResponse<Conversation>>(
+      `${this.apiUrl}/conversations`, { params }
     );
   }
 
@@ -54,32 +54,156 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- =====================================================
+-- ADMIN LISTS: SEARCH AND TOTALS
+-- =====================================================
+
+-- Búsqueda del panel sobre columnas search_text (fn_search_key + índice GIN de trigramas).
+-- Una clave de menos de 3 caracteres no forma trigramas: se filtra por subcadena y se
+-- conserva el orden (created_at, id). Desde 3 caracteres también entran las palabras
+-- parecidas (<%, pg_trgm.word_similarity_threshold) y se ordena por word_similarity.
+
+-- Patrón LIKE '%clave%' con los comodines de la clave escapados
+CREATE OR REPLACE FUNCTION fn_search_like_pattern(p_key TEXT)
+RETURNS TEXT AS $$
+    SELECT '%' || replace(replace(replace(p_key, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Condición SQL equivalente para las consultas dinámicas de fn_count_*_list
+CREATE OR REPLACE FUNCTION fn_search_condition(p_key TEXT, p_column TEXT DEFAULT 'search_text')
+RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN length(p_key) < 3 THEN format('%I LIKE %L', p_column, fn_search_like_pattern(p_key))
+        ELSE format('(%1$I LIKE %2$L OR %3$L <%% %1$I)', p_column, fn_search_like_pattern(p_key), p_key)
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+
+-- Filas estimadas por el planificador para p_query (EXPLAIN, sin ejecutarla): total barato
+-- de los listados del panel. Solo para consultas armadas por las funciones fn_count_*_list
+-- con format(%L); no recibe texto del cliente.
+CREATE OR REPLACE FUNCTION fn_estimate_rows(p_query TEXT)
+RETURNS BIGINT AS $$
+DECLARE
+    v_plan JSON;
+BEGIN
+    EXECUTE 'EXPLAIN (FORMAT JSON) ' || p_query INTO v_plan;
+    RETURN (v_plan -> 0 -> 'Plan' ->> 'Plan Rows')::NUMERIC::BIGINT;
+END;
+$$ LANGUAGE plpgsql;
+
+
 -- =====================================================
 -- USERS FUNCTIONS
 -- =====================================================
 
+-- Listado por número de página. El total ya no se calcula con COUNT(*) OVER() (contaba
+-- todas las filas filtradas en cada página): el backend lo pide aparte a fn_count_users_list.
+-- Con búsqueda de 3 o más caracteres se ordena por similitud (ver fn_search_condition).
+DROP FUNCTION IF EXISTS fn_list_users(VARCHAR,INTEGER,INTEGER);
 CREATE OR REPLACE FUNCTION fn_list_users(
     p_search VARCHAR DEFAULT '',
     p_page INTEGER DEFAULT 1,
     p_per_page INTEGER DEFAULT 20
 )
+RETURNS TABLE(
+    id VARCHAR, email VARCHAR, full_name VARCHAR, role VARCHAR,
+    is_active BOOLEAN, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+) AS $$
+DECLARE
+    v_offset  INTEGER := (p_page - 1) * p_per_page;
+    v_key     TEXT := fn_search_key(btrim(COALESCE(p_search, '')));
+    v_pattern TEXT := fn_search_like_pattern(v_key);
+BEGIN
+    IF length(v_key) < 3 THEN
+        RETURN QUERY
+        SELECT u.id, u.email, u.full_name, u.role,
+               u.is_active, u.created_at, u.updated_at
+        FROM users u
+        WHERE (v_key = '' OR u.search_text LIKE v_pattern)
+        ORDER BY u.created_at DESC, u.id DESC
+        LIMIT p_per_page OFFSET v_offset;
+    ELSE
+        RETURN QUERY
+        SELECT u.id, u.email, u.full_name, u.role,
+               u.is_active, u.created_at, u.updated_at
+        FROM users u
+        WHERE u.search_text LIKE v_pattern OR v_key <% u.search_text
+        ORDER BY word_similarity(v_key, u.search_text) DESC, u.created_at DESC, u.id DESC
+        LIMIT p_per_page OFFSET v_offset;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Listado por cursor: usuarios posteriores a la fila del cursor en orden (created_at, id)
+-- descendente (idx_users_created_id) o, con búsqueda de 3 o más caracteres, en orden
+-- (search_rank, created_at, id) descendente. NULL = primera página; el backend pide
+-- p_limit + 1 filas para saber si hay otra página.
+DROP FUNCTION IF EXISTS fn_list_users_keyset(VARCHAR,TIMESTAMPTZ,VARCHAR,INTEGER);
+CREATE OR REPLACE FUNCTION fn_list_users_keyset(
+    p_search      VARCHAR     DEFAULT '',
+    p_before_rank REAL        DEFAULT NULL,
+    p_before_at   TIMESTAMPTZ DEFAULT NULL,
+    p_before_id   VARCHAR     DEFAULT NULL,
+    p_limit       INTEGER     DEFAULT 20
+)
 RETURNS TABLE(
     id VARCHAR, email VARCHAR, full_name VARCHAR, role VARCHAR,
     is_active BOOLEAN, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ,
-    total_count BIGINT
+    search_rank REAL
 ) AS $$
 DECLARE
-    v_offset INTEGER := (p_page - 1) * p_per_page;
+    v_key     TEXT := fn_search_key(btrim(COALESCE(p_search, '')));
+    v_pattern TEXT := fn_search_like_pattern(v_key);
 BEGIN
-    RETURN QUERY
-    SELECT u.id, u.email, u.full_name, u.role,
-           u.is_active, u.created_at, u.updated_at,
-           COUNT(*) OVER() AS total_count
-    FROM users u
-    WHERE (p_search = '' OR u.email ILIKE '%' || p_search || '%'
-           OR u.full_name ILIKE '%' || p_search || '%')
-    ORDER BY u.created_at DESC
-    LIMIT p_per_page OFFSET v_offset;
+    IF length(v_key) < 3 THEN
+        RETURN QUERY
+        SELECT u.id, u.email, u.full_name, u.role,
+               u.is_active, u.created_at, u.updated_at, NULL::REAL
+        FROM users u
+        WHERE (v_key = '' OR u.search_text LIKE v_pattern)
+          -- Sin OR con "IS NULL": la comparación de filas queda siempre como condición del índice
+          AND (u.created_at, u.id) < (COALESCE(p_before_at, 'infinity'), COALESCE(p_before_id, ''))
+        ORDER BY u.created_at DESC, u.id DESC
+        LIMIT p_limit;
+    ELSE
+        RETURN QUERY
+        SELECT s.id, s.email, s.full_name, s.role,
+               s.is_active, s.created_at, s.updated_at, s.rank
+        FROM (
+            SELECT u.*, word_similarity(v_key, u.search_text) AS rank
+            FROM users u
+            WHERE u.search_text LIKE v_pattern OR v_key <% u.search_text
+        ) s
+        WHERE (s.rank, s.created_at, s.id)
+            < (COALESCE(p_before_rank, 'infinity'), COALESCE(p_before_at, 'infinity'), COALESCE(p_before_id, ''))
+        ORDER BY s.rank DESC, s.created_at DESC, s.id DESC
+        LIMIT p_limit;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Total de fn_list_users: exacto (COUNT) o, con p_estimate, la estimación del planificador.
+CREATE OR REPLACE FUNCTION fn_count_users_list(
+    p_search   VARCHAR DEFAULT '',
+    p_estimate BOOLEAN DEFAULT FALSE
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_key   TEXT := fn_search_key(btrim(COALESCE(p_search, '')));
+    v_query TEXT := 'SELECT 1 FROM users';
+    v_total BIGINT;
+BEGIN
+    IF v_key <> '' THEN
+        v_query := v_query || ' WHERE ' || fn_search_condition(v_key);
+    END IF;
+    IF p_estimate THEN
+        RETURN fn_estimate_rows(v_query);
+    END IF;
+    EXECUTE 'SELECT COUNT(*) FROM (' || v_query || ') q' INTO v_total;
+    RETURN v_total;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -155,6 +279,8 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- Listado por número de página, sin total (ver fn_count_documents_list). Con búsqueda de
+-- 3 o más caracteres se ordena por similitud (ver fn_search_condition).
 DROP FUNCTION IF EXISTS fn_list_documents(VARCHAR,VARCHAR,VARCHAR,INTEGER,INTEGER);
 CREATE OR REPLACE FUNCTION fn_list_documents(
     p_search VARCHAR DEFAULT '',
@@ -163,33 +289,155 @@ CREATE OR REPLACE FUNCTION fn_list_documents(
     p_page INTEGER DEFAULT 1,
     p_per_page INTEGER DEFAULT 20
 )
+RETURNS TABLE(
+    id VARCHAR, title VARCHAR, original_filename VARCHAR, file_path VARCHAR,
+    file_type VARCHAR, file_size INTEGER, category_id VARCHAR,
+    uploaded_by VARCHAR, processing_status VARCHAR, processing_error TEXT,
+    summary TEXT, chunk_count INTEGER, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ,
+    category_name VARCHAR, category_slug VARCHAR, category_color VARCHAR, category_icon VARCHAR
+) AS $$
+DECLARE
+    v_offset  INTEGER := (p_page - 1) * p_per_page;
+    v_key     TEXT := fn_search_key(btrim(COALESCE(p_search, '')));
+    v_pattern TEXT := fn_search_like_pattern(v_key);
+BEGIN
+    IF length(v_key) < 3 THEN
+        RETURN QUERY
+        SELECT d.id, d.title, d.original_filename, d.file_path,
+               d.file_type, d.file_size, d.category_id,
+               d.uploaded_by, d.processing_status, d.processing_error,
+               d.summary, d.chunk_count, d.created_at, d.updated_at,
+               c.name AS category_name, c.slug AS category_slug,
+               c.color AS category_color, c.icon AS category_icon
+        FROM documents d
+        LEFT JOIN categories c ON d.category_id = c.id
+        WHERE (v_key = '' OR d.search_text LIKE v_pattern)
+          AND (p_cat_id = '' OR d.category_id = p_cat_id)
+          AND (p_status = '' OR d.processing_status = p_status)
+        ORDER BY d.created_at DESC, d.id DESC
+        LIMIT p_per_page OFFSET v_offset;
+    ELSE
+        RETURN QUERY
+        SELECT d.id, d.title, d.original_filename, d.file_path,
+               d.file_type, d.file_size, d.category_id,
+               d.uploaded_by, d.processing_status, d.processing_error,
+               d.summary, d.chunk_count, d.created_at, d.updated_at,
+               c.name AS category_name, c.slug AS category_slug,
+               c.color AS category_color, c.icon AS category_icon
+        FROM documents d
+        LEFT JOIN categories c ON d.category_id = c.id
+        WHERE (d.search_text LIKE v_pattern OR v_key <% d.search_text)
+          AND (p_cat_id = '' OR d.category_id = p_cat_id)
+          AND (p_status = '' OR d.processing_status = p_status)
+        ORDER BY word_similarity(v_key, d.search_text) DESC, d.created_at DESC, d.id DESC
+        LIMIT p_per_page OFFSET v_offset;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Listado por cursor en orden (created_at, id) descendente (idx_documents_created_id): el
+-- costo de una página no crece con su posición. Con búsqueda de 3 o más caracteres el orden
+-- es (search_rank, created_at, id) sobre las coincidencias del índice de trigramas.
+-- NULL = primera página.
+DROP FUNCTION IF EXISTS fn_list_documents_keyset(VARCHAR,VARCHAR,VARCHAR,TIMESTAMPTZ,VARCHAR,INTEGER);
+CREATE OR REPLACE FUNCTION fn_list_documents_keyset(
+    p_search      VARCHAR     DEFAULT '',
+    p_cat_id      VARCHAR     DEFAULT '',
+    p_status      VARCHAR     DEFAULT '',
+    p_before_rank REAL        DEFAULT NULL,
+    p_before_at   TIMESTAMPTZ DEFAULT NULL,
+    p_before_id   VARCHAR     DEFAULT NULL,
+    p_limit       INTEGER     DEFAULT 20
+)
 RETURNS TABLE(
     id VARCHAR, title VARCHAR, original_filename VARCHAR, file_path VARCHAR,
     file_type VARCHAR, file_size INTEGER, category_id VARCHAR,
     uploaded_by VARCHAR, processing_status VARCHAR, processing_error TEXT,
     summary TEXT, chunk_count INTEGER, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ,
     category_name VARCHAR, category_slug VARCHAR, category_color VARCHAR, category_icon VARCHAR,
-    total_count BIGINT
+    search_rank REAL
 ) AS $$
 DECLARE
-    v_offset INTEGER := (p_page - 1) * p_per_page;
+    v_key     TEXT := fn_search_key(btrim(COALESCE(p_search, '')));
+    v_pattern TEXT := fn_search_like_pattern(v_key);
 BEGIN
-    RETURN QUERY
-    SELECT d.id, d.title, d.original_filename, d.file_path,
-           d.file_type, d.file_size, d.category_id,
-           d.uploaded_by, d.processing_status, d.processing_error,
-           d.summary, d.chunk_count, d.created_at, d.updated_at,
-           c.name AS category_name, c.slug AS category_slug,
-           c.color AS category_color, c.icon AS category_icon,
-           COUNT(*) OVER() AS total_count
-    FROM documents d
-    LEFT JOIN categories c ON d.category_id = c.id
-    WHERE (p_search = '' OR d.title ILIKE '%' || p_search || '%'
-           OR d.original_filename ILIKE '%' || p_search || '%')
-      AND (p_cat_id = '' OR d.category_id = p_cat_id)
-      AND (p_status = '' OR d.processing_status = p_status)
-    ORDER BY d.created_at DESC
-    LIMIT p_per_page OFFSET v_offset;
+    IF length(v_key) < 3 THEN
+        RETURN QUERY
+        SELECT d.id, d.title, d.original_filename, d.file_path,
+               d.file_type, d.file_size, d.category_id,
+               d.uploaded_by, d.processing_status, d.processing_error,
+               d.summary, d.chunk_count, d.created_at, d.updated_at,
+               c.name AS category_name, c.slug AS category_slug,
+               c.color AS category_color, c.icon AS category_icon,
+               NULL::REAL
+        FROM documents d
+        LEFT JOIN categories c ON d.category_id = c.id
+        WHERE (v_key = '' OR d.search_text LIKE v_pattern)
+          AND (p_cat_id = '' OR d.category_id = p_cat_id)
+          AND (p_status = '' OR d.processing_status = p_status)
+          AND (d.created_at, d.id) < (COALESCE(p_before_at, 'infinity'), COALESCE(p_before_id, ''))
+        ORDER BY d.created_at DESC, d.id DESC
+        LIMIT p_limit;
+    ELSE
+        RETURN QUERY
+        SELECT s.id, s.title, s.original_filename, s.file_path,
+               s.file_type, s.file_size, s.category_id,
+               s.uploaded_by, s.processing_status, s.processing_error,
+               s.summary, s.chunk_count, s.created_at, s.updated_at,
+               s.category_name, s.category_slug,
+               s.category_color, s.category_icon,
+               s.rank
+        FROM (
+            SELECT d.*, c.name AS category_name, c.slug AS category_slug,
+                   c.color AS category_color, c.icon AS category_icon,
+                   word_similarity(v_key, d.search_text) AS rank
+            FROM documents d
+            LEFT JOIN categories c ON d.category_id = c.id
+            WHERE (d.search_text LIKE v_pattern OR v_key <% d.search_text)
+              AND (p_cat_id = '' OR d.category_id = p_cat_id)
+              AND (p_status = '' OR d.processing_status = p_status)
+        ) s
+        WHERE (s.rank, s.created_at, s.id)
+            < (COALESCE(p_before_rank, 'infinity'), COALESCE(p_before_at, 'infinity'), COALESCE(p_before_id, ''))
+        ORDER BY s.rank DESC, s.created_at DESC, s.id DESC
+        LIMIT p_limit;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Total de fn_list_documents. Sin filtros es el contador 'documents' (stat_counters,
+-- exacto y sin recorrer la tabla); con filtros, COUNT o la estimación del planificador.
+CREATE OR REPLACE FUNCTION fn_count_documents_list(
+    p_search   VARCHAR DEFAULT '',
+    p_cat_id   VARCHAR DEFAULT '',
+    p_status   VARCHAR DEFAULT '',
+    p_estimate BOOLEAN DEFAULT FALSE
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_key   TEXT := fn_search_key(btrim(COALESCE(p_search, '')));
+    v_query TEXT := 'SELECT 1 FROM documents WHERE TRUE';
+    v_total BIGINT;
+BEGIN
+    IF v_key = '' AND p_cat_id = '' AND p_status = '' THEN
+        RETURN fn_get_stat_counter('documents');
+    END IF;
+    IF v_key <> '' THEN
+        v_query := v_query || ' AND ' || fn_search_condition(v_key);
+    END IF;
+    IF p_cat_id <> '' THEN
+        v_query := v_query || format(' AND category_id = %L', p_cat_id);
+    END IF;
+    IF p_status <> '' THEN
+        v_query := v_query || format(' AND processing_status = %L', p_status);
+    END IF;
+    IF p_estimate THEN
+        RETURN fn_estimate_rows(v_query);
+    END IF;
+    EXECUTE 'SELECT COUNT(*) FROM (' || v_query || ') q' INTO v_total;
+    RETURN v_total;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -255,19 +503,15 @@ CREATE OR REPLACE FUNCTION fn_delete_document(p_id VARCHAR)
 RETURNS VARCHAR AS $$
 DECLARE
     v_file_path VARCHAR;
-    v_cat_id VARCHAR;
 BEGIN
-    SELECT d.file_path, d.category_id INTO v_file_path, v_cat_id
+    SELECT d.file_path INTO v_file_path
     FROM documents d WHERE d.id = p_id;
 
     IF v_file_path IS NULL THEN RETURN NULL; END IF;
 
+    -- categories.document_count lo ajusta trg_documents_category_count
     DELETE FROM documents WHERE documents.id = p_id;
 
-    IF v_cat_id IS NOT NULL THEN
-        PERFORM fn_update_category_doc_count(v_cat_id);
-    END IF;
-
     RETURN v_file_path;
 END;
 $$ LANGUAGE plpgsql;
@@ -301,6 +545,8 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- No borra chunks: la generación activa sigue respondiendo búsquedas mientras el
+-- pipeline construye la siguiente (ver fn_begin_document_generation).
 CREATE OR REPLACE FUNCTION fn_reset_document_for_reprocess(p_id VARCHAR)
 RETURNS BOOLEAN AS $$
 BEGIN
@@ -308,251 +554,1298 @@ BEGIN
         RETURN FALSE;
     END IF;
 
-    DELETE FROM document_chunks WHERE document_chunks.document_id = p_id;
+    UPDATE documents SET
+        processing_status = 'pending',
+        processing_error = NULL
+    WHERE documents.id = p_id;
+
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Nueva versión del archivo de un documento existente (re-subida). El archivo anterior
+-- queda en previous_file_path hasta que el pipeline publica la versión nueva (los chunks
+-- activos salen de él). Si ya había uno pendiente, el archivo actual es una re-subida que
+-- nunca llegó a publicarse: se devuelve su ruta para eliminarlo del disco (NULL si no).
+CREATE OR REPLACE FUNCTION fn_replace_document_file(
+    p_id       VARCHAR,
+    p_filename VARCHAR,
+    p_path     VARCHAR,
+    p_type     VARCHAR,
+    p_size     INTEGER
+)
+RETURNS VARCHAR AS $$
+DECLARE
+    v_current  VARCHAR;
+    v_previous VARCHAR;
+BEGIN
+    SELECT d.file_path, d.previous_file_path INTO v_current, v_previous
+    FROM documents d WHERE d.id = p_id FOR UPDATE;
 
     UPDATE documents SET
+        original_filename = p_filename,
+        file_path = p_path,
+        file_type = p_type,
+        file_size = p_size,
+        previous_file_path = COALESCE(v_previous, v_current),
         processing_status = 'pending',
+        processing_error = NULL
+    WHERE documents.id = p_id;
+
+    RETURN CASE WHEN v_previous IS NOT NULL THEN v_current END;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Versión nueva publicada (o documento eliminado): limpia previous_file_path y devuelve
+-- la ruta para borrar el archivo reemplazado del disco (NULL si no había).
+CREATE OR REPLACE FUNCTION fn_release_previous_file(p_id VARCHAR)
+RETURNS VARCHAR AS $$
+DECLARE
+    v_previous VARCHAR;
+BEGIN
+    SELECT d.previous_file_path INTO v_previous FROM documents d WHERE d.id = p_id FOR UPDATE;
+    IF v_previous IS NOT NULL THEN
+        UPDATE documents SET previous_file_path = NULL WHERE documents.id = p_id;
+    END IF;
+    RETURN v_previous;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Reserva una generación nueva para el documento (UPDATE con bloqueo de fila: dos
+-- procesamientos concurrentes obtienen generaciones distintas) y lo marca 'processing'.
+CREATE OR REPLACE FUNCTION fn_begin_document_generation(p_id VARCHAR)
+RETURNS INTEGER AS $$
+DECLARE
+    v_generation INTEGER;
+BEGIN
+    UPDATE documents SET
+        building_generation = GREATEST(
+            documents.active_generation,
+            COALESCE(documents.building_generation, 0),
+            COALESCE((SELECT MAX(dc.generation) FROM document_chunks dc
+                      WHERE dc.document_id = p_id), 0)
+        ) + 1,
+        processing_status = 'processing',
+        processing_error = NULL
+    WHERE documents.id = p_id
+    RETURNING documents.building_generation INTO v_generation;
+
+    RETURN v_generation;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Cambio atómico de generación: las búsquedas pasan a ver los chunks nuevos en el mismo
+-- commit. Solo se activa la generación que sigue en building_generation: si otro
+-- procesamiento reservó una más nueva, fn_gc_chunk_generations ya puede haber borrado
+-- chunks de esta, así que se descarta (RETURN FALSE) en vez de servirla incompleta.
+-- p_summary (texto del resumen de esta generación) se guarda en el mismo UPDATE: si el
+-- procesamiento falla antes, documents.summary sigue describiendo la generación activa.
+DROP FUNCTION IF EXISTS fn_activate_document_generation(VARCHAR,INTEGER,INTEGER);
+CREATE OR REPLACE FUNCTION fn_activate_document_generation(
+    p_id          VARCHAR,
+    p_generation  INTEGER,
+    p_chunk_count INTEGER,
+    p_summary     TEXT DEFAULT NULL
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE documents SET
+        active_generation = p_generation,
+        building_generation = NULLIF(documents.building_generation, p_generation),
+        processing_status = 'completed',
         processing_error = NULL,
-        summary = NULL,
-        chunk_count = 0
+        chunk_count = p_chunk_count,
+        summary = COALESCE(p_summary, documents.summary)
+    WHERE documents.id = p_id
+      AND documents.building_generation = p_generation
+      AND documents.active_generation < p_generation;
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Procesamiento fallido: la generación activa queda intacta; los chunks parciales de
+-- p_generation los elimina fn_gc_chunk_generations.
+CREATE OR REPLACE FUNCTION fn_abort_document_generation(
+    p_id         VARCHAR,
+    p_generation INTEGER,
+    p_error      TEXT
+)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE documents SET
+        building_generation = NULLIF(documents.building_generation, p_generation),
+        processing_status = 'failed',
+        processing_error = p_error
     WHERE documents.id = p_id;
+END;
+$$ LANGUAGE plpgsql;
 
-    RETURN TRUE;
+
+-- Recuento completo de una categoría. El valor lo mantiene trg_documents_category_count;
+-- esta función queda para reparaciones puntuales (fn_reconcile_stat_counters recalcula todas).
+CREATE OR REPLACE FUNCTION fn_update_category_doc_count(p_cat_id VARCHAR)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE categories SET document_count = (
+        SELECT COUNT(*) FROM documents
+        WHERE documents.category_id = p_cat_id AND documents.processing_status = 'completed'
+    ) WHERE categories.id = p_cat_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION fn_get_document_for_processing(p_id VARCHAR)
+RETURNS TABLE(
+    id VARCHAR, title VARCHAR, file_path VARCHAR, file_type VARCHAR,
+    category_id VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT d.id, d.title, d.file_path, d.file_type, d.category_id
+    FROM documents d WHERE d.id = p_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =====================================================
+-- CATEGORIES FUNCTIONS
+-- =====================================================
+
+DROP FUNCTION IF EXISTS fn_list_categories(BOOLEAN);
+CREATE OR REPLACE FUNCTION fn_list_categories(p_active_only BOOLEAN DEFAULT TRUE)
+RETURNS TABLE(
+    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
+    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
+    document_count INTEGER, created_at TIMESTAMPTZ
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT c.id, c.name, c.slug, c.description,
+           c.icon, c.color, c.is_active, c.exclude_from_rag,
+           c.document_count, c.created_at
+    FROM categories c
+    WHERE (NOT p_active_only OR c.is_active = TRUE)
+    ORDER BY c.name;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP FUNCTION IF EXISTS fn_create_category(VARCHAR,VARCHAR,TEXT,VARCHAR,VARCHAR);
+CREATE OR REPLACE FUNCTION fn_create_category(
+    p_name VARCHAR,
+    p_slug VARCHAR,
+    p_desc TEXT DEFAULT NULL,
+    p_icon VARCHAR DEFAULT 'folder',
+    p_color VARCHAR DEFAULT '#1E3A5F'
+)
+RETURNS TABLE(
+    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
+    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
+    document_count INTEGER, created_at TIMESTAMPTZ
+) AS $$
+BEGIN
+    RETURN QUERY
+    INSERT INTO categories (name, slug, description, icon, color)
+    VALUES (p_name, p_slug, p_desc, p_icon, p_color)
+    RETURNING categories.id, categories.name, categories.slug, categories.description,
+              categories.icon, categories.color, categories.is_active, categories.exclude_from_rag,
+              categories.document_count, categories.created_at;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP FUNCTION IF EXISTS fn_get_category(VARCHAR);
+CREATE OR REPLACE FUNCTION fn_get_category(p_id VARCHAR)
+RETURNS TABLE(
+    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
+    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
+    document_count INTEGER, created_at TIMESTAMPTZ
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT c.id, c.name, c.slug, c.description,
+           c.icon, c.color, c.is_active, c.exclude_from_rag,
+           c.document_count, c.created_at
+    FROM categories c WHERE c.id = p_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION fn_category_slug_exists(
+    p_slug VARCHAR,
+    p_exclude_id VARCHAR DEFAULT NULL
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+    RETURN EXISTS (
+        SELECT 1 FROM categories
+        WHERE slug = p_slug AND (p_exclude_id IS NULL OR id != p_exclude_id)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP FUNCTION IF EXISTS fn_update_category(VARCHAR,VARCHAR,VARCHAR,TEXT,VARCHAR,VARCHAR,BOOLEAN,BOOLEAN);
+CREATE OR REPLACE FUNCTION fn_update_category(
+    p_id VARCHAR,
+    p_name VARCHAR DEFAULT NULL,
+    p_slug VARCHAR DEFAULT NULL,
+    p_desc TEXT DEFAULT NULL,
+    p_icon VARCHAR DEFAULT NULL,
+    p_color VARCHAR DEFAULT NULL,
+    p_is_active BOOLEAN DEFAULT NULL,
+    p_exclude_from_rag BOOLEAN DEFAULT NULL
+)
+RETURNS TABLE(
+    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
+    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
+    document_count INTEGER, created_at TIMESTAMPTZ
+) AS $$
+BEGIN
+    UPDATE categories SET
+        name = COALESCE(p_name, categories.name),
+        slug = COALESCE(p_slug, categories.slug),
+        description = COALESCE(p_desc, categories.description),
+        icon = COALESCE(p_icon, categories.icon),
+        color = COALESCE(p_color, categories.color),
+        is_active = COALESCE(p_is_active, categories.is_active),
+        exclude_from_rag = COALESCE(p_exclude_from_rag, categories.exclude_from_rag)
+    WHERE categories.id = p_id;
+
+    RETURN QUERY
+    SELECT c.id, c.name, c.slug, c.description,
+           c.icon, c.color, c.is_active, c.exclude_from_rag,
+           c.document_count, c.created_at
+    FROM categories c WHERE c.id = p_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION fn_delete_category(p_id VARCHAR)
+RETURNS BOOLEAN AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM documents WHERE documents.category_id = p_id) THEN
+        RETURN FALSE;
+    END IF;
+    DELETE FROM categories WHERE categories.id = p_id;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =====================================================
+-- RAG SETTINGS
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION fn_get_rag_setting(p_key VARCHAR, p_default TEXT DEFAULT NULL)
+RETURNS TEXT AS $$
+    SELECT COALESCE((SELECT rs.value FROM rag_settings rs WHERE rs.key = p_key), p_default);
+$$ LANGUAGE sql STABLE;
+
+
+CREATE OR REPLACE FUNCTION fn_set_rag_setting(p_key VARCHAR, p_value TEXT)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO rag_settings (key, value) VALUES (p_key, p_value)
+    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Modo de almacenamiento de embeddings:
+--   'float32' -> document_chunks.embedding (vector)
+--   'dual'    -> migración en curso: se escriben ambas columnas, se busca en float32
+--   'halfvec' -> document_chunks.embedding_half (halfvec, mitad de tamaño)
+CREATE OR REPLACE FUNCTION fn_get_vector_storage()
+RETURNS TEXT AS $$
+    SELECT fn_get_rag_setting('vector_storage', 'float32');
+$$ LANGUAGE sql STABLE;
+
+
+-- Misma clave que app.rag.embedding_cache.text_hash(_embedding_text(chunk)).
+CREATE OR REPLACE FUNCTION fn_chunk_content_hash(p_title TEXT, p_content TEXT)
+RETURNS VARCHAR AS $$
+    SELECT encode(sha256(convert_to('[' || COALESCE(p_title, '') || ']' || E'\n' || p_content, 'UTF8')), 'hex');
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+
+-- Truncado Matryoshka: primeras p_dims dimensiones renormalizadas (norma L2 = 1).
+CREATE OR REPLACE FUNCTION fn_truncate_embedding(p_embedding vector, p_dims INTEGER)
+RETURNS vector AS $$
+    SELECT l2_normalize(subvector(p_embedding, 1, p_dims));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+
+-- =====================================================
+-- CHUNKS FUNCTIONS
+-- =====================================================
+
+DROP FUNCTION IF EXISTS fn_create_chunk(VARCHAR,INTEGER,TEXT,FLOAT[],JSONB);
+DROP FUNCTION IF EXISTS fn_create_chunk(VARCHAR,INTEGER,TEXT,FLOAT[],JSONB,VARCHAR);
+DROP FUNCTION IF EXISTS fn_create_chunk(VARCHAR,INTEGER,TEXT,vector,JSONB,VARCHAR);
+-- searchable se calcula contra la generación del chunk (p_generation), igual que
+-- fn_flush_chunk_staging: un chunk de building_generation no es buscable hasta activarla.
+CREATE OR REPLACE FUNCTION fn_create_chunk(
+    p_doc_id     VARCHAR,
+    p_index      INTEGER,
+    p_content    TEXT,
+    p_embedding  vector  DEFAULT NULL,
+    p_metadata   JSONB DEFAULT NULL,
+    p_chunk_type VARCHAR DEFAULT 'content',
+    p_generation INTEGER DEFAULT 1
+)
+RETURNS TABLE(
+    id VARCHAR, document_id VARCHAR, chunk_index INTEGER, content TEXT,
+    chunk_type VARCHAR, metadata_json JSONB, created_at TIMESTAMPTZ
+) AS $$
+DECLARE
+    v_storage TEXT := fn_get_vector_storage();
+BEGIN
+    RETURN QUERY
+    INSERT INTO document_chunks (document_id, chunk_index, content, embedding, embedding_half,
+                                 embedding_bits, embedding_small, metadata_json, chunk_type,
+                                 generation, content_hash,
+                                 searchable, rag_excluded, category_id, page)
+    SELECT p_doc_id, p_index, p_content,
+           CASE WHEN p_embedding IS NOT NULL AND v_storage <> 'halfvec' THEN p_embedding::vector(768) END,
+           CASE WHEN p_embedding IS NOT NULL AND v_storage <> 'float32' THEN p_embedding::halfvec(768) END,
+           binary_quantize(p_embedding::vector(768))::bit(768),
+           CASE WHEN p_chunk_type = 'summary'
+                THEN fn_truncate_embedding(p_embedding::vector(768), 256)::vector(256) END,
+           p_metadata, p_chunk_type, p_generation,
+           fn_chunk_content_hash(p_metadata->>'title', p_content),
+           p_generation = d.active_generation, COALESCE(c.exclude_from_rag, FALSE), d.category_id,
+           COALESCE((p_metadata->>'page')::INTEGER, 1)
+    FROM documents d
+    LEFT JOIN categories c ON c.id = d.category_id
+    WHERE d.id = p_doc_id
+    RETURNING document_chunks.id, document_chunks.document_id, document_chunks.chunk_index,
+              document_chunks.content, document_chunks.chunk_type,
+              document_chunks.metadata_json, document_chunks.created_at;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR);
+DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN);
+DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN,VARCHAR[]);
+DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN,VARCHAR[],VARCHAR);
+DROP FUNCTION IF EXISTS fn_search_similar(vector,INTEGER,FLOAT,VARCHAR,BOOLEAN,VARCHAR[],VARCHAR);
+-- Subconsulta de candidatos compartida por fn_search_similar y fn_search_similar_multi
+-- (top $2 chunks por distancia a p_query_expr con los filtros $4 categoría y $6
+-- documentos). chunk_type y la exclusión se escriben como literales para que el planner
+-- elija el índice HNSW parcial: los chunks buscables se reparten entre
+-- idx_chunks_embedding_content (NOT rag_excluded) e idx_chunks_embedding_content_excluded,
+-- así que con p_include_excluded se recorren ambos índices (UNION ALL) y se fusionan.
+CREATE OR REPLACE FUNCTION fn_similar_candidates_sql(
+    p_column           TEXT,
+    p_type             TEXT,
+    p_query_expr       TEXT,
+    p_chunk_type       VARCHAR,
+    p_include_excluded BOOLEAN
+)
+RETURNS TEXT AS $$
+DECLARE
+    v_branch TEXT := $b$
+        SELECT dc.id, dc.content, dc.document_id, dc.page, dc.category_id,
+               dc.%1$I <=> %3$s::%2$s AS distance
+        FROM document_chunks dc
+        WHERE dc.chunk_type = %4$L
+          AND dc.searchable
+          AND %5$s dc.rag_excluded
+          AND ($4 = '' OR dc.category_id = $4)
+          AND ($6 IS NULL OR dc.document_id = ANY($6))
+        ORDER BY distance
+        LIMIT $2
+    $b$;
+BEGIN
+    IF NOT p_include_excluded THEN
+        RETURN format(v_branch, p_column, p_type, p_query_expr, p_chunk_type, 'NOT');
+    END IF;
+
+    RETURN format('SELECT u.* FROM ((%s) UNION ALL (%s)) u ORDER BY u.distance LIMIT $2',
+                  format(v_branch, p_column, p_type, p_query_expr, p_chunk_type, 'NOT'),
+                  format(v_branch, p_column, p_type, p_query_expr, p_chunk_type, ''));
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+-- Búsqueda aproximada pensada para que el índice HNSW haga el trabajo con filtros selectivos:
+--   * hnsw.iterative_scan = relaxed_order (pgvector >= 0.8): si los filtros descartan
+--     candidatos, el índice sigue entregando vecinos en vez de devolver menos de p_top_k;
+--   * hnsw.ef_search configurable (p_ef_search, RAG_HNSW_EF_SEARCH);
+--   * la distancia se calcula una vez (subconsulta) y el umbral se aplica DESPUÉS del
+--     ORDER BY/LIMIT, así el predicado no impide ordenar por el índice.
+-- Ambos ajustes son locales a la transacción (set_config(..., TRUE)).
+-- Los filtros usan las columnas desnormalizadas de document_chunks (ver
+-- fn_similar_candidates_sql); documents solo aporta el título de los resultados.
+CREATE OR REPLACE FUNCTION fn_search_similar(
+    p_query_embedding  vector,
+    p_top_k            INTEGER   DEFAULT 5,
+    p_score_threshold  FLOAT     DEFAULT 0.35,
+    p_category_id      VARCHAR   DEFAULT '',
+    p_include_excluded BOOLEAN   DEFAULT FALSE,
+    p_document_ids     VARCHAR[] DEFAULT NULL,
+    p_chunk_type       VARCHAR   DEFAULT 'content',
+    p_ef_search        INTEGER   DEFAULT 100
+)
+RETURNS TABLE(
+    content TEXT, document_id VARCHAR, title VARCHAR,
+    page INTEGER, score FLOAT, category_id VARCHAR
+) AS $$
+DECLARE
+    v_column TEXT := 'embedding';
+    v_type   TEXT := 'vector(768)';
+BEGIN
+    IF fn_get_vector_storage() = 'halfvec' THEN
+        v_column := 'embedding_half';
+        v_type   := 'halfvec(768)';
+    END IF;
+
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', TRUE);
+    PERFORM set_config('hnsw.ef_search', LEAST(GREATEST(p_ef_search, p_top_k), 1000)::TEXT, TRUE);
+
+    RETURN QUERY EXECUTE format($q$
+        SELECT
+            hits.content,
+            hits.document_id,
+            d.title,
+            hits.page,
+            (1 - hits.distance)::FLOAT AS score,
+            COALESCE(hits.category_id, '')::VARCHAR AS category_id
+        FROM (%s) hits
+        JOIN documents d ON d.id = hits.document_id
+        WHERE hits.distance <= 1 - $3
+        ORDER BY hits.distance
+    $q$, fn_similar_candidates_sql(v_column, v_type, '$1', p_chunk_type, p_include_excluded))
+    USING p_query_embedding, p_top_k, p_score_threshold, p_category_id,
+          p_include_excluded, p_document_ids;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Varias consultas en un solo viaje: un LATERAL por vector contra los mismos índices
+-- parciales que fn_search_similar, top p_top_k por consulta. Lo usan las variantes del
+-- query expander y la verificación de originalidad (páginas de chunks de la tesis).
+-- query_index (1..n) indica la posición del vector en p_query_embeddings; chunk_id
+-- permite fusionar resultados repetidos entre consultas.
+CREATE OR REPLACE FUNCTION fn_search_similar_multi(
+    p_query_embeddings vector[],
+    p_top_k            INTEGER   DEFAULT 5,
+    p_score_threshold  FLOAT     DEFAULT 0.35,
+    p_category_id      VARCHAR   DEFAULT '',
+    p_include_excluded BOOLEAN   DEFAULT FALSE,
+    p_document_ids     VARCHAR[] DEFAULT NULL,
+    p_chunk_type       VARCHAR   DEFAULT 'content',
+    p_ef_search        INTEGER   DEFAULT 100
+)
+RETURNS TABLE(
+    query_index INTEGER, chunk_id VARCHAR, content TEXT, document_id VARCHAR,
+    title VARCHAR, page INTEGER, score FLOAT, category_id VARCHAR
+) AS $$
+DECLARE
+    v_column TEXT := 'embedding';
+    v_type   TEXT := 'vector(768)';
+BEGIN
+    IF fn_get_vector_storage() = 'halfvec' THEN
+        v_column := 'embedding_half';
+        v_type   := 'halfvec(768)';
+    END IF;
+
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', TRUE);
+    PERFORM set_config('hnsw.ef_search', LEAST(GREATEST(p_ef_search, p_top_k), 1000)::TEXT, TRUE);
+
+    RETURN QUERY EXECUTE format($q$
+        SELECT
+            q.query_index::INTEGER,
+            hits.id,
+            hits.content,
+            hits.document_id,
+            d.title,
+            hits.page,
+            (1 - hits.distance)::FLOAT AS score,
+            COALESCE(hits.category_id, '')::VARCHAR AS category_id
+        FROM unnest($1) WITH ORDINALITY AS q(embedding, query_index)
+        CROSS JOIN LATERAL (%s) hits
+        JOIN documents d ON d.id = hits.document_id
+        WHERE hits.distance <= 1 - $3
+        ORDER BY q.query_index, hits.distance
+    $q$, fn_similar_candidates_sql(v_column, v_type, 'q.embedding', p_chunk_type, p_include_excluded))
+    USING p_query_embeddings, p_top_k, p_score_threshold, p_category_id,
+          p_include_excluded, p_document_ids;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Consulta léxica a partir de la pregunta en lenguaje natural: los lexemas de
+-- plainto_tsquery (sin stopwords, con stemming en español). Con p_any los lexemas se unen
+-- con OR en vez de AND, para que una pregunta larga encuentre el chunk que solo contiene el
+-- código buscado; fn_search_lexical_multi solo la usa si la versión AND no encuentra nada.
+-- Los tokens compuestos (p.ej. 'ISI-101') conservan su frase. NULL si no queda ningún lexema.
+DROP FUNCTION IF EXISTS fn_lexical_tsquery(TEXT);
+CREATE OR REPLACE FUNCTION fn_lexical_tsquery(p_text TEXT, p_any BOOLEAN DEFAULT FALSE)
+RETURNS tsquery AS $$
+    SELECT CASE WHEN p_any
+                THEN NULLIF(replace(plainto_tsquery('spanish', p_text)::TEXT, ' & ', ' | '), '')::tsquery
+                ELSE NULLIF(plainto_tsquery('spanish', p_text)::TEXT, '')::tsquery
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+
+-- Búsqueda léxica del modo híbrido (RAG_HYBRID_SEARCH): top p_top_k chunks 'content' por
+-- ts_rank_cd sobre idx_chunks_content_tsv, una consulta (texto + vector) por posición.
+-- Cada consulta usa sus lexemas con AND y, solo si ningún chunk los contiene todos, con OR.
+-- ts_rank_cd se calcula sobre a lo más p_max_candidates coincidencias por consulta: una
+-- palabra común (p.ej. 'reglamento') no obliga a puntuar medio corpus.
+-- score es el coseno con el vector de la misma consulta, calculado solo para los
+-- resultados, así la fusión RRF del backend muestra el mismo score que la búsqueda vectorial.
+-- Resultados en orden de query_index y ranking léxico.
+DROP FUNCTION IF EXISTS fn_search_lexical_multi(TEXT[],vector[],INTEGER,VARCHAR,VARCHAR[]);
+CREATE OR REPLACE FUNCTION fn_search_lexical_multi(
+    p_queries          TEXT[],
+    p_query_embeddings vector[],
+    p_top_k            INTEGER   DEFAULT 20,
+    p_category_id      VARCHAR   DEFAULT '',
+    p_document_ids     VARCHAR[] DEFAULT NULL,
+    p_max_candidates   INTEGER   DEFAULT 1000
+)
+RETURNS TABLE(
+    query_index INTEGER, chunk_id VARCHAR, content TEXT, document_id VARCHAR,
+    title VARCHAR, page INTEGER, score FLOAT, lexical_rank FLOAT, category_id VARCHAR
+) AS $$
+DECLARE
+    v_column TEXT := 'embedding';
+    v_type   TEXT := 'vector(768)';
+BEGIN
+    IF fn_get_vector_storage() = 'halfvec' THEN
+        v_column := 'embedding_half';
+        v_type   := 'halfvec(768)';
+    END IF;
+
+    RETURN QUERY EXECUTE format($q$
+        SELECT
+            q.query_index::INTEGER,
+            hits.id,
+            hits.content,
+            hits.document_id,
+            d.title,
+            hits.page,
+            (1 - (hits.vec <=> q.embedding::%2$s))::FLOAT AS score,
+            hits.rank::FLOAT AS lexical_rank,
+            COALESCE(hits.category_id, '')::VARCHAR AS category_id
+        FROM unnest($1, $2) WITH ORDINALITY AS q(query_text, embedding, query_index)
+        CROSS JOIN LATERAL (
+            SELECT CASE WHEN EXISTS (
+                            SELECT 1 FROM document_chunks dc
+                            WHERE dc.content_tsv @@ fn_lexical_tsquery(q.query_text)
+                              AND dc.chunk_type = 'content'
+                              AND dc.searchable
+                              AND NOT dc.rag_excluded
+                              AND ($4 = '' OR dc.category_id = $4)
+                              AND ($5 IS NULL OR dc.document_id = ANY($5)))
+                        THEN fn_lexical_tsquery(q.query_text)
+                        ELSE fn_lexical_tsquery(q.query_text, TRUE)
+                   END AS tsq
+        ) lq
+        CROSS JOIN LATERAL (
+            SELECT m.id, m.content, m.document_id, m.page, m.category_id, m.vec,
+                   ts_rank_cd(m.content_tsv, lq.tsq) AS rank
+            FROM (
+                SELECT dc.id, dc.content, dc.document_id, dc.page, dc.category_id,
+                       dc.content_tsv, dc.%1$I AS vec
+                FROM document_chunks dc
+                WHERE dc.content_tsv @@ lq.tsq
+                  AND dc.chunk_type = 'content'
+                  AND dc.searchable
+                  AND NOT dc.rag_excluded
+                  AND ($4 = '' OR dc.category_id = $4)
+                  AND ($5 IS NULL OR dc.document_id = ANY($5))
+                LIMIT $6
+            ) m
+            ORDER BY rank DESC
+            LIMIT $3
+        ) hits
+        JOIN documents d ON d.id = hits.document_id
+        ORDER BY q.query_index, hits.rank DESC
+    $q$, v_column, v_type)
+    USING p_queries, p_query_embeddings, p_top_k, p_category_id, p_document_ids,
+          GREATEST(p_max_candidates, p_top_k);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Modo 'binary': primera etapa por distancia de Hamming sobre embedding_bits (índice HNSW
+-- bit_hamming_ops) con p_top_k * p_oversample candidatos; luego re-ranking por coseno exacto
+-- contra el vector completo (embedding o embedding_half según vector_storage).
+-- Misma firma de salida que fn_search_similar.
+DROP FUNCTION IF EXISTS fn_search_similar_binary(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN,VARCHAR[],VARCHAR,INTEGER);
+CREATE OR REPLACE FUNCTION fn_search_similar_binary(
+    p_query_embedding  vector,
+    p_top_k            INTEGER   DEFAULT 5,
+    p_score_threshold  FLOAT     DEFAULT 0.35,
+    p_category_id      VARCHAR   DEFAULT '',
+    p_include_excluded BOOLEAN   DEFAULT FALSE,
+    p_document_ids     VARCHAR[] DEFAULT NULL,
+    p_chunk_type       VARCHAR   DEFAULT 'content',
+    p_oversample       INTEGER   DEFAULT 10
+)
+RETURNS TABLE(
+    content TEXT, document_id VARCHAR, title VARCHAR,
+    page INTEGER, score FLOAT, category_id VARCHAR
+) AS $$
+DECLARE
+    v_column TEXT := 'embedding';
+    v_type   TEXT := 'vector(768)';
+BEGIN
+    IF fn_get_vector_storage() = 'halfvec' THEN
+        v_column := 'embedding_half';
+        v_type   := 'halfvec(768)';
+    END IF;
+
+    -- HNSW devuelve como máximo ef_search filas: debe cubrir el sobremuestreo (local a la transacción)
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', TRUE);
+    PERFORM set_config('hnsw.ef_search',
+                       LEAST(GREATEST(p_top_k * GREATEST(p_oversample, 1), 40), 1000)::TEXT, TRUE);
+
+    RETURN QUERY EXECUTE format($q$
+        WITH candidates AS (
+            SELECT dc.id
+            FROM document_chunks dc
+            WHERE dc.embedding_bits IS NOT NULL
+              AND dc.chunk_type = %3$L
+              AND dc.searchable %4$s
+              AND ($4 = '' OR dc.category_id = $4)
+              AND ($6 IS NULL OR dc.document_id = ANY($6))
+            ORDER BY dc.embedding_bits <~> binary_quantize($1::vector(768))
+            LIMIT $2 * GREATEST($8, 1)
+        ),
+        rescored AS (
+            SELECT
+                dc.content,
+                dc.document_id,
+                d.title,
+                dc.page,
+                (1 - (dc.%1$I <=> $1::%2$s))::FLOAT AS score,
+                COALESCE(dc.category_id, '')::VARCHAR AS category_id
+            FROM candidates cand
+            JOIN document_chunks dc ON dc.id = cand.id
+            JOIN documents d ON d.id = dc.document_id
+            WHERE dc.%1$I IS NOT NULL
+        )
+        SELECT r.* FROM rescored r
+        WHERE r.score >= $3
+        ORDER BY r.score DESC
+        LIMIT $2
+    $q$, v_column, v_type, p_chunk_type,
+         CASE WHEN p_include_excluded THEN '' ELSE 'AND NOT dc.rag_excluded' END)
+    USING p_query_embedding, p_top_k, p_score_threshold, p_category_id,
+          p_include_excluded, p_document_ids, p_chunk_type, p_oversample;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Stage 1 (router de documentos): busca solo chunks 'summary' sobre embedding_small
+-- (256 dimensiones, índice parcial idx_chunks_embedding_small_searchable).
+-- Misma firma de salida que fn_search_similar.
+DROP FUNCTION IF EXISTS fn_search_summaries(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN);
+CREATE OR REPLACE FUNCTION fn_search_summaries(
+    p_query_embedding  vector,
+    p_top_k            INTEGER   DEFAULT 15,
+    p_score_threshold  FLOAT     DEFAULT 0.20,
+    p_category_id      VARCHAR   DEFAULT '',
+    p_include_excluded BOOLEAN   DEFAULT FALSE
+)
+RETURNS TABLE(
+    content TEXT, document_id VARCHAR, title VARCHAR,
+    page INTEGER, score FLOAT, category_id VARCHAR
+) AS $$
+DECLARE
+    v_query vector(256) := fn_truncate_embedding(p_query_embedding::vector(768), 256)::vector(256);
+BEGIN
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', TRUE);
+
+    -- Dos ramas para que la habitual lleve el predicado literal del índice parcial
+    IF p_include_excluded THEN
+        RETURN QUERY
+        SELECT
+            hits.content,
+            hits.document_id,
+            d.title,
+            hits.page,
+            (1 - hits.distance)::FLOAT AS score,
+            COALESCE(hits.category_id, '')::VARCHAR AS category_id
+        FROM (
+            SELECT dc.content, dc.document_id, dc.page, dc.category_id,
+                   dc.embedding_small <=> v_query AS distance
+            FROM document_chunks dc
+            WHERE dc.chunk_type = 'summary'
+              AND dc.searchable
+              AND (p_category_id = '' OR dc.category_id = p_category_id)
+            ORDER BY distance
+            LIMIT p_top_k
+        ) hits
+        JOIN documents d ON d.id = hits.document_id
+        WHERE hits.distance <= 1 - p_score_threshold
+        ORDER BY hits.distance;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT
+        hits.content,
+        hits.document_id,
+        d.title,
+        hits.page,
+        (1 - hits.distance)::FLOAT AS score,
+        COALESCE(hits.category_id, '')::VARCHAR AS category_id
+    FROM (
+        SELECT dc.content, dc.document_id, dc.page, dc.category_id,
+               dc.embedding_small <=> v_query AS distance
+        FROM document_chunks dc
+        WHERE dc.chunk_type = 'summary'
+          AND dc.searchable
+          AND NOT dc.rag_excluded
+          AND (p_category_id = '' OR dc.category_id = p_category_id)
+        ORDER BY distance
+        LIMIT p_top_k
+    ) hits
+    JOIN documents d ON d.id = hits.document_id
+    WHERE hits.distance <= 1 - p_score_threshold
+    ORDER BY hits.distance;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Stage 1 para varias consultas a la vez (ver fn_search_similar_multi).
+CREATE OR REPLACE FUNCTION fn_search_summaries_multi(
+    p_query_embeddings vector[],
+    p_top_k            INTEGER   DEFAULT 15,
+    p_score_threshold  FLOAT     DEFAULT 0.20,
+    p_category_id      VARCHAR   DEFAULT ''
+)
+RETURNS TABLE(
+    query_index INTEGER, chunk_id VARCHAR, content TEXT, document_id VARCHAR,
+    title VARCHAR, page INTEGER, score FLOAT, category_id VARCHAR
+) AS $$
+BEGIN
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', TRUE);
+
+    RETURN QUERY
+    SELECT
+        q.query_index::INTEGER,
+        hits.id,
+        hits.content,
+        hits.document_id,
+        d.title,
+        hits.page,
+        (1 - hits.distance)::FLOAT AS score,
+        COALESCE(hits.category_id, '')::VARCHAR AS category_id
+    FROM (
+        SELECT fn_truncate_embedding(e::vector(768), 256)::vector(256) AS embedding, o AS query_index
+        FROM unnest(p_query_embeddings) WITH ORDINALITY AS u(e, o)
+    ) q
+    CROSS JOIN LATERAL (
+        SELECT dc.id, dc.content, dc.document_id, dc.page, dc.category_id,
+               dc.embedding_small <=> q.embedding AS distance
+        FROM document_chunks dc
+        WHERE dc.chunk_type = 'summary'
+          AND dc.searchable
+          AND NOT dc.rag_excluded
+          AND (p_category_id = '' OR dc.category_id = p_category_id)
+        ORDER BY distance
+        LIMIT p_top_k
+    ) hits
+    JOIN documents d ON d.id = hits.document_id
+    WHERE hits.distance <= 1 - p_score_threshold
+    ORDER BY q.query_index, hits.distance;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Escritura masiva: el backend hace COPY a la tabla temporal chunk_staging (por sesión)
+-- y fn_flush_chunk_staging la vuelca a document_chunks con un solo INSERT ... SELECT,
+-- aplicando las mismas columnas derivadas que fn_create_chunk. No hace COMMIT: el
+-- llamador decide el alcance de la transacción (una por documento).
+CREATE OR REPLACE FUNCTION fn_prepare_chunk_staging()
+RETURNS VOID AS $$
+BEGIN
+    CREATE TEMP TABLE IF NOT EXISTS chunk_staging (
+        document_id   VARCHAR(36) NOT NULL,
+        chunk_index   INTEGER NOT NULL,
+        content       TEXT NOT NULL,
+        embedding     vector(768),
+        metadata_json JSONB,
+        chunk_type    VARCHAR(20) NOT NULL DEFAULT 'content',
+        generation    INTEGER NOT NULL DEFAULT 1
+    ) ON COMMIT DELETE ROWS;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION fn_flush_chunk_staging()
+RETURNS INTEGER AS $$
+DECLARE
+    v_storage TEXT := fn_get_vector_storage();
+    v_count   INTEGER;
+BEGIN
+    INSERT INTO document_chunks (document_id, chunk_index, content, embedding, embedding_half,
+                                 embedding_bits, embedding_small, metadata_json, chunk_type,
+                                 generation, content_hash,
+                                 searchable, rag_excluded, category_id, page)
+    SELECT s.document_id, s.chunk_index, s.content,
+           CASE WHEN v_storage <> 'halfvec' THEN s.embedding END,
+           CASE WHEN v_storage <> 'float32' THEN s.embedding::halfvec(768) END,
+           binary_quantize(s.embedding)::bit(768),
+           CASE WHEN s.chunk_type = 'summary'
+                THEN fn_truncate_embedding(s.embedding, 256)::vector(256) END,
+           s.metadata_json, s.chunk_type, s.generation,
+           fn_chunk_content_hash(s.metadata_json->>'title', s.content),
+           s.generation = d.active_generation, COALESCE(c.exclude_from_rag, FALSE),
+           d.category_id, COALESCE((s.metadata_json->>'page')::INTEGER, 1)
+    FROM chunk_staging s
+    JOIN documents d ON d.id = s.document_id
+    LEFT JOIN categories c ON c.id = d.category_id;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    DELETE FROM chunk_staging;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION fn_delete_chunks_by_document(p_doc_id VARCHAR)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM document_chunks WHERE document_chunks.document_id = p_doc_id;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Chunks de la generación activa con su hash (calculado al vuelo para filas anteriores
+-- a content_hash). Base del diff de re-subida incremental.
+CREATE OR REPLACE FUNCTION fn_get_document_chunk_hashes(p_doc_id VARCHAR)
+RETURNS TABLE(
+    id VARCHAR, chunk_index INTEGER, chunk_type VARCHAR, generation INTEGER, content_hash VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT dc.id, dc.chunk_index, dc.chunk_type, dc.generation,
+           COALESCE(dc.content_hash,
+                    fn_chunk_content_hash(dc.metadata_json->>'title', dc.content))::VARCHAR
+    FROM document_chunks dc
+    JOIN documents d ON d.id = dc.document_id
+    WHERE dc.document_id = p_doc_id AND dc.generation = d.active_generation
+    ORDER BY dc.chunk_index;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Aplica el diff de una re-subida sobre la generación activa en una sola transacción
+-- (no hace COMMIT): borra los chunks que desaparecieron, renumera/repagina los que se
+-- conservan y vuelca chunk_staging (solo chunks nuevos). p_summary (NULL = sin cambios)
+-- reemplaza documents.summary en la misma transacción. Devuelve los chunks insertados.
+DROP FUNCTION IF EXISTS fn_apply_chunk_diff(VARCHAR,VARCHAR[],VARCHAR[],INTEGER[],INTEGER[],INTEGER);
+CREATE OR REPLACE FUNCTION fn_apply_chunk_diff(
+    p_doc_id       VARCHAR,
+    p_delete_ids   VARCHAR[],
+    p_keep_ids     VARCHAR[],
+    p_keep_indexes INTEGER[],
+    p_keep_pages   INTEGER[],
+    p_chunk_count  INTEGER,
+    p_summary      TEXT DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_inserted INTEGER;
+BEGIN
+    DELETE FROM document_chunks
+    WHERE document_chunks.document_id = p_doc_id AND document_chunks.id = ANY(p_delete_ids);
+
+    UPDATE document_chunks SET
+        chunk_index = k.chunk_index,
+        page = k.page,
+        metadata_json = jsonb_set(COALESCE(document_chunks.metadata_json, '{}'::JSONB),
+                                  '{page}', to_jsonb(k.page))
+    FROM unnest(p_keep_ids, p_keep_indexes, p_keep_pages) AS k(id, chunk_index, page)
+    WHERE document_chunks.id = k.id
+      AND document_chunks.document_id = p_doc_id
+      AND (document_chunks.chunk_index <> k.chunk_index
+           OR document_chunks.page IS DISTINCT FROM k.page);
+
+    v_inserted := fn_flush_chunk_staging();
+    PERFORM fn_refresh_document_phrases(p_doc_id);
+
+    UPDATE documents SET
+        processing_status = 'completed',
+        processing_error = NULL,
+        chunk_count = p_chunk_count,
+        summary = COALESCE(p_summary, documents.summary)
+    WHERE documents.id = p_doc_id;
+
+    RETURN v_inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Elimina en lotes los chunks de generaciones que ni están activas ni en construcción
+-- (reprocesos ya activados, fallidos o reemplazados por uno más nuevo; estos últimos ya no
+-- pueden activarse, ver fn_activate_document_generation). p_doc_id NULL = todos los documentos.
+CREATE OR REPLACE FUNCTION fn_gc_chunk_generations(
+    p_doc_id VARCHAR DEFAULT NULL,
+    p_batch  INTEGER DEFAULT 5000
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM document_chunks
+    WHERE document_chunks.id IN (
+        SELECT dc.id FROM document_chunks dc
+        JOIN documents d ON d.id = dc.document_id
+        WHERE (p_doc_id IS NULL OR dc.document_id = p_doc_id)
+          AND dc.generation <> d.active_generation
+          AND dc.generation IS DISTINCT FROM d.building_generation
+        LIMIT p_batch
+    );
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- =====================================================
+-- VECTOR STORAGE MIGRATION (float32 -> halfvec)
+-- =====================================================
+
+-- Copia embedding -> embedding_half en lotes pequeños (sin bloquear la tabla).
+CREATE OR REPLACE FUNCTION fn_backfill_halfvec(p_batch INTEGER DEFAULT 5000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE document_chunks SET embedding_half = document_chunks.embedding::halfvec(768)
+    WHERE document_chunks.id IN (
+        SELECT dc.id FROM document_chunks dc
+        WHERE dc.embedding_half IS NULL AND dc.embedding IS NOT NULL
+        LIMIT p_batch
+    );
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Calcula embedding_bits para chunks insertados antes del modo 'binary'.
+CREATE OR REPLACE FUNCTION fn_backfill_bits(p_batch INTEGER DEFAULT 5000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE document_chunks SET embedding_bits = binary_quantize(
+        COALESCE(document_chunks.embedding, document_chunks.embedding_half::vector(768))
+    )::bit(768)
+    WHERE document_chunks.id IN (
+        SELECT dc.id FROM document_chunks dc
+        WHERE dc.embedding_bits IS NULL
+          AND (dc.embedding IS NOT NULL OR dc.embedding_half IS NOT NULL)
+        LIMIT p_batch
+    );
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Calcula embedding_small para los chunks 'summary' existentes.
+CREATE OR REPLACE FUNCTION fn_backfill_summary_small(p_batch INTEGER DEFAULT 5000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE document_chunks SET embedding_small = fn_truncate_embedding(
+        COALESCE(document_chunks.embedding, document_chunks.embedding_half::vector(768)), 256
+    )::vector(256)
+    WHERE document_chunks.id IN (
+        SELECT dc.id FROM document_chunks dc
+        WHERE dc.chunk_type = 'summary'
+          AND dc.embedding_small IS NULL
+          AND (dc.embedding IS NOT NULL OR dc.embedding_half IS NOT NULL)
+        LIMIT p_batch
+    );
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
 END;
 $$ LANGUAGE plpgsql;
 
 
-CREATE OR REPLACE FUNCTION fn_update_category_doc_count(p_cat_id VARCHAR)
-RETURNS VOID AS $$
+-- Libera la columna float32 una vez que halfvec es el modo activo.
+CREATE OR REPLACE FUNCTION fn_clear_float32_embeddings(p_batch INTEGER DEFAULT 5000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
 BEGIN
-    UPDATE categories SET document_count = (
-        SELECT COUNT(*) FROM documents
-        WHERE documents.category_id = p_cat_id AND documents.processing_status = 'completed'
-    ) WHERE categories.id = p_cat_id;
+    IF fn_get_vector_storage() <> 'halfvec' THEN
+        RAISE EXCEPTION 'vector_storage debe ser halfvec antes de liberar embeddings float32';
+    END IF;
+
+    UPDATE document_chunks SET embedding = NULL
+    WHERE document_chunks.id IN (
+        SELECT dc.id FROM document_chunks dc
+        WHERE dc.embedding IS NOT NULL AND dc.embedding_half IS NOT NULL
+        LIMIT p_batch
+    );
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
 END;
 $$ LANGUAGE plpgsql;
 
 
-CREATE OR REPLACE FUNCTION fn_get_document_for_processing(p_id VARCHAR)
+DROP FUNCTION IF EXISTS fn_get_vector_storage_stats();
+CREATE OR REPLACE FUNCTION fn_get_vector_storage_stats()
 RETURNS TABLE(
-    id VARCHAR, title VARCHAR, file_path VARCHAR, file_type VARCHAR,
-    category_id VARCHAR
+    storage TEXT,
+    float32_rows BIGINT,
+    halfvec_rows BIGINT,
+    bits_rows BIGINT,
+    table_bytes BIGINT,
+    float32_index_bytes BIGINT,
+    halfvec_index_bytes BIGINT,
+    bits_index_bytes BIGINT
 ) AS $$
 BEGIN
     RETURN QUERY
-    SELECT d.id, d.title, d.file_path, d.file_type, d.category_id
-    FROM documents d WHERE d.id = p_id;
+    SELECT
+        fn_get_vector_storage(),
+        (SELECT COUNT(*) FROM document_chunks dc WHERE dc.embedding IS NOT NULL),
+        (SELECT COUNT(*) FROM document_chunks dc WHERE dc.embedding_half IS NOT NULL),
+        (SELECT COUNT(*) FROM document_chunks dc WHERE dc.embedding_bits IS NOT NULL),
+        pg_total_relation_size('document_chunks'),
+        COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_content')), 0)
+            + COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_content_excluded')), 0)
+            + COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_summary')), 0),
+        COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_half_content')), 0)
+            + COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_half_content_excluded')), 0)
+            + COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_half_summary')), 0),
+        COALESCE(pg_relation_size(to_regclass('idx_chunks_embedding_bits_searchable')), 0);
 END;
 $$ LANGUAGE plpgsql;
 
 
 -- =====================================================
--- CATEGORIES FUNCTIONS
+-- ANN REPLICA (app/rag/ann_replica.py)
 -- =====================================================
 
-DROP FUNCTION IF EXISTS fn_list_categories(BOOLEAN);
-CREATE OR REPLACE FUNCTION fn_list_categories(p_active_only BOOLEAN DEFAULT TRUE)
+-- Chunks que sirve la réplica (content, buscables, no excluidos) en orden de id, por
+-- páginas (keyset). Vector en float32 aunque vector_storage sea halfvec.
+CREATE OR REPLACE FUNCTION fn_list_replica_chunks(
+    p_after_id VARCHAR DEFAULT '',
+    p_limit    INTEGER DEFAULT 10000
+)
 RETURNS TABLE(
-    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
-    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
-    document_count INTEGER, created_at TIMESTAMPTZ
+    id VARCHAR, document_id VARCHAR, category_id VARCHAR, page INTEGER, embedding vector
 ) AS $$
 BEGIN
     RETURN QUERY
-    SELECT c.id, c.name, c.slug, c.description,
-           c.icon, c.color, c.is_active, c.exclude_from_rag,
-           c.document_count, c.created_at
-    FROM categories c
-    WHERE (NOT p_active_only OR c.is_active = TRUE)
-    ORDER BY c.name;
+    SELECT dc.id, dc.document_id, dc.category_id, dc.page,
+           COALESCE(dc.embedding, dc.embedding_half::vector(768))
+    FROM document_chunks dc
+    WHERE dc.id > p_after_id
+      AND dc.chunk_type = 'content' AND dc.searchable AND NOT dc.rag_excluded
+      AND (dc.embedding IS NOT NULL OR dc.embedding_half IS NOT NULL)
+    ORDER BY dc.id
+    LIMIT p_limit;
 END;
 $$ LANGUAGE plpgsql;
 
 
-DROP FUNCTION IF EXISTS fn_create_category(VARCHAR,VARCHAR,TEXT,VARCHAR,VARCHAR);
-CREATE OR REPLACE FUNCTION fn_create_category(
-    p_name VARCHAR,
-    p_slug VARCHAR,
-    p_desc TEXT DEFAULT NULL,
-    p_icon VARCHAR DEFAULT 'folder',
-    p_color VARCHAR DEFAULT '#1E3A5F'
+CREATE OR REPLACE FUNCTION fn_count_replica_chunks()
+RETURNS BIGINT AS $$
+    SELECT COUNT(*) FROM document_chunks dc
+    WHERE dc.chunk_type = 'content' AND dc.searchable AND NOT dc.rag_excluded
+      AND (dc.embedding IS NOT NULL OR dc.embedding_half IS NOT NULL);
+$$ LANGUAGE sql STABLE;
+
+
+CREATE OR REPLACE FUNCTION fn_get_chunk_change_bounds()
+RETURNS TABLE(min_seq BIGINT, max_seq BIGINT) AS $$
+    SELECT COALESCE(MIN(l.seq), 0), COALESCE(MAX(l.seq), 0) FROM chunk_change_log l;
+$$ LANGUAGE sql STABLE;
+
+
+-- Cambios posteriores a p_since más los seq pendientes p_holes (huecos vistos antes:
+-- transacciones que aún no habían hecho commit). Devuelve el estado ACTUAL de cada
+-- chunk: present = FALSE si ya no debe estar en la réplica (borrado, oculto o excluido).
+CREATE OR REPLACE FUNCTION fn_get_chunk_changes(
+    p_since BIGINT,
+    p_limit INTEGER  DEFAULT 5000,
+    p_holes BIGINT[] DEFAULT NULL
 )
 RETURNS TABLE(
-    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
-    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
-    document_count INTEGER, created_at TIMESTAMPTZ
+    seq BIGINT, chunk_id VARCHAR, present BOOLEAN, document_id VARCHAR,
+    category_id VARCHAR, page INTEGER, embedding vector
 ) AS $$
 BEGIN
     RETURN QUERY
-    INSERT INTO categories (name, slug, description, icon, color)
-    VALUES (p_name, p_slug, p_desc, p_icon, p_color)
-    RETURNING categories.id, categories.name, categories.slug, categories.description,
-              categories.icon, categories.color, categories.is_active, categories.exclude_from_rag,
-              categories.document_count, categories.created_at;
+    SELECT l.seq, l.chunk_id,
+           COALESCE(dc.chunk_type = 'content' AND dc.searchable AND NOT dc.rag_excluded, FALSE),
+           dc.document_id, dc.category_id, dc.page,
+           COALESCE(dc.embedding, dc.embedding_half::vector(768))
+    FROM chunk_change_log l
+    LEFT JOIN document_chunks dc ON dc.id = l.chunk_id
+    WHERE l.seq > p_since OR l.seq = ANY(p_holes)
+    ORDER BY l.seq
+    LIMIT p_limit;
 END;
 $$ LANGUAGE plpgsql;
 
 
-DROP FUNCTION IF EXISTS fn_get_category(VARCHAR);
-CREATE OR REPLACE FUNCTION fn_get_category(p_id VARCHAR)
-RETURNS TABLE(
-    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
-    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
-    document_count INTEGER, created_at TIMESTAMPTZ
-) AS $$
+CREATE OR REPLACE FUNCTION fn_report_ann_replica_seq(p_replica_id VARCHAR, p_seq BIGINT)
+RETURNS VOID AS $$
 BEGIN
-    RETURN QUERY
-    SELECT c.id, c.name, c.slug, c.description,
-           c.icon, c.color, c.is_active, c.exclude_from_rag,
-           c.document_count, c.created_at
-    FROM categories c WHERE c.id = p_id;
+    INSERT INTO ann_replica_positions (replica_id, seq, updated_at)
+    VALUES (p_replica_id, p_seq, NOW())
+    ON CONFLICT (replica_id) DO UPDATE SET seq = EXCLUDED.seq, updated_at = EXCLUDED.updated_at;
 END;
 $$ LANGUAGE plpgsql;
 
 
-CREATE OR REPLACE FUNCTION fn_category_slug_exists(
-    p_slug VARCHAR,
-    p_exclude_id VARCHAR DEFAULT NULL
+-- Recorta el log hasta el menor seq que aún se necesita: el del snapshot publicado
+-- (una réplica que arranca lo reaplica desde ahí) y el de cada réplica que reportó su
+-- posición en los últimos p_live_seconds. Las réplicas sin reportar en ese lapso se
+-- consideran detenidas y se olvidan. Además se conservan p_keep_hours de historia.
+-- Sin snapshot ni réplicas registradas solo rige p_keep_hours.
+DROP FUNCTION IF EXISTS fn_prune_chunk_change_log(INTEGER);
+CREATE OR REPLACE FUNCTION fn_prune_chunk_change_log(
+    p_keep_hours   INTEGER DEFAULT 24,
+    p_live_seconds INTEGER DEFAULT 600
 )
-RETURNS BOOLEAN AS $$
+RETURNS INTEGER AS $$
+DECLARE
+    v_bound BIGINT;
+    v_count INTEGER;
 BEGIN
-    RETURN EXISTS (
-        SELECT 1 FROM categories
-        WHERE slug = p_slug AND (p_exclude_id IS NULL OR id != p_exclude_id)
+    DELETE FROM ann_replica_positions
+    WHERE updated_at < NOW() - make_interval(secs => p_live_seconds);
+
+    v_bound := LEAST(
+        fn_get_rag_setting('ann_snapshot_seq')::BIGINT,
+        (SELECT MIN(p.seq) FROM ann_replica_positions p)
     );
+
+    DELETE FROM chunk_change_log
+    WHERE changed_at < NOW() - make_interval(hours => p_keep_hours)
+      AND (v_bound IS NULL OR chunk_change_log.seq <= v_bound);
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
 END;
 $$ LANGUAGE plpgsql;
 
 
-DROP FUNCTION IF EXISTS fn_update_category(VARCHAR,VARCHAR,VARCHAR,TEXT,VARCHAR,VARCHAR,BOOLEAN,BOOLEAN);
-CREATE OR REPLACE FUNCTION fn_update_category(
-    p_id VARCHAR,
-    p_name VARCHAR DEFAULT NULL,
-    p_slug VARCHAR DEFAULT NULL,
-    p_desc TEXT DEFAULT NULL,
-    p_icon VARCHAR DEFAULT NULL,
-    p_color VARCHAR DEFAULT NULL,
-    p_is_active BOOLEAN DEFAULT NULL,
-    p_exclude_from_rag BOOLEAN DEFAULT NULL
-)
+-- Contenido y título de los chunks que devolvió la réplica (búsqueda por clave primaria).
+-- Mismos filtros que la búsqueda SQL: una réplica atrasada puede devolver chunks de
+-- generaciones ya reemplazadas o abortadas, o excluidos del RAG; esos se descartan aquí.
+CREATE OR REPLACE FUNCTION fn_get_chunks_by_ids(p_ids VARCHAR[])
 RETURNS TABLE(
-    id VARCHAR, name VARCHAR, slug VARCHAR, description TEXT,
-    icon VARCHAR, color VARCHAR, is_active BOOLEAN, exclude_from_rag BOOLEAN,
-    document_count INTEGER, created_at TIMESTAMPTZ
+    chunk_id VARCHAR, content TEXT, document_id VARCHAR, title VARCHAR,
+    page INTEGER, category_id VARCHAR
 ) AS $$
 BEGIN
-    UPDATE categories SET
-        name = COALESCE(p_name, categories.name),
-        slug = COALESCE(p_slug, categories.slug),
-        description = COALESCE(p_desc, categories.description),
-        icon = COALESCE(p_icon, categories.icon),
-        color = COALESCE(p_color, categories.color),
-        is_active = COALESCE(p_is_active, categories.is_active),
-        exclude_from_rag = COALESCE(p_exclude_from_rag, categories.exclude_from_rag)
-    WHERE categories.id = p_id;
-
     RETURN QUERY
-    SELECT c.id, c.name, c.slug, c.description,
-           c.icon, c.color, c.is_active, c.exclude_from_rag,
-           c.document_count, c.created_at
-    FROM categories c WHERE c.id = p_id;
+    SELECT dc.id, dc.content, dc.document_id, d.title, dc.page,
+           COALESCE(dc.category_id, '')::VARCHAR
+    FROM document_chunks dc
+    JOIN documents d ON d.id = dc.document_id
+    WHERE dc.id = ANY(p_ids)
+      AND dc.searchable AND NOT dc.rag_excluded;
 END;
 $$ LANGUAGE plpgsql;
 
 
-CREATE OR REPLACE FUNCTION fn_delete_category(p_id VARCHAR)
-RETURNS BOOLEAN AS $$
+-- Vectores de chunks de contenido al azar (consultas de muestra para `flask vectors ann-check`).
+CREATE OR REPLACE FUNCTION fn_sample_chunk_embeddings(p_limit INTEGER DEFAULT 50)
+RETURNS TABLE(embedding vector) AS $$
 BEGIN
-    IF EXISTS (SELECT 1 FROM documents WHERE documents.category_id = p_id) THEN
-        RETURN FALSE;
-    END IF;
-    DELETE FROM categories WHERE categories.id = p_id;
-    RETURN FOUND;
+    RETURN QUERY
+    SELECT COALESCE(dc.embedding, dc.embedding_half::vector(768))
+    FROM document_chunks dc
+    WHERE dc.chunk_type = 'content' AND dc.searchable AND NOT dc.rag_excluded
+      AND (dc.embedding IS NOT NULL OR dc.embedding_half IS NOT NULL)
+    ORDER BY random()
+    LIMIT p_limit;
 END;
 $$ LANGUAGE plpgsql;
 
 
 -- =====================================================
--- CHUNKS FUNCTIONS
+-- EMBEDDING CACHE FUNCTIONS
 -- =====================================================
 
-DROP FUNCTION IF EXISTS fn_create_chunk(VARCHAR,INTEGER,TEXT,FLOAT[],JSONB);
-DROP FUNCTION IF EXISTS fn_create_chunk(VARCHAR,INTEGER,TEXT,FLOAT[],JSONB,VARCHAR);
-CREATE OR REPLACE FUNCTION fn_create_chunk(
-    p_doc_id     VARCHAR,
-    p_index      INTEGER,
-    p_content    TEXT,
-    p_embedding  FLOAT[] DEFAULT NULL,
-    p_metadata   JSONB DEFAULT NULL,
-    p_chunk_type VARCHAR DEFAULT 'content'
+-- Devuelve los embeddings cacheados y marca las entradas como usadas (LRU).
+DROP FUNCTION IF EXISTS fn_get_cached_embeddings(VARCHAR,VARCHAR[]);
+CREATE OR REPLACE FUNCTION fn_get_cached_embeddings(
+    p_model  VARCHAR,
+    p_hashes VARCHAR[]
 )
-RETURNS TABLE(
-    id VARCHAR, document_id VARCHAR, chunk_index INTEGER, content TEXT,
-    chunk_type VARCHAR, metadata_json JSONB, created_at TIMESTAMPTZ
-) AS $$
+RETURNS TABLE(text_hash VARCHAR, embedding vector) AS $$
 BEGIN
     RETURN QUERY
-    INSERT INTO document_chunks (document_id, chunk_index, content, embedding, metadata_json, chunk_type)
-    VALUES (p_doc_id, p_index, p_content,
-            CASE WHEN p_embedding IS NOT NULL THEN p_embedding::vector(768) END,
-            p_metadata, p_chunk_type)
-    RETURNING document_chunks.id, document_chunks.document_id, document_chunks.chunk_index,
-              document_chunks.content, document_chunks.chunk_type,
-              document_chunks.metadata_json, document_chunks.created_at;
+    UPDATE embedding_cache ec SET last_used_at = NOW()
+    WHERE ec.model = p_model AND ec.text_hash = ANY(p_hashes)
+    RETURNING ec.text_hash, ec.embedding::vector;
 END;
 $$ LANGUAGE plpgsql;
 
 
-DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR);
-DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN);
-DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN,VARCHAR[]);
-DROP FUNCTION IF EXISTS fn_search_similar(FLOAT[],INTEGER,FLOAT,VARCHAR,BOOLEAN,VARCHAR[],VARCHAR);
-CREATE OR REPLACE FUNCTION fn_search_similar(
-    p_query_embedding  FLOAT[],
-    p_top_k            INTEGER   DEFAULT 5,
-    p_score_threshold  FLOAT     DEFAULT 0.35,
-    p_category_id      VARCHAR   DEFAULT '',
-    p_include_excluded BOOLEAN   DEFAULT FALSE,
-    p_document_ids     VARCHAR[] DEFAULT NULL,
-    p_chunk_type       VARCHAR   DEFAULT 'content'
+-- p_embeddings va en el mismo orden que p_hashes (sin hashes repetidos).
+DROP FUNCTION IF EXISTS fn_store_cached_embeddings(VARCHAR,VARCHAR[],FLOAT[]);
+CREATE OR REPLACE FUNCTION fn_store_cached_embeddings(
+    p_model      VARCHAR,
+    p_hashes     VARCHAR[],
+    p_embeddings vector[]
 )
-RETURNS TABLE(
-    content TEXT, document_id VARCHAR, title VARCHAR,
-    page INTEGER, score FLOAT, category_id VARCHAR
-) AS $$
+RETURNS INTEGER AS $$
 DECLARE
-    v_embedding vector(768) := p_query_embedding::vector(768);
+    v_count INTEGER;
 BEGIN
-    RETURN QUERY
-    SELECT
-        dc.content,
-        dc.document_id,
-        d.title,
-        COALESCE((dc.metadata_json->>'page')::INTEGER, 1) AS page,
-        (1 - (dc.embedding <=> v_embedding))::FLOAT AS score,
-        COALESCE(d.category_id, '') AS category_id
-    FROM document_chunks dc
-    JOIN documents d ON d.id = dc.document_id
-    LEFT JOIN categories c ON c.id = d.category_id
-    WHERE d.processing_status = 'completed'
-      AND dc.embedding IS NOT NULL
-      AND dc.chunk_type = p_chunk_type
-      AND (p_category_id = '' OR d.category_id = p_category_id)
-      AND (p_document_ids IS NULL OR d.id = ANY(p_document_ids))
-      AND (p_include_excluded OR d.category_id IS NULL OR NOT COALESCE(c.exclude_from_rag, FALSE))
-      AND (1 - (dc.embedding <=> v_embedding)) >= p_score_threshold
-    ORDER BY dc.embedding <=> v_embedding
-    LIMIT p_top_k;
+    INSERT INTO embedding_cache (model, text_hash, embedding)
+    SELECT p_model, h.text_hash, h.embedding::vector(768)
+    FROM unnest(p_hashes, p_embeddings) AS h(text_hash, embedding)
+    ON CONFLICT (model, text_hash) DO UPDATE SET last_used_at = NOW();
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
 END;
 $$ LANGUAGE plpgsql;
 
 
-CREATE OR REPLACE FUNCTION fn_delete_chunks_by_document(p_doc_id VARCHAR)
+-- Elimina las entradas menos usadas recientemente hasta dejar p_max_entries.
+CREATE OR REPLACE FUNCTION fn_evict_embedding_cache(p_max_entries INTEGER)
 RETURNS INTEGER AS $$
 DECLARE
-    v_count INTEGER;
+    v_excess INTEGER;
+    v_count  INTEGER;
 BEGIN
-    DELETE FROM document_chunks WHERE document_chunks.document_id = p_doc_id;
+    SELECT COUNT(*) - p_max_entries INTO v_excess FROM embedding_cache;
+    IF v_excess <= 0 THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM embedding_cache ec
+    USING (
+        SELECT e.model, e.text_hash FROM embedding_cache e
+        ORDER BY e.last_used_at ASC
+        LIMIT v_excess
+    ) old
+    WHERE ec.model = old.model AND ec.text_hash = old.text_hash;
     GET DIAGNOSTICS v_count = ROW_COUNT;
     RETURN v_count;
 END;
@@ -585,6 +1878,8 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- Listado por páginas (page/per_page) sobre conversations; se mantiene para clientes que
+-- paginan por número de página. Ver fn_list_conversations_keyset.
 CREATE OR REPLACE FUNCTION fn_list_conversations(
     p_user_id VARCHAR,
     p_page INTEGER DEFAULT 1,
@@ -602,22 +1897,47 @@ DECLARE
 BEGIN
     RETURN QUERY
     SELECT
-        ch.conversation_id,
-        (SELECT LEFT(ch2.content, 100) FROM chat_history ch2
-         WHERE ch2.conversation_id = ch.conversation_id AND ch2.role = 'user'
-         ORDER BY ch2.created_at ASC LIMIT 1) AS preview,
-        MAX(ch.created_at) AS last_message_at,
-        COUNT(*) AS message_count,
+        c.id AS conversation_id,
+        c.preview,
+        c.last_message_at,
+        c.message_count::BIGINT,
         COUNT(*) OVER() AS total_count
-    FROM chat_history ch
-    WHERE ch.user_id = p_user_id
-    GROUP BY ch.conversation_id
-    ORDER BY last_message_at DESC
+    FROM conversations c
+    WHERE c.user_id = p_user_id
+    ORDER BY c.last_message_at DESC, c.id DESC
     LIMIT p_per_page OFFSET v_offset;
 END;
 $$ LANGUAGE plpgsql;
 
 
+-- Listado por cursor: conversaciones anteriores a (p_before_at, p_before_id) en orden
+-- (last_message_at, id) descendente, sin contar el total. NULL = primera página.
+-- El backend pide p_limit + 1 filas para saber si hay otra página.
+CREATE OR REPLACE FUNCTION fn_list_conversations_keyset(
+    p_user_id   VARCHAR,
+    p_before_at TIMESTAMPTZ DEFAULT NULL,
+    p_before_id VARCHAR     DEFAULT NULL,
+    p_limit     INTEGER     DEFAULT 20
+)
+RETURNS TABLE(
+    conversation_id VARCHAR,
+    preview TEXT,
+    last_message_at TIMESTAMPTZ,
+    message_count INTEGER
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT c.id, c.preview, c.last_message_at, c.message_count
+    FROM conversations c
+    WHERE c.user_id = p_user_id
+      -- Sin OR con "IS NULL": la comparación de filas queda siempre como condición del índice
+      AND (c.last_message_at, c.id) < (COALESCE(p_before_at, 'infinity'), COALESCE(p_before_id, ''))
+    ORDER BY c.last_message_at DESC, c.id DESC
+    LIMIT p_limit;
+END;
+$$ LANGUAGE plpgsql;
+
+
 CREATE OR REPLACE FUNCTION fn_get_conversation_messages(
     p_conv_id VARCHAR,
     p_user_id VARCHAR
@@ -683,6 +2003,7 @@ $$ LANGUAGE plpgsql;
 -- ANALYTICS FUNCTIONS
 -- =====================================================
 
+-- Lee los contadores de stat_counters (mantenidos por triggers, ver tables.sql).
 CREATE OR REPLACE FUNCTION fn_get_dashboard_stats()
 RETURNS TABLE(
     total_users BIGINT,
@@ -694,20 +2015,21 @@ RETURNS TABLE(
 BEGIN
     RETURN QUERY
     SELECT
-        (SELECT COUNT(*) FROM users WHERE role = 'user') AS total_users,
-        (SELECT COUNT(*) FROM documents) AS total_documents,
-        (SELECT COUNT(DISTINCT ch.conversation_id) FROM chat_history ch) AS total_conversations,
-        (SELECT COUNT(*) FROM chat_history) AS total_messages,
+        fn_get_stat_counter('users')         AS total_users,
+        fn_get_stat_counter('documents')     AS total_documents,
+        fn_get_stat_counter('conversations') AS total_conversations,
+        fn_get_stat_counter('messages')      AS total_messages,
         CASE
-            WHEN (SELECT COUNT(*) FROM feedbacks) > 0
-            THEN ROUND((SELECT COUNT(*) FROM feedbacks WHERE rating = 1)::NUMERIC /
-                        (SELECT COUNT(*) FROM feedbacks)::NUMERIC * 100, 1)
+            WHEN fn_get_stat_counter('feedbacks') > 0
+            THEN ROUND(fn_get_stat_counter('feedbacks_positive')::NUMERIC /
+                        fn_get_stat_counter('feedbacks')::NUMERIC * 100, 1)
             ELSE 0
         END AS feedback_rate;
 END;
 $$ LANGUAGE plpgsql;
 
 
+-- Mensajes por día desde el agregado continuo usage_daily (días en hora de Perú).
 CREATE OR REPLACE FUNCTION fn_get_daily_usage(p_days INTEGER DEFAULT 30)
 RETURNS TABLE(
     date DATE,
@@ -715,11 +2037,71 @@ RETURNS TABLE(
 ) AS $$
 BEGIN
     RETURN QUERY
-    SELECT ch.created_at::DATE AS date, COUNT(*) AS count
-    FROM chat_history ch
-    WHERE ch.created_at >= NOW() - (p_days || ' days')::INTERVAL
-    GROUP BY ch.created_at::DATE
-    ORDER BY date;
+    SELECT (u.bucket AT TIME ZONE 'America/Lima')::DATE AS date, u.messages AS count
+    FROM usage_daily u
+    WHERE u.bucket >= NOW() - (p_days || ' days')::INTERVAL
+      AND u.messages > 0
+    ORDER BY u.bucket;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Uso por rango y granularidad (hour | day | week | month) desde los rollups: usage_hourly
+-- para 'hour', usage_daily para el resto (re-agregado con time_bucket y rollup() de los
+-- hyperloglog). active_users y conversations son conteos distintos aproximados.
+-- p_from y p_to se amplían a los límites de bucket (hora de Perú), así el primer y el
+-- último bucket cubren el periodo completo que indica su etiqueta.
+CREATE OR REPLACE FUNCTION fn_get_usage_rollup(
+    p_from        TIMESTAMPTZ,
+    p_to          TIMESTAMPTZ,
+    p_granularity VARCHAR DEFAULT 'day'
+)
+RETURNS TABLE(
+    bucket TIMESTAMPTZ, messages BIGINT, user_messages BIGINT,
+    active_users BIGINT, conversations BIGINT,
+    feedback_positive BIGINT, feedback_negative BIGINT
+) AS $$
+DECLARE
+    v_step INTERVAL := CASE p_granularity
+                           WHEN 'hour'  THEN INTERVAL '1 hour'
+                           WHEN 'week'  THEN INTERVAL '1 week'
+                           WHEN 'month' THEN INTERVAL '1 month'
+                           ELSE INTERVAL '1 day'
+                       END;
+    v_from TIMESTAMPTZ := time_bucket(v_step, p_from, 'America/Lima');
+    v_to   TIMESTAMPTZ := time_bucket(v_step, p_to, 'America/Lima');
+BEGIN
+    IF v_to < p_to THEN
+        v_to := ((v_to AT TIME ZONE 'America/Lima') + v_step) AT TIME ZONE 'America/Lima';
+    END IF;
+
+    IF p_granularity = 'hour' THEN
+        RETURN QUERY
+        SELECT u.bucket, u.messages, u.user_messages,
+               distinct_count(u.users_hll)::BIGINT, distinct_count(u.conversations_hll)::BIGINT,
+               u.feedback_positive, u.feedback_negative
+        FROM usage_hourly u
+        WHERE u.bucket >= v_from AND u.bucket < v_to
+        ORDER BY u.bucket;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT b.bucket, SUM(u.messages)::BIGINT, SUM(u.user_messages)::BIGINT,
+           distinct_count(rollup(u.users_hll))::BIGINT,
+           distinct_count(rollup(u.conversations_hll))::BIGINT,
+           SUM(u.feedback_positive)::BIGINT, SUM(u.feedback_negative)::BIGINT
+    FROM usage_daily u
+    CROSS JOIN LATERAL (
+        SELECT CASE p_granularity
+                   WHEN 'week'  THEN time_bucket(INTERVAL '1 week', u.bucket, 'America/Lima')
+                   WHEN 'month' THEN time_bucket(INTERVAL '1 month', u.bucket, 'America/Lima')
+                   ELSE u.bucket
+               END AS bucket
+    ) b
+    WHERE u.bucket >= v_from AND u.bucket < v_to
+    GROUP BY b.bucket
+    ORDER BY b.bucket;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -841,6 +2223,8 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-- Listado por número de página, sin total (ver fn_count_thesis_checks_list).
+DROP FUNCTION IF EXISTS fn_list_thesis_checks(VARCHAR,VARCHAR,INTEGER,INTEGER);
 CREATE OR REPLACE FUNCTION fn_list_thesis_checks(
     p_checked_by    VARCHAR DEFAULT '',
     p_status        VARCHAR DEFAULT '',
@@ -853,8 +2237,7 @@ RETURNS TABLE(
     status VARCHAR, processing_error TEXT,
     originality_score NUMERIC, plagiarism_level VARCHAR, total_chunks INTEGER,
     flagged_chunks INTEGER, score_threshold NUMERIC,
-    created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ,
-    total_count BIGINT
+    created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
 ) AS $$
 DECLARE
     v_offset INTEGER := (p_page - 1) * p_per_page;
@@ -866,18 +2249,79 @@ BEGIN
         tc.status, tc.processing_error,
         tc.originality_score, tc.plagiarism_level, tc.total_chunks,
         tc.flagged_chunks, tc.score_threshold,
-        tc.created_at, tc.updated_at,
-        COUNT(*) OVER() AS total_count
+        tc.created_at, tc.updated_at
     FROM thesis_checks tc
     JOIN users u ON u.id = tc.checked_by
     WHERE (p_checked_by = '' OR tc.checked_by = p_checked_by)
       AND (p_status = '' OR tc.status = p_status)
-    ORDER BY tc.created_at DESC
+    ORDER BY tc.created_at DESC, tc.id DESC
     LIMIT p_per_page OFFSET v_offset;
 END;
 $$ LANGUAGE plpgsql;
 
 
+-- Listado por cursor sobre (created_at, id) descendente (idx_thesis_checks_created_id).
+CREATE OR REPLACE FUNCTION fn_list_thesis_checks_keyset(
+    p_checked_by    VARCHAR     DEFAULT '',
+    p_status        VARCHAR     DEFAULT '',
+    p_before_at     TIMESTAMPTZ DEFAULT NULL,
+    p_before_id     VARCHAR     DEFAULT NULL,
+    p_limit         INTEGER     DEFAULT 20
+)
+RETURNS TABLE(
+    id VARCHAR, filename VARCHAR, file_path VARCHAR, file_type VARCHAR,
+    file_size INTEGER, checked_by VARCHAR, checker_name VARCHAR,
+    status VARCHAR, processing_error TEXT,
+    originality_score NUMERIC, plagiarism_level VARCHAR, total_chunks INTEGER,
+    flagged_chunks INTEGER, score_threshold NUMERIC,
+    created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        tc.id, tc.filename, tc.file_path, tc.file_type,
+        tc.file_size, tc.checked_by, u.full_name AS checker_name,
+        tc.status, tc.processing_error,
+        tc.originality_score, tc.plagiarism_level, tc.total_chunks,
+        tc.flagged_chunks, tc.score_threshold,
+        tc.created_at, tc.updated_at
+    FROM thesis_checks tc
+    JOIN users u ON u.id = tc.checked_by
+    WHERE (p_checked_by = '' OR tc.checked_by = p_checked_by)
+      AND (p_status = '' OR tc.status = p_status)
+      AND (tc.created_at, tc.id) < (COALESCE(p_before_at, 'infinity'), COALESCE(p_before_id, ''))
+    ORDER BY tc.created_at DESC, tc.id DESC
+    LIMIT p_limit;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Total de fn_list_thesis_checks: exacto (COUNT) o estimado por el planificador.
+CREATE OR REPLACE FUNCTION fn_count_thesis_checks_list(
+    p_checked_by VARCHAR DEFAULT '',
+    p_status     VARCHAR DEFAULT '',
+    p_estimate   BOOLEAN DEFAULT FALSE
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_query TEXT := 'SELECT 1 FROM thesis_checks WHERE TRUE';
+    v_total BIGINT;
+BEGIN
+    IF p_checked_by <> '' THEN
+        v_query := v_query || format(' AND checked_by = %L', p_checked_by);
+    END IF;
+    IF p_status <> '' THEN
+        v_query := v_query || format(' AND status = %L', p_status);
+    END IF;
+    IF p_estimate THEN
+        RETURN fn_estimate_rows(v_query);
+    END IF;
+    EXECUTE 'SELECT COUNT(*) FROM (' || v_query || ') q' INTO v_total;
+    RETURN v_total;
+END;
+$$ LANGUAGE plpgsql;
+
+
 CREATE OR REPLACE FUNCTION fn_get_thesis_check(p_id VARCHAR)
 RETURNS TABLE(
     id VARCHAR, filename VARCHAR, file_path VARCHAR, file_type VARCHAR,
@@ -1006,35 +2450,57 @@ $$ LANGUAGE plpgsql;
 -- CHAT AUTOCOMPLETE
 -- =====================================================
 
+-- Frases de documentos que contienen p_query (índice GIN de trigramas sobre
+-- autocomplete_phrases). Primero las que empiezan con el texto, luego las que aparecen
+-- en más documentos. p_query se escapa para que % y _ sean literales. suggestion_key
+-- (fn_normalize_question) permite descartar frases que repiten una pregunta sugerida.
+DROP FUNCTION IF EXISTS fn_autocomplete_chat(VARCHAR, INTEGER);
 CREATE OR REPLACE FUNCTION fn_autocomplete_chat(
     p_query  VARCHAR,
     p_limit  INTEGER DEFAULT 3
 )
-RETURNS TABLE(suggestion TEXT, source VARCHAR, frequency BIGINT)
+RETURNS TABLE(suggestion TEXT, suggestion_key TEXT, source VARCHAR, frequency BIGINT)
 LANGUAGE plpgsql AS $$
+DECLARE
+    v_pattern TEXT := lower(replace(replace(replace(p_query, '\', '\\'), '%', '\%'), '_', '\_'));
 BEGIN
     RETURN QUERY
-    SELECT DISTINCT
-        TRIM(SUBSTRING(
-            dc.content,
-            GREATEST(1, POSITION(LOWER(p_query) IN LOWER(dc.content)) - 30),
-            LENGTH(p_query) + 90
-        ))                   AS suggestion,
-        'document'::VARCHAR  AS source,
-        0::BIGINT            AS frequency
-    FROM document_chunks dc
-    JOIN documents d ON d.id = dc.document_id
+    SELECT
+        p.phrase                         AS suggestion,
+        fn_normalize_question(p.phrase)  AS suggestion_key,
+        'document'::VARCHAR              AS source,
+        COUNT(*)::BIGINT     AS frequency
+    FROM autocomplete_phrases p
+    JOIN documents d ON d.id = p.document_id
     LEFT JOIN categories c ON c.id = d.category_id
-    WHERE dc.content ILIKE '%' || p_query || '%'
-      AND d.processing_status = 'completed'
+    WHERE lower(p.phrase) LIKE '%' || v_pattern || '%'
       AND (c.id IS NULL
            OR (c.slug  NOT ILIKE '%tesis%'
            AND c.name  NOT ILIKE '%tesis%'))
+    GROUP BY p.phrase
+    ORDER BY bool_or(lower(p.phrase) LIKE v_pattern || '%') DESC, COUNT(*) DESC, LENGTH(p.phrase)
     LIMIT p_limit;
 END;
 $$;
 
 
+-- Preguntas de question_frequency modificadas desde p_since (NULL = todas), con su
+-- frecuencia total. Alimenta el índice de prefijos en proceso (app/rag/autocomplete.py):
+-- releer una fila reemplaza su frecuencia, así que las lecturas pueden solaparse.
+DROP FUNCTION IF EXISTS fn_get_question_counts(TIMESTAMPTZ);
+CREATE OR REPLACE FUNCTION fn_get_question_counts(p_since TIMESTAMPTZ DEFAULT NULL)
+RETURNS TABLE(question_key TEXT, question TEXT, frequency BIGINT, last_at TIMESTAMPTZ)
+LANGUAGE plpgsql AS $$
+BEGIN
+    RETURN QUERY
+    SELECT qf.question_key, qf.question, qf.frequency, qf.last_asked_at AS last_at
+    FROM question_frequency qf
+    WHERE (p_since IS NULL OR qf.last_asked_at > p_since)
+      AND LENGTH(qf.question) <= 200;
+END;
+$$;
+
+
 -- =====================================================
 -- SUGGESTED QUESTIONS (frequent from chat history)
 -- =====================================================
@@ -1047,15 +2513,10 @@ RETURNS TABLE(question TEXT, frequency BIGINT)
 LANGUAGE plpgsql AS $$
 BEGIN
     RETURN QUERY
-    SELECT
-        ch.content   AS question,
-        COUNT(*)     AS frequency
-    FROM chat_history ch
-    WHERE ch.role = 'user'
-      AND LENGTH(TRIM(ch.content)) >= 10
-    GROUP BY ch.content
-    HAVING COUNT(*) >= p_min_frequency
-    ORDER BY frequency DESC
+    SELECT qf.question, qf.frequency
+    FROM question_frequency qf
+    WHERE qf.frequency >= p_min_frequency
+    ORDER BY qf.frequency DESC
     LIMIT p_limit;
 END;
 $$;
@@ -5,6 +5,8 @@
 -- Extensions
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 CREATE EXTENSION IF NOT EXISTS "pgcrypto";
+CREATE EXTENSION IF NOT EXISTS pg_trgm;      -- autocompletado (índices GIN de trigramas)
+CREATE EXTENSION IF NOT EXISTS unaccent;     -- normalización de preguntas y búsquedas
 CREATE EXTENSION IF NOT EXISTS ai CASCADE;   -- instala pgvector + pgai automáticamente
 
 -- =====================================================
@@ -18,6 +20,16 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- =====================================================
+-- Function: clave de búsqueda (minúsculas, sin tildes)
+-- =====================================================
+-- unaccent() es STABLE (depende del diccionario en search_path), así que no sirve en columnas
+-- generadas ni índices; con el diccionario fijado por esquema el resultado es inmutable.
+CREATE OR REPLACE FUNCTION fn_search_key(p_text TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, p_text));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
 -- =====================================================
 -- Table: users
 -- =====================================================
@@ -34,6 +46,14 @@ CREATE TABLE IF NOT EXISTS users (
 
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+-- Orden de los listados del panel (fn_list_users_keyset): (created_at, id) descendente
+CREATE INDEX IF NOT EXISTS idx_users_created_id ON users(created_at DESC, id DESC);
+
+-- Buscador del panel: nombre y correo normalizados (fn_search_key) con índice de trigramas,
+-- usado por LIKE '%texto%' y por la similitud de palabras (<%) de pg_trgm
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_text TEXT
+    GENERATED ALWAYS AS (fn_search_key(full_name || ' ' || email)) STORED;
+CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users USING gin (search_text gin_trgm_ops);
 
 DROP TRIGGER IF EXISTS trg_users_updated_at ON users;
 CREATE TRIGGER trg_users_updated_at
@@ -80,9 +100,27 @@ CREATE TABLE IF NOT EXISTS documents (
 
 ALTER TABLE documents ADD COLUMN IF NOT EXISTS summary TEXT;
 
+-- Generación de chunks visible en búsquedas (0 = todavía sin chunks activos). Reprocesar
+-- construye building_generation en paralelo y al terminar la activa con un solo UPDATE.
+-- Al añadir la columna, los documentos existentes quedan en la generación 1 (la de sus chunks).
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS active_generation INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE documents ALTER COLUMN active_generation SET DEFAULT 0;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS building_generation INTEGER;
+-- Archivo reemplazado por una re-subida cuyo procesamiento aún no terminó: respalda los
+-- chunks activos hasta que la versión nueva se publica (ver fn_release_previous_file).
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS previous_file_path VARCHAR(1000);
+
 CREATE INDEX IF NOT EXISTS idx_documents_category ON documents(category_id);
 CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(processing_status);
 CREATE INDEX IF NOT EXISTS idx_documents_uploaded_by ON documents(uploaded_by);
+-- Orden de los listados del panel (fn_list_documents_keyset): (created_at, id) descendente
+CREATE INDEX IF NOT EXISTS idx_documents_created_id ON documents(created_at DESC, id DESC);
+
+-- Buscador del panel: título y nombre de archivo normalizados (fn_search_key) con índice
+-- de trigramas, usado por LIKE '%texto%' y por la similitud de palabras (<%) de pg_trgm
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS search_text TEXT
+    GENERATED ALWAYS AS (fn_search_key(title || ' ' || original_filename)) STORED;
+CREATE INDEX IF NOT EXISTS idx_documents_search_trgm ON documents USING gin (search_text gin_trgm_ops);
 
 DROP TRIGGER IF EXISTS trg_documents_updated_at ON documents;
 CREATE TRIGGER trg_documents_updated_at
@@ -116,12 +154,322 @@ DO $$ BEGIN
     END IF;
 END $$;
 
--- Índice HNSW para búsqueda aproximada eficiente (coseno)
-CREATE INDEX IF NOT EXISTS idx_chunks_embedding
-    ON document_chunks USING hnsw (embedding vector_cosine_ops);
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 1;
+-- sha256 del texto embebido ('[título]\ncontenido', ver fn_chunk_content_hash): permite
+-- re-subir una versión nueva del documento y embeber solo los chunks que cambiaron.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+-- Almacenamiento opcional en media precisión (ver fn_get_vector_storage).
+-- Su índice HNSW (idx_chunks_embedding_half) lo crea `flask vectors migrate-halfvec`.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_half halfvec(768);
+
+-- Firma binaria (1 bit por dimensión) para la primera etapa del modo de búsqueda 'binary':
+-- distancia de Hamming sobre 96 bytes por chunk, luego re-ranking exacto con el vector completo.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_bits bit(768);
+
+-- Vector reducido (primeras 256 dimensiones Matryoshka de nomic-embed-text, renormalizado)
+-- solo para chunks 'summary': el Stage 1 (router de documentos) busca sobre este índice pequeño.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_small vector(256);
+
+-- Filtros de búsqueda desnormalizados (evitan JOIN a documents/categories por candidato):
+--   searchable   = el chunk pertenece a la generación activa del documento
+--   rag_excluded = la categoría del documento tiene exclude_from_rag
+--   category_id  = categoría del documento; page = metadata_json->>'page'
+-- Las inserciones los calculan (fn_flush_chunk_staging, fn_create_chunk) y los triggers
+-- trg_documents_sync_chunks / trg_categories_sync_chunks los mantienen al día.
+-- Al añadir las columnas se rellenan una sola vez para los chunks existentes.
+DO $$ BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'document_chunks' AND column_name = 'searchable'
+    ) THEN
+        ALTER TABLE document_chunks
+            ADD COLUMN searchable   BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN rag_excluded BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN category_id  VARCHAR(36),
+            ADD COLUMN page         INTEGER NOT NULL DEFAULT 1;
+
+        UPDATE document_chunks dc SET
+            searchable   = (dc.generation = d.active_generation),
+            rag_excluded = COALESCE(c.exclude_from_rag, FALSE),
+            category_id  = d.category_id,
+            page         = COALESCE((dc.metadata_json->>'page')::INTEGER, 1)
+        FROM documents d
+        LEFT JOIN categories c ON c.id = d.category_id
+        WHERE d.id = dc.document_id;
+    END IF;
+END $$;
+
+-- Texto completo en español para la búsqueda léxica del modo híbrido (códigos de curso,
+-- números de artículo, resoluciones: tokens exactos que los embeddings aproximan mal).
+-- Columna generada: todas las rutas de inserción y el diff de re-subidas la mantienen sin
+-- cambios en el backend. Añadirla reescribe la tabla una vez.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('spanish', content)) STORED;
+
+-- Índices HNSW parciales (coseno): solo chunks buscables, uno por tipo. El Stage 1
+-- (summary) recorre un grafo de un nodo por documento en vez del índice completo, y los
+-- chunks de una generación en construcción no se indexan hasta activarse.
+DROP INDEX IF EXISTS idx_chunks_embedding;
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_content
+    ON document_chunks USING hnsw (embedding vector_cosine_ops)
+    WHERE chunk_type = 'content' AND searchable AND NOT rag_excluded;
+
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_summary
+    ON document_chunks USING hnsw (embedding vector_cosine_ops)
+    WHERE chunk_type = 'summary' AND searchable AND NOT rag_excluded;
+
+-- Chunks de categorías excluidas del RAG (p.ej. tesis): solo los consulta la verificación
+-- de originalidad (p_include_excluded), que recorre este índice junto con el de content.
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_content_excluded
+    ON document_chunks USING hnsw (embedding vector_cosine_ops)
+    WHERE chunk_type = 'content' AND searchable AND rag_excluded;
 
-CREATE INDEX IF NOT EXISTS idx_chunks_document ON document_chunks(document_id);
+DROP INDEX IF EXISTS idx_chunks_embedding_bits;
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_bits_searchable
+    ON document_chunks USING hnsw (embedding_bits bit_hamming_ops)
+    WHERE searchable AND NOT rag_excluded;
+
+DROP INDEX IF EXISTS idx_chunks_embedding_small_summary;
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_small_searchable
+    ON document_chunks USING hnsw (embedding_small vector_cosine_ops)
+    WHERE chunk_type = 'summary' AND searchable AND NOT rag_excluded;
+
+-- Búsqueda léxica (fn_search_lexical_multi): mismos filtros que el índice de content.
+CREATE INDEX IF NOT EXISTS idx_chunks_content_tsv
+    ON document_chunks USING gin (content_tsv)
+    WHERE chunk_type = 'content' AND searchable AND NOT rag_excluded;
+
+DROP INDEX IF EXISTS idx_chunks_document;
+CREATE INDEX IF NOT EXISTS idx_chunks_document_generation ON document_chunks(document_id, generation);
 CREATE INDEX IF NOT EXISTS idx_chunks_type ON document_chunks(chunk_type);
+CREATE INDEX IF NOT EXISTS idx_chunks_category ON document_chunks(category_id);
+
+-- =====================================================
+-- Triggers: sincronizar filtros desnormalizados de document_chunks
+-- =====================================================
+-- Cambio de generación activa o de categoría de un documento. Solo toca las filas cuyo
+-- valor cambia (activar una generación reescribe la vieja y la nueva, nada más).
+CREATE OR REPLACE FUNCTION fn_sync_document_chunk_filters()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_excluded BOOLEAN;
+BEGIN
+    SELECT COALESCE(c.exclude_from_rag, FALSE) INTO v_excluded
+    FROM categories c WHERE c.id = NEW.category_id;
+    v_excluded := COALESCE(v_excluded, FALSE);
+
+    UPDATE document_chunks dc SET
+        searchable   = (dc.generation = NEW.active_generation),
+        rag_excluded = v_excluded,
+        category_id  = NEW.category_id
+    WHERE dc.document_id = NEW.id
+      AND (dc.searchable <> (dc.generation = NEW.active_generation)
+           OR dc.rag_excluded <> v_excluded
+           OR dc.category_id IS DISTINCT FROM NEW.category_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_documents_sync_chunks ON documents;
+CREATE TRIGGER trg_documents_sync_chunks
+    AFTER UPDATE OF active_generation, category_id ON documents
+    FOR EACH ROW
+    WHEN (OLD.active_generation IS DISTINCT FROM NEW.active_generation
+          OR OLD.category_id IS DISTINCT FROM NEW.category_id)
+    EXECUTE FUNCTION fn_sync_document_chunk_filters();
+
+-- Una categoría entra o sale del RAG (exclude_from_rag).
+CREATE OR REPLACE FUNCTION fn_sync_category_chunk_filters()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE document_chunks dc SET rag_excluded = COALESCE(NEW.exclude_from_rag, FALSE)
+    WHERE dc.category_id = NEW.id
+      AND dc.rag_excluded <> COALESCE(NEW.exclude_from_rag, FALSE);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_categories_sync_chunks ON categories;
+CREATE TRIGGER trg_categories_sync_chunks
+    AFTER UPDATE OF exclude_from_rag ON categories
+    FOR EACH ROW
+    WHEN (OLD.exclude_from_rag IS DISTINCT FROM NEW.exclude_from_rag)
+    EXECUTE FUNCTION fn_sync_category_chunk_filters();
+
+-- =====================================================
+-- Table: autocomplete_phrases
+-- =====================================================
+-- Frases de la generación activa de cada documento (fuente 'document' de
+-- /chat/autocomplete). El índice GIN de trigramas resuelve LIKE '%texto%' sin recorrer
+-- los chunks; se reconstruyen por documento al activar una generación y al aplicar el
+-- diff de una re-subida (fn_refresh_document_phrases).
+CREATE TABLE IF NOT EXISTS autocomplete_phrases (
+    id           BIGSERIAL PRIMARY KEY,
+    document_id  VARCHAR(36) NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    phrase       TEXT NOT NULL,
+    UNIQUE (document_id, phrase)
+);
+
+CREATE INDEX IF NOT EXISTS idx_autocomplete_phrases_trgm
+    ON autocomplete_phrases USING gin (lower(phrase) gin_trgm_ops);
+
+-- Frases = fragmentos entre signos de puntuación o saltos de línea, de 20 a 120 caracteres.
+CREATE OR REPLACE FUNCTION fn_refresh_document_phrases(p_doc_id VARCHAR)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    DELETE FROM autocomplete_phrases WHERE autocomplete_phrases.document_id = p_doc_id;
+
+    INSERT INTO autocomplete_phrases (document_id, phrase)
+    SELECT DISTINCT dc.document_id, s.phrase
+    FROM document_chunks dc
+    JOIN documents d ON d.id = dc.document_id AND dc.generation = d.active_generation
+    CROSS JOIN LATERAL (
+        SELECT btrim(regexp_replace(part, '\s+', ' ', 'g')) AS phrase
+        FROM regexp_split_to_table(dc.content, '[.;:!?¿¡•\n]+') AS part
+    ) s
+    WHERE dc.document_id = p_doc_id
+      AND dc.chunk_type = 'content'
+      AND LENGTH(s.phrase) BETWEEN 20 AND 120
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Al crear la tabla se cargan una sola vez las frases de los documentos existentes.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM autocomplete_phrases LIMIT 1) THEN
+        PERFORM fn_refresh_document_phrases(d.id)
+        FROM documents d WHERE d.active_generation > 0;
+    END IF;
+END $$;
+
+-- Cambio de generación activa (procesamiento o reproceso terminado). Usa
+-- dc.generation = active_generation porque corre antes que trg_documents_sync_chunks.
+CREATE OR REPLACE FUNCTION fn_sync_document_phrases()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM fn_refresh_document_phrases(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_documents_phrases ON documents;
+CREATE TRIGGER trg_documents_phrases
+    AFTER UPDATE OF active_generation ON documents
+    FOR EACH ROW
+    WHEN (OLD.active_generation IS DISTINCT FROM NEW.active_generation)
+    EXECUTE FUNCTION fn_sync_document_phrases();
+
+-- =====================================================
+-- Table: rag_settings
+-- =====================================================
+-- Ajustes que deben compartir el backend y las funciones SQL (p.ej. vector_storage).
+CREATE TABLE IF NOT EXISTS rag_settings (
+    key             VARCHAR(50) PRIMARY KEY,
+    value           TEXT NOT NULL,
+    updated_at      TIMESTAMPTZ DEFAULT NOW()
+);
+
+INSERT INTO rag_settings (key, value) VALUES ('vector_storage', 'float32')
+ON CONFLICT (key) DO NOTHING;
+
+-- =====================================================
+-- Table: embedding_cache
+-- =====================================================
+-- Caché de embeddings direccionada por contenido: (modelo, sha256 del texto embebido).
+-- Compartida por ingesta, reprocesamiento y verificación de originalidad.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model           VARCHAR(100) NOT NULL,
+    text_hash       VARCHAR(64) NOT NULL,
+    embedding       vector(768) NOT NULL,
+    created_at      TIMESTAMPTZ DEFAULT NOW(),
+    last_used_at    TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (model, text_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used_at);
+
+-- =====================================================
+-- Table: chunk_change_log
+-- =====================================================
+-- Cambios de chunks visibles para la réplica ANN en proceso (app/rag/ann_replica.py):
+-- chunks 'content' buscables que se insertan, borran o cambian de filtros. Solo se
+-- registra con rag_settings.ann_change_log = 'on' (lo activa `flask vectors ann-snapshot`).
+-- Cada sentencia hace NOTIFY chunk_changes; los workers leen desde su último seq.
+CREATE TABLE IF NOT EXISTS chunk_change_log (
+    seq         BIGSERIAL PRIMARY KEY,
+    chunk_id    VARCHAR(36) NOT NULL,
+    changed_at  TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunk_change_log_changed_at ON chunk_change_log(changed_at);
+
+-- Último seq aplicado por cada réplica en ejecución (host:pid), reportado en cada
+-- sincronización. fn_prune_chunk_change_log no borra cambios que una réplica viva o el
+-- snapshot publicado (rag_settings.ann_snapshot_seq) todavía necesitan.
+CREATE TABLE IF NOT EXISTS ann_replica_positions (
+    replica_id  VARCHAR(255) PRIMARY KEY,
+    seq         BIGINT NOT NULL,
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Triggers por sentencia con tablas de transición: una sola inserción al log y un solo
+-- NOTIFY por COPY/flush o activación de generación, no uno por fila.
+CREATE OR REPLACE FUNCTION fn_log_chunk_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF fn_get_rag_setting('ann_change_log', 'off') <> 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO chunk_change_log (chunk_id)
+        SELECT n.id FROM new_rows n
+        WHERE n.chunk_type = 'content' AND n.searchable AND NOT n.rag_excluded;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO chunk_change_log (chunk_id)
+        SELECT o.id FROM old_rows o
+        WHERE o.chunk_type = 'content' AND o.searchable AND NOT o.rag_excluded;
+    ELSE
+        -- Los vectores de un chunk no cambian (un texto nuevo es un chunk nuevo): basta
+        -- con detectar cambios de visibilidad o de los filtros que usa la réplica.
+        INSERT INTO chunk_change_log (chunk_id)
+        SELECT n.id FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE n.chunk_type = 'content'
+          AND ((n.searchable AND NOT n.rag_excluded) OR (o.searchable AND NOT o.rag_excluded))
+          AND (n.searchable, n.rag_excluded, n.category_id, n.page, n.document_id)
+              IS DISTINCT FROM (o.searchable, o.rag_excluded, o.category_id, o.page, o.document_id);
+    END IF;
+
+    IF FOUND THEN
+        PERFORM pg_notify('chunk_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunks_log_insert ON document_chunks;
+CREATE TRIGGER trg_chunks_log_insert
+    AFTER INSERT ON document_chunks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_log_chunk_changes();
+
+DROP TRIGGER IF EXISTS trg_chunks_log_update ON document_chunks;
+CREATE TRIGGER trg_chunks_log_update
+    AFTER UPDATE ON document_chunks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_log_chunk_changes();
+
+DROP TRIGGER IF EXISTS trg_chunks_log_delete ON document_chunks;
+CREATE TRIGGER trg_chunks_log_delete
+    AFTER DELETE ON document_chunks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_log_chunk_changes();
 
 -- =====================================================
 -- Table: chat_history
@@ -138,6 +486,188 @@ CREATE TABLE IF NOT EXISTS chat_history (
 
 CREATE INDEX IF NOT EXISTS idx_chat_conversation ON chat_history(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_chat_user ON chat_history(user_id);
+-- Últimas preguntas de usuarios (fn_get_popular_queries) sin recorrer todo el historial.
+CREATE INDEX IF NOT EXISTS idx_chat_user_questions ON chat_history(created_at DESC) WHERE role = 'user';
+
+-- =====================================================
+-- Table: question_frequency
+-- =====================================================
+-- Preguntas de usuarios agrupadas por texto normalizado (fn_normalize_question: la clave
+-- de búsqueda fn_search_key sin puntuación), mantenida por triggers de chat_history. Las
+-- preguntas sugeridas y el índice de prefijos del autocompletado leen de aquí en vez de
+-- agrupar todo el historial. question guarda la última redacción recibida.
+CREATE OR REPLACE FUNCTION fn_normalize_question(p_text TEXT)
+RETURNS TEXT AS $$
+    SELECT btrim(regexp_replace(fn_search_key(p_text), '[^a-z0-9]+', ' ', 'g'));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE TABLE IF NOT EXISTS question_frequency (
+    question_key   TEXT PRIMARY KEY,
+    question       TEXT NOT NULL,
+    frequency      BIGINT NOT NULL DEFAULT 0,
+    last_asked_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_question_frequency_frequency ON question_frequency(frequency DESC);
+CREATE INDEX IF NOT EXISTS idx_question_frequency_last_asked ON question_frequency(last_asked_at);
+
+-- Suma (p_sign = 1) o resta (p_sign = -1) mensajes 'user' de al menos 10 caracteres.
+CREATE OR REPLACE FUNCTION fn_apply_question_counts(p_rows chat_history[], p_sign INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO question_frequency AS qf (question_key, question, frequency, last_asked_at)
+    SELECT m.question_key,
+           (array_agg(btrim(m.content) ORDER BY m.created_at DESC))[1],
+           p_sign * COUNT(*),
+           MAX(m.created_at)
+    FROM (
+        SELECT fn_normalize_question(r.content) AS question_key, r.content, r.created_at
+        FROM unnest(p_rows) r
+        WHERE r.role = 'user' AND LENGTH(TRIM(r.content)) >= 10
+    ) m
+    WHERE m.question_key <> ''
+    GROUP BY m.question_key
+    ON CONFLICT (question_key) DO UPDATE SET
+        frequency     = qf.frequency + EXCLUDED.frequency,
+        question      = CASE WHEN p_sign > 0 THEN EXCLUDED.question ELSE qf.question END,
+        last_asked_at = CASE WHEN p_sign > 0 THEN GREATEST(qf.last_asked_at, EXCLUDED.last_asked_at)
+                             ELSE NOW() END;
+
+    IF p_sign < 0 THEN
+        DELETE FROM question_frequency WHERE frequency <= 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers por sentencia: un upsert agrupado por inserción/borrado (p.ej. al eliminar una
+-- conversación completa), no uno por mensaje.
+CREATE OR REPLACE FUNCTION fn_count_questions()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM fn_apply_question_counts(ARRAY(SELECT n FROM new_rows n), 1);
+    ELSE
+        PERFORM fn_apply_question_counts(ARRAY(SELECT o FROM old_rows o), -1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_history_questions_insert ON chat_history;
+CREATE TRIGGER trg_chat_history_questions_insert
+    AFTER INSERT ON chat_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_questions();
+
+DROP TRIGGER IF EXISTS trg_chat_history_questions_delete ON chat_history;
+CREATE TRIGGER trg_chat_history_questions_delete
+    AFTER DELETE ON chat_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_questions();
+
+-- Al crear la tabla se cuenta una sola vez el historial existente. Si hay claves de una
+-- versión anterior de fn_normalize_question, se vuelve a contar desde cero.
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM question_frequency
+               WHERE question_key <> fn_normalize_question(question) LIMIT 1) THEN
+        TRUNCATE question_frequency;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM question_frequency LIMIT 1) THEN
+        PERFORM fn_apply_question_counts(ARRAY(SELECT ch FROM chat_history ch WHERE ch.role = 'user'), 1);
+    END IF;
+END $$;
+
+-- =====================================================
+-- Table: conversations
+-- =====================================================
+-- Resumen por conversación para la barra lateral del chat (fn_list_conversations*):
+-- evita agrupar todo el chat_history del usuario y buscar la vista previa por
+-- conversación. Lo mantienen triggers de chat_history; el listado pagina por
+-- (last_message_at, id) con idx_conversations_user_recent.
+CREATE TABLE IF NOT EXISTS conversations (
+    id               VARCHAR(36) PRIMARY KEY,
+    user_id          VARCHAR(36) NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    preview          TEXT,
+    last_message_at  TIMESTAMPTZ NOT NULL,
+    message_count    INTEGER NOT NULL DEFAULT 0,
+    created_at       TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversations_user_recent
+    ON conversations(user_id, last_message_at DESC, id DESC);
+
+-- Inserción: un upsert por conversación y sentencia. La vista previa es el primer
+-- mensaje del usuario (100 caracteres) y no cambia una vez fijada.
+CREATE OR REPLACE FUNCTION fn_sync_conversations_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO conversations AS c (id, user_id, preview, last_message_at, message_count)
+    SELECT n.conversation_id,
+           (array_agg(n.user_id))[1],
+           (array_agg(LEFT(n.content, 100) ORDER BY n.created_at) FILTER (WHERE n.role = 'user'))[1],
+           MAX(COALESCE(n.created_at, NOW())),
+           COUNT(*)
+    FROM new_rows n
+    GROUP BY n.conversation_id
+    ON CONFLICT (id) DO UPDATE SET
+        preview         = COALESCE(c.preview, EXCLUDED.preview),
+        last_message_at = GREATEST(c.last_message_at, EXCLUDED.last_message_at),
+        message_count   = c.message_count + EXCLUDED.message_count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Borrado: recalcula las conversaciones afectadas desde sus mensajes restantes
+-- (idx_chat_conversation) y elimina las que quedaron vacías.
+CREATE OR REPLACE FUNCTION fn_sync_conversations_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE conversations c SET
+        preview         = r.preview,
+        last_message_at = r.last_message_at,
+        message_count   = r.message_count
+    FROM (
+        SELECT ch.conversation_id,
+               (array_agg(LEFT(ch.content, 100) ORDER BY ch.created_at) FILTER (WHERE ch.role = 'user'))[1] AS preview,
+               MAX(ch.created_at) AS last_message_at,
+               COUNT(*)::INTEGER AS message_count
+        FROM chat_history ch
+        WHERE ch.conversation_id IN (SELECT DISTINCT conversation_id FROM old_rows)
+        GROUP BY ch.conversation_id
+    ) r
+    WHERE c.id = r.conversation_id;
+
+    DELETE FROM conversations c
+    WHERE c.id IN (SELECT DISTINCT conversation_id FROM old_rows)
+      AND NOT EXISTS (SELECT 1 FROM chat_history ch WHERE ch.conversation_id = c.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_history_conversations_insert ON chat_history;
+CREATE TRIGGER trg_chat_history_conversations_insert AFTER INSERT ON chat_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_sync_conversations_insert();
+
+DROP TRIGGER IF EXISTS trg_chat_history_conversations_delete ON chat_history;
+CREATE TRIGGER trg_chat_history_conversations_delete AFTER DELETE ON chat_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_sync_conversations_delete();
+
+-- Al crear la tabla se resumen una sola vez las conversaciones existentes.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM conversations LIMIT 1) THEN
+        INSERT INTO conversations (id, user_id, preview, last_message_at, message_count)
+        SELECT ch.conversation_id,
+               (array_agg(ch.user_id))[1],
+               (array_agg(LEFT(ch.content, 100) ORDER BY ch.created_at) FILTER (WHERE ch.role = 'user'))[1],
+               COALESCE(MAX(ch.created_at), NOW()),
+               COUNT(*)
+        FROM chat_history ch
+        GROUP BY ch.conversation_id
+        ON CONFLICT (id) DO NOTHING;
+    END IF;
+END $$;
 
 -- =====================================================
 -- Table: feedbacks
@@ -179,9 +709,332 @@ CREATE TABLE IF NOT EXISTS thesis_checks (
 
 CREATE INDEX IF NOT EXISTS idx_thesis_checks_user    ON thesis_checks(checked_by);
 CREATE INDEX IF NOT EXISTS idx_thesis_checks_status  ON thesis_checks(status);
-CREATE INDEX IF NOT EXISTS idx_thesis_checks_created ON thesis_checks(created_at DESC);
+-- (created_at, id) descendente: orden de fn_list_thesis_checks_keyset (reemplaza a idx_thesis_checks_created)
+DROP INDEX IF EXISTS idx_thesis_checks_created;
+CREATE INDEX IF NOT EXISTS idx_thesis_checks_created_id ON thesis_checks(created_at DESC, id DESC);
 
 DROP TRIGGER IF EXISTS trg_thesis_checks_updated_at ON thesis_checks;
 CREATE TRIGGER trg_thesis_checks_updated_at
     BEFORE UPDATE ON thesis_checks
     FOR EACH ROW EXECUTE FUNCTION fn_update_timestamp();
+
+-- =====================================================
+-- Table: stat_counters
+-- =====================================================
+-- Contadores del dashboard mantenidos por triggers (fn_get_dashboard_stats los suma en vez
+-- de recorrer chat_history y feedbacks). Cada contador se reparte en STAT_COUNTER_SLOTS
+-- filas elegidas por pg_backend_pid(): las escrituras concurrentes del chat no compiten
+-- por la misma fila. fn_reconcile_stat_counters recalcula todo desde las tablas.
+CREATE TABLE IF NOT EXISTS stat_counters (
+    name   VARCHAR(64) NOT NULL,
+    slot   SMALLINT NOT NULL,
+    value  BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, slot)
+);
+
+CREATE OR REPLACE FUNCTION fn_bump_stat_counter(p_name VARCHAR, p_delta BIGINT)
+RETURNS VOID AS $$
+BEGIN
+    IF p_delta = 0 THEN RETURN; END IF;
+    INSERT INTO stat_counters AS sc (name, slot, value)
+    VALUES (p_name, pg_backend_pid() % 16, p_delta)   -- 16 = STAT_COUNTER_SLOTS
+    ON CONFLICT (name, slot) DO UPDATE SET value = sc.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_get_stat_counter(p_name VARCHAR)
+RETURNS BIGINT AS $$
+    SELECT COALESCE(SUM(value), 0)::BIGINT FROM stat_counters WHERE name = p_name;
+$$ LANGUAGE sql STABLE;
+
+-- Triggers por sentencia con tablas de transición: un ajuste por contador y sentencia.
+CREATE OR REPLACE FUNCTION fn_count_users()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM fn_bump_stat_counter('users',
+        (CASE WHEN TG_OP <> 'DELETE' THEN (SELECT COUNT(*) FROM new_rows WHERE role = 'user') ELSE 0 END)
+      - (CASE WHEN TG_OP <> 'INSERT' THEN (SELECT COUNT(*) FROM old_rows WHERE role = 'user') ELSE 0 END));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_count_insert ON users;
+CREATE TRIGGER trg_users_count_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_users();
+DROP TRIGGER IF EXISTS trg_users_count_update ON users;
+CREATE TRIGGER trg_users_count_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_users();
+DROP TRIGGER IF EXISTS trg_users_count_delete ON users;
+CREATE TRIGGER trg_users_count_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_users();
+
+CREATE OR REPLACE FUNCTION fn_count_documents()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM fn_bump_stat_counter('documents',
+        (CASE WHEN TG_OP = 'INSERT' THEN (SELECT COUNT(*) FROM new_rows) ELSE 0 END)
+      - (CASE WHEN TG_OP = 'DELETE' THEN (SELECT COUNT(*) FROM old_rows) ELSE 0 END));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_documents_count_insert ON documents;
+CREATE TRIGGER trg_documents_count_insert AFTER INSERT ON documents
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_documents();
+DROP TRIGGER IF EXISTS trg_documents_count_delete ON documents;
+CREATE TRIGGER trg_documents_count_delete AFTER DELETE ON documents
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_documents();
+
+-- categories.document_count = documentos 'completed' de la categoría, ajustado por fila
+-- (antes fn_update_category_doc_count lo recontaba en cada procesamiento o borrado).
+CREATE OR REPLACE FUNCTION fn_sync_category_doc_count()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_old_cat VARCHAR;
+    v_new_cat VARCHAR;
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.processing_status = 'completed' THEN
+        v_old_cat := OLD.category_id;
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.processing_status = 'completed' THEN
+        v_new_cat := NEW.category_id;
+    END IF;
+    IF v_old_cat IS NOT DISTINCT FROM v_new_cat THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE categories SET document_count = COALESCE(document_count, 0) - 1 WHERE id = v_old_cat;
+    UPDATE categories SET document_count = COALESCE(document_count, 0) + 1 WHERE id = v_new_cat;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_documents_category_count ON documents;
+CREATE TRIGGER trg_documents_category_count
+    AFTER INSERT OR DELETE OR UPDATE OF category_id, processing_status ON documents
+    FOR EACH ROW EXECUTE FUNCTION fn_sync_category_doc_count();
+
+-- Mensajes y conversaciones (conversation_id distintos): una conversación se cuenta al
+-- insertar su primer mensaje y se descuenta al borrar el último.
+CREATE OR REPLACE FUNCTION fn_count_chat_messages()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM fn_bump_stat_counter('messages', (SELECT COUNT(*) FROM new_rows));
+        PERFORM fn_bump_stat_counter('conversations', (
+            SELECT COUNT(DISTINCT n.conversation_id) FROM new_rows n
+            WHERE NOT EXISTS (
+                SELECT 1 FROM chat_history ch
+                WHERE ch.conversation_id = n.conversation_id
+                  AND ch.id NOT IN (SELECT id FROM new_rows)
+            )
+        ));
+    ELSE
+        PERFORM fn_bump_stat_counter('messages', -(SELECT COUNT(*) FROM old_rows));
+        PERFORM fn_bump_stat_counter('conversations', -(
+            SELECT COUNT(DISTINCT o.conversation_id) FROM old_rows o
+            WHERE NOT EXISTS (SELECT 1 FROM chat_history ch WHERE ch.conversation_id = o.conversation_id)
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_history_count_insert ON chat_history;
+CREATE TRIGGER trg_chat_history_count_insert AFTER INSERT ON chat_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_chat_messages();
+DROP TRIGGER IF EXISTS trg_chat_history_count_delete ON chat_history;
+CREATE TRIGGER trg_chat_history_count_delete AFTER DELETE ON chat_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_chat_messages();
+
+CREATE OR REPLACE FUNCTION fn_count_feedbacks()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM fn_bump_stat_counter('feedbacks',
+        (CASE WHEN TG_OP = 'INSERT' THEN (SELECT COUNT(*) FROM new_rows) ELSE 0 END)
+      - (CASE WHEN TG_OP = 'DELETE' THEN (SELECT COUNT(*) FROM old_rows) ELSE 0 END));
+    PERFORM fn_bump_stat_counter('feedbacks_positive',
+        (CASE WHEN TG_OP <> 'DELETE' THEN (SELECT COUNT(*) FROM new_rows WHERE rating = 1) ELSE 0 END)
+      - (CASE WHEN TG_OP <> 'INSERT' THEN (SELECT COUNT(*) FROM old_rows WHERE rating = 1) ELSE 0 END));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_feedbacks_count_insert ON feedbacks;
+CREATE TRIGGER trg_feedbacks_count_insert AFTER INSERT ON feedbacks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_feedbacks();
+DROP TRIGGER IF EXISTS trg_feedbacks_count_update ON feedbacks;
+CREATE TRIGGER trg_feedbacks_count_update AFTER UPDATE ON feedbacks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_feedbacks();
+DROP TRIGGER IF EXISTS trg_feedbacks_count_delete ON feedbacks;
+CREATE TRIGGER trg_feedbacks_count_delete AFTER DELETE ON feedbacks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_count_feedbacks();
+
+-- Recalcula todos los contadores (y categories.document_count) desde las tablas. El
+-- bloqueo EXCLUSIVE espera a las transacciones que ya ajustaron un contador y detiene las
+-- nuevas hasta el COMMIT, así ningún ajuste se pierde ni se cuenta dos veces.
+CREATE OR REPLACE FUNCTION fn_reconcile_stat_counters()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE stat_counters IN EXCLUSIVE MODE;
+    DELETE FROM stat_counters;
+    INSERT INTO stat_counters (name, slot, value) VALUES
+        ('users',              0, (SELECT COUNT(*) FROM users WHERE role = 'user')),
+        ('documents',          0, (SELECT COUNT(*) FROM documents)),
+        ('messages',           0, (SELECT COUNT(*) FROM chat_history)),
+        ('conversations',      0, (SELECT COUNT(DISTINCT conversation_id) FROM chat_history)),
+        ('feedbacks',          0, (SELECT COUNT(*) FROM feedbacks)),
+        ('feedbacks_positive', 0, (SELECT COUNT(*) FROM feedbacks WHERE rating = 1));
+
+    UPDATE categories c SET document_count = n.count
+    FROM (
+        SELECT c2.id, COUNT(d.id)::INTEGER AS count
+        FROM categories c2
+        LEFT JOIN documents d ON d.category_id = c2.id AND d.processing_status = 'completed'
+        GROUP BY c2.id
+    ) n
+    WHERE c.id = n.id AND c.document_count IS DISTINCT FROM n.count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Al crear la tabla se cargan los contadores una sola vez.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM stat_counters LIMIT 1) THEN
+        PERFORM fn_reconcile_stat_counters();
+    END IF;
+END $$;
+
+-- =====================================================
+-- Table: usage_events (hypertable) + rollups
+-- =====================================================
+-- Eventos de uso (mensajes y valoraciones) para las analíticas por rango. Los triggers de
+-- chat_history y feedbacks los escriben; los agregados continuos usage_hourly y
+-- usage_daily (sobre usage_hourly) se materializan de forma incremental, así las consultas
+-- por rango leen un bucket por hora/día en vez de las filas de chat_history.
+-- Usuarios y conversaciones distintos se guardan como hyperloglog (timescaledb_toolkit):
+-- rollup() combina buckets para cualquier rango y granularidad (conteo aproximado, ~2%).
+CREATE EXTENSION IF NOT EXISTS timescaledb;
+CREATE EXTENSION IF NOT EXISTS timescaledb_toolkit;
+
+CREATE TABLE IF NOT EXISTS usage_events (
+    occurred_at      TIMESTAMPTZ NOT NULL,
+    kind             VARCHAR(24) NOT NULL
+                         CHECK (kind IN ('message_user', 'message_assistant',
+                                         'feedback_positive', 'feedback_negative')),
+    user_id          VARCHAR(36),
+    conversation_id  VARCHAR(36),
+    value            SMALLINT NOT NULL DEFAULT 1
+);
+
+SELECT create_hypertable('usage_events', 'occurred_at',
+                         chunk_time_interval => INTERVAL '7 days', if_not_exists => TRUE);
+
+-- Mensajes: un evento por fila insertada (por sentencia, sin trigger por fila).
+CREATE OR REPLACE FUNCTION fn_log_message_events()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO usage_events (occurred_at, kind, user_id, conversation_id)
+    SELECT COALESCE(n.created_at, NOW()), 'message_' || n.role, n.user_id, n.conversation_id
+    FROM new_rows n;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_history_usage_events ON chat_history;
+CREATE TRIGGER trg_chat_history_usage_events AFTER INSERT ON chat_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_log_message_events();
+
+-- Valoraciones: +1 al crear, -1/+1 al cambiar de rating (upsert), -1 al borrar. Las
+-- correcciones se registran en NOW(), no en el bucket de la valoración original: las
+-- políticas solo rematerializan los últimos días, así que un evento antiguo quedaría fuera
+-- de los agregados. Cada bucket cuenta entonces los eventos de valoración ocurridos en él
+-- (netos), no las valoraciones vigentes creadas en ese periodo.
+CREATE OR REPLACE FUNCTION fn_log_feedback_events()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND (TG_OP = 'DELETE' OR OLD.rating IS DISTINCT FROM NEW.rating) THEN
+        INSERT INTO usage_events (occurred_at, kind, user_id, value)
+        VALUES (NOW(),
+                CASE WHEN OLD.rating = 1 THEN 'feedback_positive' ELSE 'feedback_negative' END,
+                OLD.user_id, -1);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD.rating IS DISTINCT FROM NEW.rating) THEN
+        INSERT INTO usage_events (occurred_at, kind, user_id, value)
+        VALUES (CASE WHEN TG_OP = 'INSERT' THEN COALESCE(NEW.created_at, NOW()) ELSE NOW() END,
+                CASE WHEN NEW.rating = 1 THEN 'feedback_positive' ELSE 'feedback_negative' END,
+                NEW.user_id, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_feedbacks_usage_events ON feedbacks;
+CREATE TRIGGER trg_feedbacks_usage_events
+    AFTER INSERT OR DELETE OR UPDATE OF rating ON feedbacks
+    FOR EACH ROW EXECUTE FUNCTION fn_log_feedback_events();
+
+-- Al crear la tabla se cargan los eventos del historial existente. Los agregados se
+-- materializan con `flask analytics refresh-rollups` (refresh_continuous_aggregate no
+-- puede ejecutarse dentro de la transacción de este script); mientras tanto, la
+-- agregación en tiempo real (materialized_only = false) calcula lo no materializado.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM usage_events LIMIT 1) THEN
+        INSERT INTO usage_events (occurred_at, kind, user_id, conversation_id)
+        SELECT ch.created_at, 'message_' || ch.role, ch.user_id, ch.conversation_id
+        FROM chat_history ch WHERE ch.created_at IS NOT NULL;
+
+        INSERT INTO usage_events (occurred_at, kind, user_id)
+        SELECT f.created_at,
+               CASE WHEN f.rating = 1 THEN 'feedback_positive' ELSE 'feedback_negative' END,
+               f.user_id
+        FROM feedbacks f WHERE f.created_at IS NOT NULL;
+    END IF;
+END $$;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS usage_hourly
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    time_bucket(INTERVAL '1 hour', occurred_at)                                 AS bucket,
+    SUM(CASE WHEN kind LIKE 'message_%' THEN value ELSE 0 END)::BIGINT          AS messages,
+    SUM(CASE WHEN kind = 'message_user' THEN value ELSE 0 END)::BIGINT          AS user_messages,
+    SUM(CASE WHEN kind = 'feedback_positive' THEN value ELSE 0 END)::BIGINT     AS feedback_positive,
+    SUM(CASE WHEN kind = 'feedback_negative' THEN value ELSE 0 END)::BIGINT     AS feedback_negative,
+    hyperloglog(256, CASE WHEN kind = 'message_user' THEN user_id END)          AS users_hll,
+    hyperloglog(256, conversation_id)                                           AS conversations_hll
+FROM usage_events
+GROUP BY 1
+WITH NO DATA;
+
+-- Días en hora de Perú (el historial anterior agrupaba por la fecha local de la sesión).
+CREATE MATERIALIZED VIEW IF NOT EXISTS usage_daily
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    time_bucket(INTERVAL '1 day', bucket, 'America/Lima')  AS bucket,
+    SUM(messages)::BIGINT                                  AS messages,
+    SUM(user_messages)::BIGINT                             AS user_messages,
+    SUM(feedback_positive)::BIGINT                         AS feedback_positive,
+    SUM(feedback_negative)::BIGINT                         AS feedback_negative,
+    rollup(users_hll)                                      AS users_hll,
+    rollup(conversations_hll)                              AS conversations_hll
+FROM usage_hourly
+GROUP BY 1
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('usage_hourly',
+    start_offset => INTERVAL '1 day', end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '30 minutes', if_not_exists => TRUE);
+
+SELECT add_continuous_aggregate_policy('usage_daily',
+    start_offset => INTERVAL '3 days', end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 hour', if_not_exists => TRUE);
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Mide la pérdida de recall@k del modo de búsqueda 'binary' (Hamming + re-ranking exacto)
+frente al modo 'hnsw' actual, ambos contra una búsqueda exacta sin índice.
+
+Usa como consultas embeddings de chunks de contenido elegidos al azar y llama directamente
+a fn_search_similar / fn_search_similar_binary con los mismos filtros que el backend.
+Requiere firmas binarias calculadas (`flask vectors backfill-bits`).
+
+Uso:
+    python scripts/bench_binary_search.py
+    python scripts/bench_binary_search.py --queries 200 --top-k 10 --oversample 2 4 10 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent.parent / '.env')
+
+DATABASE_URL = os.getenv('DATABASE_URL') or (
+    f"postgresql://{os.getenv('POSTGRES_USER', 'upao_user')}"
+    f":{os.getenv('POSTGRES_PASSWORD', 'upao_secret_2024')}"
+    f"@{os.getenv('POSTGRES_HOST', 'localhost')}"
+    f":{os.getenv('POSTGRES_PORT', '5433')}"
+    f"/{os.getenv('POSTGRES_DB', 'upao_rag')}"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recall@k: binary vs hnsw.")
+    parser.add_argument("--queries", type=int, default=100, help="Cantidad de consultas de muestra")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--oversample", type=int, nargs="+", default=[2, 4, 10, 20],
+                        help="Factores de sobremuestreo a comparar")
+    return parser.parse_args()
+
+
+def run_search(cur, fn_name, vector, k, extra=()):
+    # score_threshold -1: sin corte, solo interesa el orden
+    params = (vector, k, -1.0, '', True, None, 'content') + tuple(extra)
+    placeholders = ', '.join(['%s::vector'] + ['%s'] * (len(params) - 1))
+    start = time.perf_counter()
+    cur.execute(f"SELECT * FROM {fn_name}({placeholders})", params)
+    keys = [(r['document_id'], r['content']) for r in cur.fetchall()]
+    return keys, (time.perf_counter() - start) * 1000
+
+
+def recall(found, truth):
+    return len(set(found) & set(truth)) / len(truth) if truth else 1.0
+
+
+def main():
+    args = parse_args()
+    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("SELECT * FROM fn_get_vector_storage_stats()")
+    stats = cur.fetchone()
+    if stats['bits_rows'] == 0:
+        print("No hay firmas binarias. Ejecute `flask vectors backfill-bits`.", file=sys.stderr)
+        sys.exit(1)
+    print(f"Almacenamiento {stats['storage']}: {stats['bits_rows']} firmas, "
+          f"índice bits {stats['bits_index_bytes'] / 1024 / 1024:.1f} MB")
+
+    cur.execute(
+        "SELECT COALESCE(embedding, embedding_half::vector(768))::text AS v "
+        "FROM document_chunks WHERE chunk_type = 'content' "
+        "AND (embedding IS NOT NULL OR embedding_half IS NOT NULL) "
+        "ORDER BY random() LIMIT %s", (args.queries,)
+    )
+    queries = [r['v'] for r in cur.fetchall()]
+
+    results = {'hnsw': ([], [])}
+    for factor in args.oversample:
+        results[f'binary x{factor}'] = ([], [])
+
+    for vector in queries:
+        cur.execute("SET enable_indexscan = off")
+        truth, _ = run_search(cur, 'fn_search_similar', vector, args.top_k)
+        cur.execute("SET enable_indexscan = on")
+
+        found, ms = run_search(cur, 'fn_search_similar', vector, args.top_k)
+        results['hnsw'][0].append(ms)
+        results['hnsw'][1].append(recall(found, truth))
+
+        for factor in args.oversample:
+            found, ms = run_search(cur, 'fn_search_similar_binary', vector, args.top_k, (factor,))
+            results[f'binary x{factor}'][0].append(ms)
+            results[f'binary x{factor}'][1].append(recall(found, truth))
+
+    print(f"\n{len(queries)} consultas, top_k={args.top_k} (referencia: búsqueda exacta)")
+    print(f"  {'modo':<14} {'p50 ms':>8} {'recall@k':>9} {'pérdida':>8}")
+    base_recall = statistics.mean(results['hnsw'][1])
+    for label, (latencies, recalls) in results.items():
+        mean_recall = statistics.mean(recalls)
+        print(f"  {label:<14} {statistics.median(latencies):8.2f} {mean_recall:9.3f} "
+              f"{base_recall - mean_recall:+8.3f}")
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
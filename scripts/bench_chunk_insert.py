@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Compara el throughput (filas/s) de escritura de chunks:
+  - fila a fila:   SELECT fn_create_chunk(...) + COMMIT por chunk (ruta anterior)
+  - COPY texto:    COPY a chunk_staging con vectores como '[...]' + fn_flush_chunk_staging()
+  - COPY binario:  igual, con vectores float32 en el formato binario de pgvector (ruta actual)
+
+Crea un documento temporal con vectores aleatorios normalizados y lo elimina al terminar
+(los chunks se borran en cascada). No necesita Ollama.
+
+Uso:
+    python scripts/bench_chunk_insert.py
+    python scripts/bench_chunk_insert.py --rows 2000 --repeat 3
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import struct
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor, Json
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent.parent / '.env')
+
+DATABASE_URL = os.getenv('DATABASE_URL') or (
+    f"postgresql://{os.getenv('POSTGRES_USER', 'upao_user')}"
+    f":{os.getenv('POSTGRES_PASSWORD', 'upao_secret_2024')}"
+    f"@{os.getenv('POSTGRES_HOST', 'localhost')}"
+    f":{os.getenv('POSTGRES_PORT', '5433')}"
+    f"/{os.getenv('POSTGRES_DB', 'upao_rag')}"
+)
+
+DIM = 768
+CONTENT = "Fragmento de prueba para medir la escritura masiva de chunks. " * 12
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de escritura de chunks.")
+    parser.add_argument("--rows", type=int, default=2000, help="Chunks por corrida")
+    parser.add_argument("--repeat", type=int, default=3, help="Corridas por método")
+    return parser.parse_args()
+
+
+def random_vector(rng):
+    v = [rng.gauss(0, 1) for _ in range(DIM)]
+    norm = math.sqrt(sum(x * x for x in v))
+    return [x / norm for x in v]
+
+
+# ─── Métodos ───
+
+def insert_row_by_row(conn, doc_id, vectors):
+    cur = conn.cursor()
+    for i, vector in enumerate(vectors):
+        cur.execute(
+            "SELECT * FROM fn_create_chunk(%s, %s, %s, %s::vector, %s)",
+            (doc_id, i, CONTENT, vector, Json({'page': 1, 'title': 'bench'})),
+        )
+        conn.commit()
+    cur.close()
+
+
+def insert_copy(conn, doc_id, vectors):
+    meta = json.dumps({'page': 1, 'title': 'bench'})
+    buf = io.StringIO()
+    for i, vector in enumerate(vectors):
+        literal = '[' + ','.join(repr(x) for x in vector) + ']'
+        buf.write(f"{doc_id}\t{i}\t{CONTENT}\t{literal}\t{meta}\tcontent\n")
+    buf.seek(0)
+
+    cur = conn.cursor()
+    cur.execute("SELECT fn_prepare_chunk_staging()")
+    cur.copy_expert(
+        "COPY chunk_staging (document_id, chunk_index, content, embedding, metadata_json, chunk_type) "
+        "FROM STDIN", buf,
+    )
+    cur.execute("SELECT fn_flush_chunk_staging()")
+    conn.commit()
+    cur.close()
+
+
+def insert_copy_binary(conn, doc_id, vectors):
+    meta = b'\x01' + json.dumps({'page': 1, 'title': 'bench'}).encode('utf-8')
+    content = CONTENT.encode('utf-8')
+    doc = doc_id.encode('utf-8')
+    matrix = np.ascontiguousarray(vectors, dtype='>f4')
+    vector_header = struct.pack('>HH', DIM, 0)
+
+    def field(data):
+        return struct.pack('>i', len(data)) + data
+
+    buf = io.BytesIO()
+    buf.write(b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0))
+    for i, row in enumerate(matrix):
+        buf.write(struct.pack('>h', 6))
+        buf.write(field(doc) + field(struct.pack('>i', i)) + field(content)
+                  + field(vector_header + row.tobytes()) + field(meta) + field(b'content'))
+    buf.write(struct.pack('>h', -1))
+    buf.seek(0)
+
+    cur = conn.cursor()
+    cur.execute("SELECT fn_prepare_chunk_staging()")
+    cur.copy_expert(
+        "COPY chunk_staging (document_id, chunk_index, content, embedding, metadata_json, chunk_type) "
+        "FROM STDIN WITH (FORMAT binary)", buf,
+    )
+    cur.execute("SELECT fn_flush_chunk_staging()")
+    conn.commit()
+    cur.close()
+
+
+def main():
+    args = parse_args()
+    try:
+        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    except psycopg2.OperationalError as e:
+        print(f"Error de conexión: {e}", file=sys.stderr)
+        sys.exit(1)
+    cur = conn.cursor()
+
+    cur.execute("SELECT id FROM users ORDER BY created_at LIMIT 1")
+    user = cur.fetchone()
+    if not user:
+        print("Se necesita al menos un usuario (python scripts/seed_admin.py).", file=sys.stderr)
+        sys.exit(1)
+
+    cur.execute(
+        "SELECT id FROM fn_create_document(%s, %s, %s, %s, %s, %s, %s)",
+        ('bench_chunk_insert', 'bench.txt', '/dev/null', 'txt', 0, '', user['id']),
+    )
+    doc_id = cur.fetchone()['id']
+    conn.commit()
+
+    rng = random.Random(42)
+    vectors = [random_vector(rng) for _ in range(args.rows)]
+    methods = [
+        ('fila a fila', insert_row_by_row),
+        ('COPY texto', insert_copy),
+        ('COPY binario', insert_copy_binary),
+    ]
+
+    try:
+        print(f"{args.rows} chunks x {args.repeat} corridas\n")
+        print(f"  {'método':<14} {'mejor s':>8} {'filas/s':>10}")
+        baseline = None
+        for label, fn in methods:
+            best = float('inf')
+            for _ in range(args.repeat):
+                cur.execute("DELETE FROM document_chunks WHERE document_id = %s", (doc_id,))
+                conn.commit()
+                start = time.perf_counter()
+                fn(conn, doc_id, vectors)
+                best = min(best, time.perf_counter() - start)
+            rate = args.rows / best
+            baseline = baseline or rate
+            print(f"  {label:<14} {best:8.2f} {rate:10.0f}  (x{rate / baseline:.1f})")
+    finally:
+        cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
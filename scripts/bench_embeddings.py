@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Benchmark de batching de embeddings: embeddings/seg para distintos presupuestos de tokens.
+
+Levanta un servidor local que imita POST /api/embed de Ollama (latencia = overhead por
+request + costo por token, procesamiento serializado como un único modelo cargado, y
+error 500 si el batch supera --server-max-tokens) y mide EmbeddingBatcher con:
+  - batch fijo de 32 textos (comportamiento anterior)
+  - presupuestos fijos de tokens (--budgets)
+  - presupuesto adaptativo por latencia
+
+Uso:
+    python scripts/bench_embeddings.py
+    python scripts/bench_embeddings.py --texts 3000 --budgets 1024 4096 16384
+    python scripts/bench_embeddings.py --url http://localhost:11434 --model nomic-embed-text
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from app.rag.batcher import EmbeddingBatcher, estimate_tokens  # noqa: E402
+
+
+# ─── CLI ──────────────────────────────────────────────────────────────────────
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de batching de embeddings.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--texts", type=int, default=2000, help="Cantidad de textos a embeber")
+    parser.add_argument("--short-ratio", type=float, default=0.5,
+                        help="Proporción de textos cortos (filas de Excel) vs chunks largos")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[1024, 4096, 8192, 16384],
+                        help="Presupuestos de tokens fijos a comparar")
+    parser.add_argument("--target-latency", type=float, default=1.0,
+                        help="Latencia objetivo por batch del modo adaptativo (s)")
+    parser.add_argument("--url", default=None,
+                        help="Ollama real; si se omite se usa el servidor simulado")
+    parser.add_argument("--model", default="nomic-embed-text")
+
+    sim = parser.add_argument_group("servidor simulado")
+    sim.add_argument("--server-overhead-ms", type=float, default=60.0, help="Costo fijo por request")
+    sim.add_argument("--server-token-us", type=float, default=40.0, help="Costo por token (µs)")
+    sim.add_argument("--server-max-tokens", type=int, default=12000,
+                     help="Tokens por request a partir de los cuales el servidor falla")
+    sim.add_argument("--dim", type=int, default=768)
+    return parser.parse_args()
+
+
+# ─── Servidor simulado ────────────────────────────────────────────────────────
+def start_stand_in_server(args):
+    compute_lock = threading.Lock()   # un único modelo: los requests se procesan en serie
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            inputs = body.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            tokens = sum(estimate_tokens(t) for t in inputs)
+
+            if tokens > args.server_max_tokens:
+                time.sleep(args.server_overhead_ms / 1000)
+                self.send_response(500)
+                self.end_headers()
+                self.wfile.write(b'{"error": "context deadline exceeded"}')
+                return
+
+            with compute_lock:
+                time.sleep(args.server_overhead_ms / 1000 + tokens * args.server_token_us / 1e6)
+
+            payload = json.dumps({'embeddings': [_fake_vector(t, args.dim) for t in inputs]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *_):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def _fake_vector(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dim)]
+
+
+# ─── Cliente ──────────────────────────────────────────────────────────────────
+def make_embed_fn(url, model):
+    def embed(texts):
+        req = urllib.request.Request(
+            f'{url}/api/embed',
+            data=json.dumps({'model': model, 'input': texts}).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            return json.loads(resp.read())['embeddings']
+    return embed
+
+
+def build_corpus(n, short_ratio, seed=42):
+    rng = random.Random(seed)
+    words = ('reglamento matricula creditos semestre docente evaluacion tesis '
+             'facultad escuela curso nota promedio requisito articulo').split()
+    corpus = []
+    for _ in range(n):
+        size = rng.randint(6, 15) if rng.random() < short_ratio else rng.randint(120, 180)
+        corpus.append(' '.join(rng.choice(words) for _ in range(size)))
+    return corpus
+
+
+# ─── Ejecución ────────────────────────────────────────────────────────────────
+def run_case(label, batcher, corpus):
+    calls = {'batches': 0, 'failures': 0}
+    inner = batcher.embed_fn
+
+    def counting(texts):
+        calls['batches'] += 1
+        try:
+            return inner(texts)
+        except Exception:
+            calls['failures'] += 1
+            raise
+
+    batcher.embed_fn = counting
+    start = time.perf_counter()
+    vectors = batcher.embed_all(corpus)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(corpus)
+    return {
+        'modo': label,
+        'requests': calls['batches'],
+        'fallidos': calls['failures'],
+        'segundos': f'{elapsed:.2f}',
+        'emb/s': f'{len(corpus) / elapsed:.1f}',
+        'budget_final': batcher.token_budget,
+    }
+
+
+def print_rows(rows):
+    cols = list(rows[0].keys())
+    widths = {c: max(len(c), max(len(str(r[c])) for r in rows)) for c in cols}
+    sep = "+-" + "-+-".join("-" * widths[c] for c in cols) + "-+"
+    print(sep)
+    print("| " + " | ".join(c.ljust(widths[c]) for c in cols) + " |")
+    print(sep)
+    for r in rows:
+        print("| " + " | ".join(str(r[c]).ljust(widths[c]) for c in cols) + " |")
+    print(sep)
+
+
+def run():
+    args = parse_args()
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_stand_in_server(args)
+        print(f"Servidor simulado en {url}")
+
+    embed_fn = make_embed_fn(url, args.model)
+    corpus = build_corpus(args.texts, args.short_ratio)
+    total_tokens = sum(estimate_tokens(t) for t in corpus)
+    print(f"{len(corpus)} textos, ~{total_tokens} tokens\n")
+
+    cases = [('fijo 32 textos', EmbeddingBatcher(embed_fn, token_budget=10 ** 9, max_batch=32,
+                                                 adaptive=False))]
+    for budget in args.budgets:
+        cases.append((f'fijo {budget} tok', EmbeddingBatcher(embed_fn, token_budget=budget,
+                                                             max_batch=10 ** 6, adaptive=False)))
+    cases.append(('adaptativo', EmbeddingBatcher(embed_fn, token_budget=args.budgets[0],
+                                                 max_batch=10 ** 6,
+                                                 target_latency=args.target_latency)))
+
+    rows = []
+    for label, batcher in cases:
+        try:
+            rows.append(run_case(label, batcher, corpus))
+        except Exception as e:
+            rows.append({'modo': label, 'requests': '-', 'fallidos': '-', 'segundos': '-',
+                         'emb/s': f'ERROR: {e}', 'budget_final': '-'})
+    print_rows(rows)
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Compara recall y latencia de búsqueda float32 (vector) vs halfvec sobre el mismo corpus.
+
+Requiere que ambas columnas estén pobladas, es decir, ejecutarlo después del backfill de
+`flask vectors migrate-halfvec` y antes de usar --drop-float32. Usa como consultas los
+embeddings de chunks de contenido elegidos al azar y como verdad de referencia un escaneo
+exacto (sin índice) sobre la columna float32.
+
+Uso:
+    python scripts/bench_halfvec.py
+    python scripts/bench_halfvec.py --queries 200 --top-k 10 --ef-search 100
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent.parent / '.env')
+
+DATABASE_URL = os.getenv('DATABASE_URL') or (
+    f"postgresql://{os.getenv('POSTGRES_USER', 'upao_user')}"
+    f":{os.getenv('POSTGRES_PASSWORD', 'upao_secret_2024')}"
+    f"@{os.getenv('POSTGRES_HOST', 'localhost')}"
+    f":{os.getenv('POSTGRES_PORT', '5433')}"
+    f"/{os.getenv('POSTGRES_DB', 'upao_rag')}"
+)
+
+SEARCH_SQL = """
+    SELECT dc.id FROM document_chunks dc
+    WHERE dc.chunk_type = 'content' AND dc.{col} IS NOT NULL
+    ORDER BY dc.{col} <=> %s::{typ}
+    LIMIT %s
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark float32 vs halfvec.")
+    parser.add_argument("--queries", type=int, default=100, help="Cantidad de consultas de muestra")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, default=40, help="hnsw.ef_search para ambos índices")
+    return parser.parse_args()
+
+
+def timed_search(cur, col, typ, vector, k):
+    start = time.perf_counter()
+    cur.execute(SEARCH_SQL.format(col=col, typ=typ), (vector, k))
+    ids = [r['id'] for r in cur.fetchall()]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def summarize(label, latencies, recalls):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    recall = f"{statistics.mean(recalls):.3f}" if recalls else "1.000 (referencia)"
+    print(f"  {label:<22} p50={statistics.median(latencies):7.2f} ms  p95={p95:7.2f} ms  recall={recall}")
+
+
+def main():
+    args = parse_args()
+    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("SELECT * FROM fn_get_vector_storage_stats()")
+    stats = cur.fetchone()
+    print("Almacenamiento:")
+    for key, value in stats.items():
+        if key.endswith('bytes'):
+            value = f"{value / 1024 / 1024:.1f} MB"
+        print(f"  {key}: {value}")
+
+    if not stats['float32_rows'] or stats['halfvec_rows'] < stats['float32_rows']:
+        print("\nAmbas columnas deben estar pobladas (ejecute el backfill de migrate-halfvec).",
+              file=sys.stderr)
+        sys.exit(1)
+
+    cur.execute(
+        "SELECT embedding::text AS v FROM document_chunks "
+        "WHERE chunk_type = 'content' AND embedding IS NOT NULL "
+        "ORDER BY random() LIMIT %s", (args.queries,)
+    )
+    queries = [r['v'] for r in cur.fetchall()]
+    cur.execute("SET hnsw.ef_search = %s", (args.ef_search,))
+
+    exact_lat, f32_lat, half_lat = [], [], []
+    f32_recall, half_recall = [], []
+    for vector in queries:
+        cur.execute("SET enable_indexscan = off")
+        truth, ms = timed_search(cur, 'embedding', 'vector(768)', vector, args.top_k)
+        exact_lat.append(ms)
+        cur.execute("SET enable_indexscan = on")
+
+        ids, ms = timed_search(cur, 'embedding', 'vector(768)', vector, args.top_k)
+        f32_lat.append(ms)
+        f32_recall.append(len(set(ids) & set(truth)) / len(truth))
+
+        ids, ms = timed_search(cur, 'embedding_half', 'halfvec(768)', vector, args.top_k)
+        half_lat.append(ms)
+        half_recall.append(len(set(ids) & set(truth)) / len(truth))
+
+    print(f"\n{len(queries)} consultas, top_k={args.top_k}, ef_search={args.ef_search}:")
+    summarize("exacto float32", exact_lat, [])
+    summarize("HNSW float32", f32_lat, f32_recall)
+    summarize("HNSW halfvec", half_lat, half_recall)
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
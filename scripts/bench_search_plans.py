@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Benchmark de regresión de fn_search_similar: planes (EXPLAIN ANALYZE) y latencias de la
+consulta anterior (umbral en WHERE, distancia calculada 3 veces, sin iterative scan) frente
+a la actual (distancia una vez, umbral después del LIMIT, hnsw.iterative_scan, filtros
+desnormalizados con índice HNSW parcial) con 100k y 1M chunks y filtros de distinta selectividad.
+
+Genera un corpus sintético (vectores aleatorios normalizados, 500 chunks por documento,
+50 categorías, una de ellas excluida del RAG) a través de chunk_staging, de modo que las
+columnas derivadas coinciden con la ingesta real. Ejecutar contra una base de pruebas:
+con 1M chunks la carga y el mantenimiento del índice HNSW toman bastante tiempo.
+
+Uso:
+    python scripts/bench_search_plans.py
+    python scripts/bench_search_plans.py --sizes 100000 --queries 30 --ef-search 200
+    python scripts/bench_search_plans.py --cleanup      # borra el corpus sintético
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent.parent / '.env')
+
+DATABASE_URL = os.getenv('DATABASE_URL') or (
+    f"postgresql://{os.getenv('POSTGRES_USER', 'upao_user')}"
+    f":{os.getenv('POSTGRES_PASSWORD', 'upao_secret_2024')}"
+    f"@{os.getenv('POSTGRES_HOST', 'localhost')}"
+    f":{os.getenv('POSTGRES_PORT', '5433')}"
+    f"/{os.getenv('POSTGRES_DB', 'upao_rag')}"
+)
+
+BENCH_PREFIX = 'bench-search'
+CHUNKS_PER_DOC = 500
+CATEGORIES = 50
+LOAD_BATCH_DOCS = 20
+
+# Consulta de fn_search_similar antes del rediseño
+LEGACY_SQL = """
+    SELECT dc.content, dc.document_id, d.title,
+           COALESCE((dc.metadata_json->>'page')::INTEGER, 1) AS page,
+           (1 - (dc.{col} <=> %(q)s::{typ}))::FLOAT AS score,
+           COALESCE(d.category_id, '')::VARCHAR AS category_id
+    FROM document_chunks dc
+    JOIN documents d ON d.id = dc.document_id
+    LEFT JOIN categories c ON c.id = d.category_id
+    WHERE dc.generation = d.active_generation
+      AND dc.{col} IS NOT NULL
+      AND dc.chunk_type = 'content'
+      AND (%(cat)s = '' OR d.category_id = %(cat)s)
+      AND (%(docs)s::VARCHAR[] IS NULL OR d.id = ANY(%(docs)s::VARCHAR[]))
+      AND (d.category_id IS NULL OR NOT COALESCE(c.exclude_from_rag, FALSE))
+      AND (1 - (dc.{col} <=> %(q)s::{typ})) >= %(thr)s
+    ORDER BY dc.{col} <=> %(q)s::{typ}
+    LIMIT %(k)s
+"""
+
+# Misma consulta que ejecuta fn_search_similar ahora
+CURRENT_SQL = """
+    SELECT hits.content, hits.document_id, d.title, hits.page,
+           (1 - hits.distance)::FLOAT AS score, COALESCE(hits.category_id, '') AS category_id
+    FROM (
+        SELECT dc.content, dc.document_id, dc.page, dc.category_id,
+               dc.{col} <=> %(q)s::{typ} AS distance
+        FROM document_chunks dc
+        WHERE dc.chunk_type = 'content'
+          AND dc.searchable AND NOT dc.rag_excluded
+          AND (%(cat)s = '' OR dc.category_id = %(cat)s)
+          AND (%(docs)s::VARCHAR[] IS NULL OR dc.document_id = ANY(%(docs)s::VARCHAR[]))
+        ORDER BY distance
+        LIMIT %(k)s
+    ) hits
+    JOIN documents d ON d.id = hits.document_id
+    WHERE hits.distance <= 1 - %(thr)s
+    ORDER BY hits.distance
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Planes y latencias de fn_search_similar.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000],
+                        help="Tamaños de corpus (chunks sintéticos)")
+    parser.add_argument("--queries", type=int, default=50, help="Consultas por escenario")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.35)
+    parser.add_argument("--ef-search", type=int, default=100)
+    parser.add_argument("--cleanup", action="store_true", help="Borrar el corpus sintético y salir")
+    return parser.parse_args()
+
+
+# ─── Corpus sintético ───
+
+def ensure_categories(cur):
+    for i in range(CATEGORIES):
+        cur.execute(
+            "INSERT INTO categories (name, slug, exclude_from_rag) VALUES (%s, %s, %s) "
+            "ON CONFLICT (slug) DO NOTHING",
+            (f'{BENCH_PREFIX} {i}', f'{BENCH_PREFIX}-{i}', i == CATEGORIES - 1),
+        )
+    cur.execute("SELECT id FROM categories WHERE slug LIKE %s ORDER BY slug", (f'{BENCH_PREFIX}-%',))
+    return [r['id'] for r in cur.fetchall()]
+
+
+def bench_chunk_count(cur):
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM document_chunks dc JOIN documents d ON d.id = dc.document_id "
+        "WHERE d.original_filename = %s", (f'{BENCH_PREFIX}.txt',)
+    )
+    return cur.fetchone()['n']
+
+
+def grow_corpus(conn, cur, target, category_ids, user_id):
+    current = bench_chunk_count(cur)
+    docs_needed = max(0, -(-(target - current) // CHUNKS_PER_DOC))
+    if not docs_needed:
+        return
+    print(f"Cargando {docs_needed * CHUNKS_PER_DOC} chunks sintéticos (corpus actual: {current})...")
+    start = time.perf_counter()
+    created = 0
+    while created < docs_needed:
+        batch = min(LOAD_BATCH_DOCS, docs_needed - created)
+        cur.execute("SELECT fn_prepare_chunk_staging()")
+        for _ in range(batch):
+            category_id = category_ids[(current // CHUNKS_PER_DOC + created) % len(category_ids)]
+            cur.execute(
+                "INSERT INTO documents (title, original_filename, file_path, file_type, category_id, "
+                "uploaded_by, processing_status, active_generation) "
+                "VALUES (%s, %s, '/dev/null', 'txt', %s, %s, 'completed', 1) RETURNING id, title",
+                (f'{BENCH_PREFIX} doc', f'{BENCH_PREFIX}.txt', category_id, user_id),
+            )
+            doc = cur.fetchone()
+            cur.execute("""
+                INSERT INTO chunk_staging (document_id, chunk_index, content, embedding,
+                                           metadata_json, chunk_type, generation)
+                SELECT %(doc)s, g.i, 'chunk sintetico ' || g.i, v.vec,
+                       jsonb_build_object('page', g.i / 10 + 1, 'title', %(title)s), 'content', 1
+                FROM generate_series(0, %(n)s - 1) AS g(i)
+                CROSS JOIN LATERAL (
+                    SELECT l2_normalize(array_agg(random() - 0.5)::vector(768)) AS vec
+                    FROM generate_series(1, 768) WHERE g.i >= 0
+                ) v
+            """, {'doc': doc['id'], 'title': doc['title'], 'n': CHUNKS_PER_DOC})
+            created += 1
+        cur.execute("SELECT fn_flush_chunk_staging()")
+        conn.commit()
+        print(f"  {(current // CHUNKS_PER_DOC + created) * CHUNKS_PER_DOC} chunks", end='\r')
+    cur.execute("ANALYZE document_chunks")
+    conn.commit()
+    print(f"\nCarga completada en {time.perf_counter() - start:.0f} s")
+
+
+def cleanup(conn, cur):
+    cur.execute("DELETE FROM documents WHERE original_filename = %s", (f'{BENCH_PREFIX}.txt',))
+    docs = cur.rowcount
+    cur.execute("DELETE FROM categories WHERE slug LIKE %s", (f'{BENCH_PREFIX}-%',))
+    conn.commit()
+    print(f"Corpus sintético eliminado ({docs} documentos).")
+
+
+# ─── Medición ───
+
+def run(conn, cur, sql, params, legacy, ef_search, explain=False):
+    cur.execute("SET LOCAL hnsw.iterative_scan = %s", ('off' if legacy else 'relaxed_order',))
+    cur.execute("SET LOCAL hnsw.ef_search = %s", (40 if legacy else ef_search,))
+    prefix = "EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) " if explain else ""
+    start = time.perf_counter()
+    cur.execute(prefix + sql, params)
+    rows = cur.fetchall()
+    elapsed = (time.perf_counter() - start) * 1000
+    conn.rollback()
+    return rows, elapsed
+
+
+def scenarios(cur, category_ids):
+    cur.execute(
+        "SELECT id FROM documents WHERE original_filename = %s ORDER BY random() LIMIT 5",
+        (f'{BENCH_PREFIX}.txt',),
+    )
+    doc_ids = [r['id'] for r in cur.fetchall()]
+    return [
+        ('sin filtro', '', None),
+        (f'1 categoría (~{100 // CATEGORIES}%)', category_ids[0], None),
+        ('5 documentos', '', doc_ids),
+    ]
+
+
+def main():
+    args = parse_args()
+    try:
+        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    except psycopg2.OperationalError as e:
+        print(f"Error de conexión: {e}", file=sys.stderr)
+        sys.exit(1)
+    cur = conn.cursor()
+
+    if args.cleanup:
+        cleanup(conn, cur)
+        return
+
+    cur.execute("SELECT id FROM users ORDER BY created_at LIMIT 1")
+    user = cur.fetchone()
+    if not user:
+        print("Se necesita al menos un usuario (python scripts/seed_admin.py).", file=sys.stderr)
+        sys.exit(1)
+
+    cur.execute("SELECT fn_get_vector_storage() AS storage")
+    halfvec = cur.fetchone()['storage'] == 'halfvec'
+    col, typ = ('embedding_half', 'halfvec(768)') if halfvec else ('embedding', 'vector(768)')
+    legacy_sql = LEGACY_SQL.format(col=col, typ=typ)
+    current_sql = CURRENT_SQL.format(col=col, typ=typ)
+
+    category_ids = ensure_categories(cur)
+    conn.commit()
+
+    for size in sorted(args.sizes):
+        grow_corpus(conn, cur, size, category_ids, user['id'])
+        cur.execute(
+            f"SELECT dc.{col}::text AS q FROM document_chunks dc JOIN documents d ON d.id = dc.document_id "
+            f"WHERE d.original_filename = %s ORDER BY random() LIMIT %s",
+            (f'{BENCH_PREFIX}.txt', args.queries),
+        )
+        queries = [r['q'] for r in cur.fetchall()]
+        conn.rollback()
+
+        print(f"\n═══ {bench_chunk_count(cur)} chunks sintéticos, top_k={args.top_k}, "
+              f"threshold={args.threshold}, ef_search={args.ef_search} ═══")
+        for label, cat, docs in scenarios(cur, category_ids):
+            print(f"\n── {label} ──")
+            for name, sql, legacy in (('anterior', legacy_sql, True), ('actual', current_sql, False)):
+                base = {'cat': cat, 'docs': docs, 'thr': args.threshold, 'k': args.top_k}
+                latencies, counts = [], []
+                for q in queries:
+                    rows, ms = run(conn, cur, sql, dict(base, q=q), legacy, args.ef_search)
+                    latencies.append(ms)
+                    counts.append(len(rows))
+                latencies.sort()
+                p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+                print(f"  {name:<9} p50={statistics.median(latencies):8.2f} ms  p95={p95:8.2f} ms  "
+                      f"filas promedio={statistics.mean(counts):5.1f}/{args.top_k}")
+
+                plan, _ = run(conn, cur, sql, dict(base, q=queries[0]), legacy, args.ef_search, explain=True)
+                for line in plan:
+                    print(f"      {line['QUERY PLAN']}")
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()